@@ -13,8 +13,9 @@ const int chargeRelay = 26;  // Relay for charging
 const int dischargeRelay = 27; // Relay for discharging
 
 // Actuation Variables
-int chargeStart = -1, chargeDuration = 0;
-int dischargeStart = -1, dischargeDuration = 0;
+// Hours; fractional when the server runs at sub-hourly resolution (e.g. 6.25 = 06:15)
+float chargeStart = -1, chargeDuration = 0;
+float dischargeStart = -1, dischargeDuration = 0;
 bool dataReceivedFlag = false;  // Flag to check if we have received initial data
 
 void setup() {
@@ -88,11 +89,11 @@ void receiveData() {
         Serial.println("Received Data: " + receivedData);
 
         // Parse received data
-        int parsed = sscanf(receivedData.c_str(), "%d,%d,%d,%d", &chargeStart, &chargeDuration, &dischargeStart, &dischargeDuration);
+        int parsed = sscanf(receivedData.c_str(), "%f,%f,%f,%f", &chargeStart, &chargeDuration, &dischargeStart, &dischargeDuration);
 
         if (parsed == 4) {
-            Serial.printf("Charging Start: %d, Duration: %d hours\n", chargeStart, chargeDuration);
-            Serial.printf("Discharging Start: %d, Duration: %d hours\n", dischargeStart, dischargeDuration);
+            Serial.printf("Charging Start: %g, Duration: %g hours\n", chargeStart, chargeDuration);
+            Serial.printf("Discharging Start: %g, Duration: %g hours\n", dischargeStart, dischargeDuration);
 
             client.print("ACK\n");  // Send acknowledgment
             Serial.println("Acknowledgment sent to Python.");
@@ -108,36 +109,43 @@ void receiveData() {
     }
 }
 
+// True if `minute` of the day falls in the window starting at `start` hours for `duration` hours
+bool inWindow(int minute, float start, float duration) {
+    long startMinute = lroundf(start * 60);
+    long endMinute = startMinute + lroundf(duration * 60);
+    return minute >= startMinute && minute < endMinute;
+}
+
 // Function to execute 72-hour cycle
 void executeCycle() {
     Serial.println("🔄 Starting 72-hour execution...");
 
-    for (int hour = 0; hour < 72; hour++) {
-        Serial.print("⏳ Hour: "); Serial.println(hour % 24); // Show time in 24-hour format
-
-        // Check Charging Period
-        if ((hour % 24) >= chargeStart && (hour % 24) < chargeStart + chargeDuration) {
-            digitalWrite(chargeRelay, HIGH);
-            Serial.println("⚡ Battery is CHARGING...");
-        } else {
-            digitalWrite(chargeRelay, LOW);
-        }
+    // Step minute by minute so sub-hour starts (e.g. 6.25 = 06:15) and short windows are honoured
+    int lastState = -1;
+    for (int step = 0; step < 72 * 60; step++) {
+        int minute = step % (24 * 60);
+        bool charging = inWindow(minute, chargeStart, chargeDuration);
+        bool discharging = inWindow(minute, dischargeStart, dischargeDuration);
 
-        // Check Discharging Period
-        if ((hour % 24) >= dischargeStart && (hour % 24) < dischargeStart + dischargeDuration) {
-            digitalWrite(dischargeRelay, HIGH);
-            Serial.println("🔋 Battery is DISCHARGING...");
-        } else {
-            digitalWrite(dischargeRelay, LOW);
+        if (minute % 60 == 0) {
+            Serial.print("⏳ Hour: "); Serial.println(minute / 60); // Show time in 24-hour format
         }
 
-        // If neither charging nor discharging, battery is idle
-        if (!((hour % 24) >= chargeStart && (hour % 24) < chargeStart + chargeDuration) &&
-            !((hour % 24) >= dischargeStart && (hour % 24) < dischargeStart + dischargeDuration)) {
-            Serial.println("🛑 Battery is IDLE.");
+        // Check Charging / Discharging Period
+        digitalWrite(chargeRelay, charging ? HIGH : LOW);
+        digitalWrite(dischargeRelay, discharging ? HIGH : LOW);
+
+        // Report only when the battery changes state
+        int state = (charging ? 1 : 0) | (discharging ? 2 : 0);
+        if (state != lastState) {
+            Serial.printf("%02d:%02d\n", minute / 60, minute % 60);
+            if (charging) Serial.println("⚡ Battery is CHARGING...");
+            if (discharging) Serial.println("🔋 Battery is DISCHARGING...");
+            if (!charging && !discharging) Serial.println("🛑 Battery is IDLE.");  // If neither charging nor discharging, battery is idle
+            lastState = state;
         }
 
-        delay(30000);  // Simulate each hour as 1 second (for testing)
+        delay(500);  // Simulate each hour as 30 seconds (for testing)
     }
 
     Serial.println("✅ 72-hour cycle complete. Waiting for new data...");
@@ -1,15 +1,23 @@
-import pandas as pd
-import numpy as np
-import socket
 import time
-import firebase_admin
-from firebase_admin import credentials, db
-from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import StandardScaler
-from sklearn.impute import SimpleImputer
-from sklearn.neighbors import NearestNeighbors
+PROCESS_STARTED = time.perf_counter()  # Reference point for the time-to-first-plan budget
+
+import numpy as np
+import hashlib
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import os
 from dotenv import load_dotenv
+from history_store import HistoryStore, default_store_path
+from clustering import CLUSTER_BACKEND, cluster_days, demand_profiles
+from forecaster import HourlyForecaster, FORECAST_STATE_PATH, format_forecast
+from battery_sim import BatteryParams
+from dispatch_optimizer import optimal_schedule
+from tariff_engine import TariffEngine, TARIFF_PLAN
+from resolution import READINGS_PER_DAY, as_hours, best_window, downsample
+from esp32_dispatch import Esp32Dispatcher, summarize
+from storage import open_storage
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -18,128 +26,526 @@ load_dotenv()
 FIREBASE_CREDENTIALS_PATH = os.getenv('FIREBASE_CREDENTIALS_PATH_PRANA')
 DATABASE_URL = os.getenv('FIREBASE_DATABASE_URL')
 
-# Initialize Firebase (if not already initialized)
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CREDENTIALS_PATH)
-    firebase_admin.initialize_app(cred, {"databaseURL": DATABASE_URL})
+# Initialize storage (Firebase unless STORAGE_BACKEND says otherwise)
+storage = open_storage(FIREBASE_CREDENTIALS_PATH, DATABASE_URL)
+
+# 📈 Per-stage timings on /metrics (off unless ML_METRICS_PORT or METRICS_LOG_PATH is set)
+ML_METRICS_PORT = os.getenv('ML_METRICS_PORT')
+ML_STARTUP_BUDGET = float(os.getenv('ML_STARTUP_BUDGET', 5.0))  # Seconds from launch to the first plan
+first_plan_reported = False
+
+def report_first_plan():
+    """Log time-to-first-plan once per process (before dispatch, which depends on the controllers)."""
+    global first_plan_reported
+    if first_plan_reported:
+        return
+    first_plan_reported = True
+    startup = time.perf_counter() - PROCESS_STARTED
+    print(f"⏱️ Time to first plan: {startup:.2f}s", flush=True)
+    metrics.gauge("startup_seconds", startup)
+    if startup > ML_STARTUP_BUDGET:
+        print(f"⚠️ First plan took {startup:.2f}s, over the {ML_STARTUP_BUDGET:g}s budget", flush=True)
 
 # 🔌 ESP32 Configuration
 ESP32_IP = os.getenv('ESP32_IP')  # Update with actual ESP32 IP
 ESP32_PORT = int(os.getenv('ESP32_SERVER_PORT', 6000))
 file_path = os.getenv('CSV_FILE_PATH')
 
-def process_ml_model():
-    print("\n===== Running ML Model =====", flush=True)
+# 📦 Binary history written by the data server (falls back to the CSV if missing)
+HISTORY_STORE_PATH = os.getenv('HISTORY_STORE_PATH') or (default_store_path(file_path) if file_path else None)
+MAX_LOCAL_ROWS = int(os.getenv('MAX_LOCAL_ROWS', 300))
+history_store = None
 
-    # --- Load Dataset ---
-    dataset = pd.read_csv(file_path)
+def load_history():
+    """Return the day x hour matrix: a zero-copy view of the binary store, or the parsed CSV."""
+    global history_store
+    if HISTORY_STORE_PATH and os.path.exists(HISTORY_STORE_PATH):
+        if history_store is None:
+            history_store = HistoryStore(HISTORY_STORE_PATH, MAX_LOCAL_ROWS, READINGS_PER_DAY)
+        return history_store.values()
+    return read_csv_history(file_path)
+
+def history_position():
+    """(days ever appended, ring capacity) of the history load_history() returned; a CSV never wraps."""
+    if history_store is not None and HISTORY_STORE_PATH and os.path.exists(HISTORY_STORE_PATH):
+        return history_store.total_days, history_store.capacity
+    return None, None
+
+def read_csv_history(path):
+    """Parse a `Day,Hour_0..Hour_23` (or `Slot_0..`) CSV into a numeric matrix."""
+    import pandas as pd  # Only the CSV fallback needs pandas
+    dataset = pd.read_csv(path)
 
     # Convert all non-numeric values to NaN and fill them with mean
     dataset.iloc[:, 1:] = dataset.iloc[:, 1:].apply(pd.to_numeric, errors='coerce')
+    return dataset.iloc[:, 1:].values
+
+# 💾 Fitted state cached across cycles and restarts
+ML_STATE_PATH = os.getenv('ML_STATE_PATH', 'ml_state.joblib')
+
+def digest_rows(X):
+    """Content hash of a block of rows."""
+    return hashlib.sha1(np.ascontiguousarray(X, dtype=np.float64).tobytes()).hexdigest()
+
+def load_ml_state():
+    """Load the cached fit from disk, or None if there is no usable cache."""
+    if not os.path.exists(ML_STATE_PATH):
+        return None
+    try:
+        import joblib
+        return joblib.load(ML_STATE_PATH)
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable ML state cache: {e}", flush=True)
+        return None
+
+def save_ml_state(state):
+    try:
+        import joblib
+        joblib.dump(state, ML_STATE_PATH)
+    except Exception as e:
+        print(f"⚠️ Could not save ML state cache: {e}", flush=True)
+
+# 🔎 Days are clustered on a coarse view; windows are still searched at full resolution
+CLUSTER_SLOTS = int(os.getenv('CLUSTER_SLOTS', 24))
 
-    # Handle Missing Values
-    imputer = SimpleImputer(strategy="mean")
-    X = dataset.iloc[:, 1:].values
-    X = imputer.fit_transform(X)
+def cluster_view(X):
+    """Days x CLUSTER_SLOTS averages that the imputer, scaler and clustering work on (X itself at hourly resolution)."""
+    return downsample(X, CLUSTER_SLOTS)
 
-    # Normalize Data (Standardization)
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+def fill_gaps(X):
+    """Full-resolution days with missing readings replaced by that slot's mean."""
+    X = np.array(X, dtype=np.float64)
+    missing = np.isnan(X)
+    if missing.any():
+        counts = (~missing).sum(axis=0)
+        means = np.where(missing, 0, X).sum(axis=0) / np.maximum(counts, 1)
+        X[missing] = np.broadcast_to(means, X.shape)[missing]
+    return X
 
-    # --- Automatic eps Selection Using Nearest Neighbors ---
-    neighbors = NearestNeighbors(n_neighbors=5)
-    neighbors_fit = neighbors.fit(X_scaled)
-    distances, indices = neighbors_fit.kneighbors(X_scaled)
+def transform_days(X, coarse, state):
+    """(full-resolution days with gaps filled, scaled coarse view) for find_schedule()."""
+    coarse = state["imputer"].transform(np.asarray(coarse, dtype=np.float64))
+    X = coarse if coarse.shape[1] == X.shape[1] else fill_gaps(X)
+    return X, state["scaler"].transform(coarse)
 
-    # Find eps from the knee-point of sorted distances
-    sorted_distances = np.sort(distances[:, -1])
-    eps_value = sorted_distances[int(0.9 * len(sorted_distances))]
+def fit_preprocessing(X, state, total=None, capacity=None):
+    """Fit (or incrementally update) the imputer and scaler.
 
-    print(f"Calculated eps value for DBSCAN: {eps_value}", flush=True)
+    `total` counts the days ever appended to the history (default: len(X))
+    and `capacity` is the ring size X wraps at (default: it never wraps). If
+    the days appended since `state` was fitted are all still in X and the
+    last day it saw is unchanged, the per-column observed sums/counts and the
+    scaler statistics are updated with those days alone, which keeps a full
+    ring buffer (same row count, rotating rows) incremental; the statistics
+    then cover every day seen so far. Otherwise both are refitted from scratch.
+    """
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
+    X = np.asarray(X, dtype=np.float64)
+    rows = len(X)
+    total = rows if total is None else total
+    capacity = capacity or max(total, 1)
+    prev_total = state.get("total", 0) if state else 0
+    appended = (
+        0 < prev_total < total and total - prev_total < rows
+        and digest_rows(X[(prev_total - 1) % capacity]) == state.get("tail")
+    )
 
-    # Apply DBSCAN with found eps
-    dbscan = DBSCAN(eps=eps_value, min_samples=3)
-    cluster_labels = dbscan.fit_predict(X_scaled)
+    if appended:
+        new_rows = X[np.arange(prev_total, total) % capacity]
+        imputer, scaler = state["imputer"], state["scaler"]
+        observed = ~np.isnan(new_rows)
+        obs_count = state["obs_count"] + observed.sum(axis=0)
+        obs_sum = state["obs_sum"] + np.where(observed, new_rows, 0).sum(axis=0)
+        # Columns that have still never been observed keep their previous fill value
+        imputer.statistics_ = np.where(obs_count > 0, obs_sum / np.maximum(obs_count, 1), imputer.statistics_)
+        scaler.partial_fit(imputer.transform(new_rows))
+        print(f"➕ Incrementally updated imputer/scaler with {total - prev_total} new day(s)", flush=True)
+    else:
+        # Handle Missing Values
+        imputer = SimpleImputer(strategy="mean", keep_empty_features=True)
+        imputer.fit(X)
+        observed = ~np.isnan(X)
+        obs_count = observed.sum(axis=0)
+        obs_sum = np.where(observed, X, 0).sum(axis=0)
+
+        # Normalize Data (Standardization)
+        scaler = StandardScaler()
+        scaler.fit(imputer.transform(X))
+
+    return {
+        "rows": rows,
+        "digest": digest_rows(X),
+        "total": total,
+        "tail": digest_rows(X[(total - 1) % capacity]) if total else None,  # Newest day fitted
+        "imputer": imputer,
+        "scaler": scaler,
+        "obs_count": obs_count,
+        "obs_sum": obs_sum,
+        "schedule": None,
+    }
+
+def find_schedule(X, X_scaled, verbose=True, backend=None):
+    """Cluster the days and pick (charge_start, charge_duration, discharge_start, discharge_duration).
+
+    X holds the days at full resolution; X_scaled is the (possibly coarser) view they are clustered on.
+    """
+    # --- Cluster days with the configured backend (CLUSTER_BACKEND) ---
+    with metrics.timer("ml_stage_seconds", stage="cluster"):
+        cluster_labels, eps_value = cluster_days(X_scaled, backend)
+
+    if verbose and eps_value is not None:
+        print(f"Calculated eps value for DBSCAN: {eps_value}", flush=True)
+
+    # Identify Low-Demand (Charging) & High-Demand (Discharging) clusters
+    profiles = demand_profiles(X, cluster_labels)
+    if profiles is None:
+        return None
+
+    # Get hourly trends
+    low_demand_hours, high_demand_hours = profiles
+    return best_windows(low_demand_hours, high_demand_hours)
+
+WINDOW_HOURS = 4  # Length of the charge and discharge windows
+
+def best_windows(low_demand_hours, high_demand_hours):
+    """Charge in the cheapest and discharge in the busiest 4-hour window (prefix sums, any slot resolution)."""
+    with metrics.timer("ml_stage_seconds", stage="window_search"):
+        best_charge_start = best_window(low_demand_hours, WINDOW_HOURS, lowest=True)
+        best_charge_duration = WINDOW_HOURS
 
-    # Extract unique clusters (excluding noise)
-    unique_labels = np.unique(cluster_labels)
-    unique_labels = unique_labels[unique_labels != -1]
+        best_discharge_start = best_window(high_demand_hours, WINDOW_HOURS, lowest=False)
+        best_discharge_duration = WINDOW_HOURS
 
-    if len(unique_labels) > 0:
-        # Compute cluster-wise average power consumption
-        cluster_means = np.array([X[cluster_labels == i].mean(axis=0) for i in unique_labels])
+    return best_charge_start, best_charge_duration, best_discharge_start, best_discharge_duration
 
-        # Identify Low-Demand (Charging) & High-Demand (Discharging) clusters
-        low_demand_cluster = np.argmin(cluster_means.sum(axis=1))
-        high_demand_cluster = np.argmax(cluster_means.sum(axis=1))
+# 🔮 Plan from the data server's streaming forecast instead of re-clustering the history
+SCHEDULE_SOURCE = os.getenv('SCHEDULE_SOURCE', 'clusters')  # clusters | forecast | optimal
+last_forecast_observations = None
+last_optimal_schedule = None
 
-        # Get hourly trends
-        low_demand_hours = cluster_means[low_demand_cluster]
-        high_demand_hours = cluster_means[high_demand_cluster]
+def plan_from_forecast():
+    """(schedule, fitted) from the next-day forecast, or None if it is missing, still warming up or at another resolution."""
+    global last_forecast_observations
+    with metrics.timer("ml_stage_seconds", stage="forecast"):
+        forecaster = HourlyForecaster.load(FORECAST_STATE_PATH)
+    if forecaster is None or not forecaster.ready():
+        print("⚠️ Load forecast not ready yet; planning from clusters", flush=True)
+        return None
+    if forecaster.hours != READINGS_PER_DAY:
+        # State saved under another SLOT_MINUTES: its slots are not this resolution's
+        print(f"⚠️ Load forecast has {forecaster.hours} slots a day, expected {READINGS_PER_DAY}; "
+              "planning from clusters", flush=True)
+        return None
 
-        # --- Find Best Charging & Discharging Hours using a 4-hour window ---
-        best_charge_start = np.argmin([sum(low_demand_hours[i:i+4]) for i in range(21)])
-        best_charge_duration = 4
+    forecast = forecaster.forecast()
+    # The same expected profile gives both the quietest (charge) and busiest (discharge) window
+    schedule = best_windows(forecast["mean"], forecast["mean"])
+    fitted = forecaster.observations != last_forecast_observations
+    last_forecast_observations = forecaster.observations
+    report_first_plan()
+    if fitted:
+        print(f"🔮 Next-day forecast: {format_forecast(forecast)}", flush=True)
+        print(f"Best Charge Start: {schedule[0]}", flush=True)
+        print(f"Best Discharge Start: {schedule[2]}", flush=True)
+        metrics.inc("ml_cycles_total", result="forecast")
+    else:
+        print(f"⏭️ Forecast unchanged since last run; keeping schedule {schedule}", flush=True)
+        metrics.inc("ml_cycles_total", result="unchanged")
+    return schedule, fitted
+
+def plan_optimal():
+    """(schedule, fitted) from the cost-minimal dispatch under the tariff, or None to fall back to clusters.
+
+    The expected load is the streaming forecast once it is ready, else the
+    mean stored day; fitted is True when the schedule changed. Without any
+    load history, or when the battery limits admit no dispatch, returns None.
+    """
+    global last_optimal_schedule
+    with metrics.timer("ml_stage_seconds", stage="optimize"):
+        forecaster = HourlyForecaster.load(FORECAST_STATE_PATH)
+        if forecaster is not None and forecaster.ready() and forecaster.hours == READINGS_PER_DAY:
+            expected = np.array(forecaster.forecast()["mean"])
+        else:
+            history = load_history()
+            if len(history) == 0 or np.isnan(history).all():
+                print("⚠️ No load history to optimize against yet; planning from clusters", flush=True)
+                return None
+            expected = np.nan_to_num(np.nanmean(history, axis=0))
+
+        engine = TariffEngine.from_config(slots=READINGS_PER_DAY)
+        plan = engine.index.get(TARIFF_PLAN)
+        if plan is None and os.getenv('TARIFF_PLAN'):
+            print(f"⚠️ Unknown TARIFF_PLAN '{TARIFF_PLAN}' (configured: {', '.join(engine.names)}); "
+                  "planning from clusters", flush=True)
+            metrics.inc("ml_cycles_total", result="optimal_failed")
+            return None
+        plan = plan or 0  # Unset: the first configured plan, as the tariff optimizer prices with
+        prices = engine.prices[plan]
+        try:
+            schedule = optimal_schedule(prices, expected, BatteryParams())
+        except ValueError as e:
+            print(f"⚠️ Optimal dispatch failed ({e}); planning from clusters", flush=True)
+            metrics.inc("ml_cycles_total", result="optimal_failed")
+            return None
+
+    report_first_plan()
+    fitted = schedule != last_optimal_schedule
+    last_optimal_schedule = schedule
+    if fitted:
+        print(f"⚡ Optimal dispatch under '{engine.names[plan]}': {schedule}", flush=True)
+        metrics.inc("ml_cycles_total", result="optimal")
+    else:
+        print(f"⏭️ Optimal schedule unchanged; keeping {schedule}", flush=True)
+        metrics.inc("ml_cycles_total", result="unchanged")
+    return schedule, fitted
+
+def plan_schedule():
+    """Fit on the current history -> (schedule, fitted); fitted is False if nothing changed since the cached fit."""
+    if SCHEDULE_SOURCE == 'forecast':
+        planned = plan_from_forecast()
+        if planned is not None:
+            return planned
+    elif SCHEDULE_SOURCE == 'optimal':
+        planned = plan_optimal()
+        if planned is not None:
+            return planned
+
+    # --- Load Dataset ---
+    with metrics.timer("ml_stage_seconds", stage="load_history"):
+        X = load_history()
+        coarse = cluster_view(X)
+        total, capacity = history_position()
 
-        best_discharge_start = np.argmax([sum(high_demand_hours[i:i+4]) for i in range(21)])
-        best_discharge_duration = 4
+    # --- Skip the whole fit if no new day has arrived ---
+    cached = load_ml_state()
+    if (cached and cached["rows"] == len(coarse) and cached["digest"] == digest_rows(coarse)
+            and cached.get("backend") == CLUSTER_BACKEND):
+        print(f"⏭️ No new data since last run; keeping schedule {cached['schedule']}", flush=True)
+        metrics.inc("ml_cycles_total", result="unchanged")
+        report_first_plan()
+        return cached["schedule"], False
+
+    with metrics.timer("ml_stage_seconds", stage="preprocess"):
+        state = fit_preprocessing(coarse, cached, total, capacity)
+        X, X_scaled = transform_days(X, coarse, state)
+
+    schedule = find_schedule(X, X_scaled)
+    state["schedule"] = schedule
+    state["backend"] = CLUSTER_BACKEND
+    report_first_plan()
+
+    if schedule is not None:
+        best_charge_start, best_charge_duration, best_discharge_start, best_discharge_duration = schedule
 
         # Output required values
         print(f"Best Charge Start: {best_charge_start}", flush=True)
         print(f"Best Charge Duration: {best_charge_duration} hours", flush=True)
         print(f"Best Discharge Start: {best_discharge_start}", flush=True)
         print(f"Best Discharge Duration: {best_discharge_duration} hours", flush=True)
+    else:
+        print("No valid clusters found! Check dataset and retry.", flush=True)
 
-        # --- Sending Data to ESP32 ---
-        data_to_send = f"{int(best_charge_start)},{int(best_charge_duration)},{int(best_discharge_start)},{int(best_discharge_duration)}\n"
-        print(f"Sending Data to ESP32: {data_to_send.strip()}", flush=True)
+    metrics.inc("ml_cycles_total", result="fitted" if schedule is not None else "no_clusters")
+    save_ml_state(state)
+    return schedule, True
 
-        response = send_to_esp32(data_to_send)
+def controller_command(schedule):
+    """"start,duration,start,duration" line; whole hours are sent as ints, as the firmware always received them."""
+    return ",".join(f"{as_hours(v):g}" for v in schedule) + "\n"
 
-        # Print received response
-        print(f"📥 Received from ESP32: {response}", flush=True)
+def dispatch_schedule(schedule):
+    """Send a schedule to the site's ESP32 and return its reply ("Error" if unreachable)."""
+    data_to_send = controller_command(schedule)
+    print(f"Sending Data to ESP32: {data_to_send.strip()}", flush=True)
 
-        # --- Update Firebase (Inside "Battery Data") ---
-        update_firebase(best_charge_start, best_charge_duration, best_discharge_start, best_discharge_duration)
+    response = send_to_esp32(data_to_send)
 
-    else:
-        print("No valid clusters found! Check dataset and retry.", flush=True)
+    # Print received response
+    print(f"📥 Received from ESP32: {response}", flush=True)
+    return response
+
+def process_ml_model():
+    print("\n===== Running ML Model =====", flush=True)
+    # An unchanged plan is still sent: the controller waits for a schedule every cycle
+    schedule, _ = plan_schedule()
+
+    if schedule is not None:
+        # --- Sending Data to ESP32 ---
+        dispatch_schedule(schedule)
+
+        # --- Update Firebase (Inside "Battery Data") ---
+        with metrics.timer("ml_stage_seconds", stage="storage_write"):
+            update_firebase(*schedule)
 
     print("✅ Acknowledgment: Data processing & transmission completed. Waiting for next cycle...\n", flush=True)
+    return schedule
 
-def send_to_esp32(data):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5)
-            s.connect((ESP32_IP, ESP32_PORT))
-            s.sendall(data.encode())
-            print("Data Sent Successfully!", flush=True)
-
-            # Wait for ESP32 Response
-            response = s.recv(1024).decode().strip()
-            print(f"✅ ESP32 Response Received: {response}", flush=True)
-            return response
-    except Exception as e:
-        print(f"⚠️ Error: {e}", flush=True)
+# 📡 Pooled, concurrent controller dispatcher (connections persist between cycles)
+dispatcher = Esp32Dispatcher()
+
+def send_to_esp32(data, ip=None, port=None):
+    device = (ip or ESP32_IP, int(port or ESP32_PORT))
+    result = dispatcher.dispatch({device: data})[device]
+    if result["response"] is None:
+        print(f"⚠️ Error: {result.get('error')} (after {result['attempts']} attempt(s))", flush=True)
         return "Error"
+    print("Data Sent Successfully!", flush=True)
+    print(f"✅ ESP32 Response Received: {result['response']}", flush=True)
+    return result["response"]
 
 def update_firebase(charge_start, charge_duration, discharge_start, discharge_duration):
     try:
-        ref = db.reference("/Battery Data")
-        ref.set({
-            "best_charge_start": int(charge_start),
-            "best_charge_duration": int(charge_duration),
-            "best_discharge_start": int(discharge_start),
-            "best_discharge_duration": int(discharge_duration),
+        storage.set("Battery Data", {
+            "best_charge_start": as_hours(charge_start),
+            "best_charge_duration": as_hours(charge_duration),
+            "best_discharge_start": as_hours(discharge_start),
+            "best_discharge_duration": as_hours(discharge_duration),
             "last_updated": time.strftime("%Y-%m-%d %H:%M:%S")
         })
         print("🔥 Firebase Updated Successfully Inside 'Battery Data'!", flush=True)
     except Exception as e:
         print(f"⚠️ Firebase Error: {e}", flush=True)
 
+# ---------------- Fleet Mode ----------------
+FLEET_WORKERS = int(os.getenv('FLEET_WORKERS', 0))  # 0 = one worker per available core
+DAY_DURATION = 720  # One simulated "day"; a fleet cycle should finish well inside it
+FLEET_BATTERY_PATH = 'Fleet Battery Data'  # {site}: schedule; 'Battery Data' stays the single-site schedule
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def load_sites(source):
+    """Sites from a directory of per-site CSV/.bin histories or a JSON manifest.
+
+    Manifest format: a list (or {"sites": [...]}) of
+    {"site": "house_1", "history": "house_1.csv", "esp32_ip": "10.0.0.5", "esp32_port": 6000};
+    relative history paths are resolved against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        return [
+            {"site": os.path.splitext(name)[0], "history": os.path.join(source, name)}
+            for name in sorted(os.listdir(source))
+            if name.endswith(('.csv', '.bin'))
+        ]
+
+    with open(source, 'r') as f:
+        manifest = json.load(f)
+    sites = manifest["sites"] if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(source))
+    for site in sites:
+        site["history"] = os.path.join(base_dir, site["history"])
+    return sites
+
+def plan_site(site):
+    """Run the scheduling pipeline for one site (executes in a worker process)."""
+    started = time.perf_counter()
+    try:
+        if site["history"].endswith('.bin'):
+            with HistoryStore(site["history"], MAX_LOCAL_ROWS, READINGS_PER_DAY) as store:
+                X = np.array(store.values(), dtype=np.float64)
+        else:
+            X = read_csv_history(site["history"])
+        coarse = cluster_view(X)
+        state = fit_preprocessing(coarse, None)
+        schedule = find_schedule(*transform_days(X, coarse, state), verbose=False)
+        error = None
+    except Exception as e:
+        schedule, error = None, str(e)
+    return {"site": site["site"], "schedule": schedule, "error": error, "seconds": time.perf_counter() - started}
+
+def push_fleet_results(sites, results):
+    """Send each schedule to its site's controller and write all per-site Firebase paths in one update."""
+    by_site = {site["site"]: site for site in sites}
+    planned = [r for r in results if r["schedule"] is not None]
+
+    # Fan all commands out at once: about one round trip in total, not one per controller
+    commands, device_site = {}, {}
+    for result in planned:
+        site = by_site[result["site"]]
+        if site.get("esp32_ip"):
+            device = (site["esp32_ip"], int(site.get("esp32_port") or ESP32_PORT))
+            commands[device] = controller_command(result["schedule"])
+            device_site[device] = result["site"]
+    acks = dispatcher.dispatch(commands) if commands else {}
+    if acks:
+        print(f"📡 {summarize(acks)}", flush=True)
+    responses = {device_site[device]: (ack["response"] or "Error") for device, ack in acks.items()}
+
+    updated = time.strftime("%Y-%m-%d %H:%M:%S")
+    writes = {}
+    for result in planned:
+        charge_start, charge_duration, discharge_start, discharge_duration = result["schedule"]
+        writes[f"{FLEET_BATTERY_PATH}/{result['site']}"] = {
+            "best_charge_start": as_hours(charge_start),
+            "best_charge_duration": as_hours(charge_duration),
+            "best_discharge_start": as_hours(discharge_start),
+            "best_discharge_duration": as_hours(discharge_duration),
+            "last_updated": updated
+        }
+    if writes:
+        try:
+            storage.update("/", writes)
+            print(f"🔥 Firebase Updated for {len(writes)} site(s) under '{FLEET_BATTERY_PATH}'!", flush=True)
+        except Exception as e:
+            print(f"⚠️ Firebase Error: {e}", flush=True)
+    return responses
+
+def run_fleet(source, push=True):
+    """Plan every site in parallel on a process pool and report per-site and total wall time."""
+    print("\n===== Running ML Model (fleet mode) =====", flush=True)
+    started = time.perf_counter()
+    sites = load_sites(source)
+    workers = FLEET_WORKERS or available_cores()
+    chunksize = max(1, len(sites) // (workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(plan_site, sites, chunksize=chunksize))
+    planning_time = time.perf_counter() - started
+    metrics.observe("ml_stage_seconds", planning_time, stage="fleet_planning")
+    report_first_plan()
+
+    for result in results:
+        if result["error"]:
+            print(f"⚠️ {result['site']}: failed after {result['seconds']:.3f}s: {result['error']}", flush=True)
+        elif result["schedule"] is None:
+            print(f"⚠️ {result['site']}: no valid clusters ({result['seconds']:.3f}s)", flush=True)
+        else:
+            print(f"📍 {result['site']}: {result['schedule']} in {result['seconds']:.3f}s", flush=True)
+        # Workers run in other processes, so their timings are recorded here
+        metrics.observe("ml_site_seconds", result["seconds"], outcome="error" if result["error"] else "ok")
+
+    responses = push_fleet_results(sites, results) if push else {}
+    total_time = time.perf_counter() - started
+    ok = sum(1 for r in results if r["schedule"] is not None)
+    site_seconds = sum(r["seconds"] for r in results)
+    pushed = list(responses.values())
+    acked = sum(1 for resp in pushed if resp == "ACK")
+
+    print(f"⏱️ Planned {ok}/{len(sites)} sites on {workers} worker(s): "
+          f"planning {planning_time:.2f}s, total {total_time:.2f}s "
+          f"(sum of per-site time {site_seconds:.2f}s, {100 * total_time / DAY_DURATION:.1f}% of a {DAY_DURATION}s day); "
+          f"{acked}/{len(pushed)} controller(s) acknowledged", flush=True)
+    return {"results": results, "responses": responses, "planning_seconds": planning_time, "total_seconds": total_time}
+
 # --- Run the model every 72 seconds ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ML-based load scheduling")
+    parser.add_argument("--fleet", help="Directory of per-site histories or a JSON site manifest")
+    parser.add_argument("--once", action="store_true", help="Run a single cycle and exit")
+    args = parser.parse_args()
+    metrics.configure("ml_scheduler", ML_METRICS_PORT)
+
     while True:
-        process_ml_model()
+        with metrics.timer("ml_cycle_seconds", mode="fleet" if args.fleet else "single"):
+            if args.fleet:
+                run_fleet(args.fleet)
+            else:
+                process_ml_model()
+        if args.once:
+            break
         print("⏳ Waiting for 72 seconds before the next update...\n", flush=True)
-        time.sleep(720)
\ No newline at end of file
+        time.sleep(720)
@@ -1,36 +1,43 @@
+import time
+PROCESS_STARTED = time.perf_counter()  # Reference point for the startup budget
+
+import asyncio
 import socket
 import csv
+import math
 import os
-import firebase_admin
-from firebase_admin import credentials, db
 from dotenv import load_dotenv
+from upload_queue import UploadQueue
+from storage import open_storage
+import metrics
+from history_store import HistoryStore, default_store_path, import_csv, parse_day_number, parse_reading
+from forecaster import HourlyForecaster, FORECAST_STATE_PATH
+from wire_protocol import MAGIC, ProtocolError, read_frame, reading_values
+from resolution import READINGS_PER_DAY, SLOT_MINUTES, slot_columns
 
 # Load environment variables
 load_dotenv()
 
-# ----------------- Firebase Initialization -----------------
+# ----------------- Storage Initialization -----------------
+# STORAGE_BACKEND selects Firebase (default), a local SQLite file or memory.
+# Firebase itself connects on the first upload, not at startup.
 FIREBASE_CREDENTIALS_PATH = os.getenv('FIREBASE_CREDENTIALS_PATH_PRANA')
 FIREBASE_DATABASE_URL = os.getenv('FIREBASE_DATABASE_URL')
 
 try:
-    cred = credentials.Certificate(FIREBASE_CREDENTIALS_PATH)
-    firebase_admin.initialize_app(cred, {
-        'databaseURL': FIREBASE_DATABASE_URL
-    })
-    print("✅ Firebase initialized successfully.")
+    storage = open_storage(FIREBASE_CREDENTIALS_PATH, FIREBASE_DATABASE_URL)
+    print(f"✅ Storage initialized successfully ({storage.name}).")
 except Exception as e:
-    print("❌ Firebase initialization failed:", e)
+    print("❌ Storage initialization failed:", e)
     exit()
 
-# Firebase database reference
-ref = db.reference('sensor_data')
-READINGS_PER_DAY = 24  # 24 readings make one full dataset
-
 # ----------------- Server Configuration -----------------
 HOST = os.getenv('SERVER_HOST', '')           # Listen on all available interfaces
 PORT = int(os.getenv('SERVER_PORT', 5000))    # Must match the ESP32 port
 CSV_FILE = os.getenv('CSV_FILE_PATH')
 MAX_LOCAL_ROWS = int(os.getenv('MAX_LOCAL_ROWS', 300))  # Keep only the latest 10 days locally
+SERVER_METRICS_PORT = os.getenv('SERVER_METRICS_PORT')  # Prometheus /metrics endpoint (off if unset)
+SERVER_STARTUP_BUDGET = float(os.getenv('SERVER_STARTUP_BUDGET', 1.0))  # Seconds from launch to first accept
 
 def print_server_ips():
     """Prints all available IPs for the server."""
@@ -41,12 +48,14 @@ def print_server_ips():
     print(f"   🔹 IP Addresses: {host_ips[2]}")
 
 # ----------------- CSV File Setup -----------------
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        header = ['Day'] + [f'Hour_{i}' for i in range(READINGS_PER_DAY)]
-        writer.writerow(header)
-    print(f"✅ Created CSV file: {CSV_FILE}")
+def ensure_csv_file():
+    """Create the CSV with its header row if it does not exist yet."""
+    if not os.path.exists(CSV_FILE):
+        with open(CSV_FILE, 'w', newline='') as f:
+            writer = csv.writer(f)
+            header = ['Day'] + slot_columns()
+            writer.writerow(header)
+        print(f"✅ Created CSV file: {CSV_FILE} ({READINGS_PER_DAY} readings per day, {SLOT_MINUTES}-minute slots)")
 
 def load_rows():
     """Load existing rows from CSV (skip header)."""
@@ -62,73 +71,207 @@ def save_rows(rows):
     """Save only the latest MAX_LOCAL_ROWS to the CSV file."""
     with open(CSV_FILE, 'w', newline='') as f:
         writer = csv.writer(f)
-        header = ['Day'] + [f'Hour_{i}' for i in range(READINGS_PER_DAY)]
+        header = ['Day'] + slot_columns()
         writer.writerow(header)
         writer.writerows(rows[-MAX_LOCAL_ROWS:])  # Keep only the latest 10 rows
     print(f"✅ CSV file updated. Keeping only the last {MAX_LOCAL_ROWS} days.")
 
+def append_row(row, csv_rows):
+    """Append one row to the CSV; trim back to MAX_LOCAL_ROWS only once it doubles in size."""
+    csv_rows += 1
+    if csv_rows > 2 * MAX_LOCAL_ROWS:
+        save_rows(load_rows() + [row])
+        return MAX_LOCAL_ROWS
+    with open(CSV_FILE, 'a', newline='') as f:
+        csv.writer(f).writerow(row)
+    return csv_rows
+
+# ----------------- Binary History Store -----------------
+HISTORY_STORE_PATH = os.getenv('HISTORY_STORE_PATH') or (default_store_path(CSV_FILE) if CSV_FILE else None)
+
+def open_history_store():
+    """Open the memory-mapped history, seeding it from the CSV on first run."""
+    store = HistoryStore(HISTORY_STORE_PATH, MAX_LOCAL_ROWS, READINGS_PER_DAY)
+    if store.total_days == 0:
+        imported = import_csv(store, CSV_FILE)
+        if imported:
+            print(f"✅ Imported {imported} days from {CSV_FILE} into {HISTORY_STORE_PATH}")
+    return store
+
+# ----------------- Streaming Load Forecast -----------------
+def open_forecaster(store):
+    """Resume the saved forecast state, or seed it once from the stored history."""
+    forecaster = HourlyForecaster.load(FORECAST_STATE_PATH)
+    if forecaster is not None and forecaster.hours != READINGS_PER_DAY:
+        print(f"⚠️ Forecast state has {forecaster.hours} slots, not {READINGS_PER_DAY}; rebuilding it")
+        forecaster = None
+    if forecaster is None:
+        forecaster = HourlyForecaster.from_history(store.ordered()[1], READINGS_PER_DAY)
+        if len(store):
+            print(f"✅ Seeded load forecast from {len(store)} stored days")
+    return forecaster
+
 # ----------------- Main Server Code -----------------
-def main():
-    print_server_ips()
-    rows = load_rows()  # Load existing rows from file
-    current_row = []    # Buffer for the current row of readings
+CLIENT_IDLE_TIMEOUT = float(os.getenv('CLIENT_IDLE_TIMEOUT', 120))  # Drop silent sensor connections
+UPLOAD_WAL_PATH = os.getenv('SENSOR_UPLOAD_WAL_PATH', 'sensor_upload.wal')  # Unacknowledged storage writes
 
-    current_day = len(rows) + 1  # Determine next day count from existing data
-    readings = {}
+def store_day(store, csv_state, day_key, readings, forecaster=None):
+    """Append one completed day to the history store and CSV (runs in a worker thread)."""
+    values = list(readings.values())
+    with metrics.timer("server_store_seconds", target="history"):
+        store.append(parse_day_number(day_key), [parse_reading(v) for v in values])
+    with metrics.timer("server_store_seconds", target="csv"):
+        csv_state["rows"] = append_row([day_key] + values, csv_state["rows"])
+    if forecaster is not None:
+        # Readings were folded in as they arrived; publishing once per day is enough for the scheduler
+        with metrics.timer("server_store_seconds", target="forecast"):
+            forecaster.save(FORECAST_STATE_PATH)
+    print(f"✅ Saved {day_key} locally. Total days in store: {len(store)}")
 
-    # Set up the TCP server socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+async def run_worker(queue, job):
+    """Drain completed days from `queue` and run `job` off the event loop."""
+    while True:
+        day_key, readings, _ = await queue.get()
         try:
-            s.bind((HOST, PORT))
-            s.listen()
-            print(f"🚀 Server listening on port {PORT}...")
+            await asyncio.to_thread(job, day_key, readings)
         except Exception as e:
-            print("❌ Error binding the socket:", e)
-            return
-        
-        while True:
-            try:
-                conn, addr = s.accept()
-                with conn:
-                    print(f"🔗 Connected by {addr}")
-                    data = conn.recv(1024).decode().strip()
-                    if not data:
-                        print("⚠️ No data received.")
-                        continue
-                    print(f"📩 Received data: {data}")
+            print(f"❌ Worker error while handling {day_key}:", e)
+        finally:
+            queue.task_done()
 
-                    # Append reading to batch
-                    readings[len(readings)] = data  # Store readings as index-value pairs
+async def serve(day_pipeline=None):
+    """Accept sensor connections until cancelled.
 
-                    # If we have 24 readings, push to Firebase correctly
-                    if len(readings) == READINGS_PER_DAY:
-                        day_key = f'Day_{current_day}'
-                        try:
-                            ref.child(day_key).set(readings)  # Store readings under `Day_1`, `Day_2`, etc.
-                            print(f"✅ Uploaded {day_key} to Firebase correctly.")
-                        except Exception as e:
-                            print("❌ Firebase upload error:", e)
+    day_pipeline: optional coroutine function(queue, store_job) that takes over
+    completed days from the storage queue instead of the default worker;
+    pipeline.py uses it to chain scheduling and tariffs onto each new day.
+    """
+    ensure_csv_file()
+    store = open_history_store()
+    csv_state = {"rows": len(load_rows())}
+    forecaster = open_forecaster(store)
+    state = {"current_day": store.last_day + 1, "connections": 0}  # Next day count from existing data
+    device_readings = {}  # Per-device buffers: device id -> {index: reading}
 
-                        # Append new row to CSV
-                        new_row = [f'Day_{current_day}'] + list(readings.values())
-                        rows.append(new_row)
+    uploads = UploadQueue(UPLOAD_WAL_PATH, root_ref=storage.reference('/')).start()  # Durable, batched writer
+    storage_queue = asyncio.Queue()
+    store_job = lambda day_key, readings: store_day(store, csv_state, day_key, readings, forecaster)
+    workers = [
+        asyncio.create_task(day_pipeline(storage_queue, store_job) if day_pipeline else run_worker(storage_queue, store_job)),
+    ]
 
-                        # Keep only the latest MAX_LOCAL_ROWS rows
-                        if len(rows) > MAX_LOCAL_ROWS:
-                            rows = rows[-MAX_LOCAL_ROWS:]
+    def record_readings(device_id, values):
+        """Add typed readings (floats, NaN if unreadable) to the device's current day."""
+        readings = device_readings.setdefault(device_id, {})
+        for value in values:
+            hour = len(readings)
+            readings[hour] = value  # Store readings as index-value pairs
+            forecaster.update(hour, value)  # O(1) per reading
 
-                        save_rows(rows)
-                        print(f"✅ Saved {day_key} to CSV. Total rows locally: {len(rows)}")
+            # Once this device has a full day of readings, hand the day off to the workers
+            if len(readings) == READINGS_PER_DAY:
+                complete_day(device_id, readings)
+                readings = device_readings[device_id] = {}  # Reset for the next day
+        print(f"📝 {device_id} row length: {len(readings)} / {READINGS_PER_DAY}")
 
-                        readings = {}  # Reset for the next day
-                        current_day += 1  # Move to the next day
-                    
-                    # Append received reading to the current row
-                    current_row.append(data)
-                    print(f"📝 Current row length: {len(current_row)} / {READINGS_PER_DAY}")
+    def complete_day(device_id, readings):
+        day_key = f'Day_{state["current_day"]}'
+        state["current_day"] += 1  # Move to the next day
+        # Numbers go out as numbers; unreadable or non-finite readings as null
+        readings = {hour: value if math.isfinite(value) else None for hour, value in readings.items()}
+        uploads.put(f'sensor_data/{day_key}', readings)  # Store readings under `Day_1`, `Day_2`, etc.
+        storage_queue.put_nowait((day_key, readings, time.perf_counter()))  # Completion time for end-to-end latency
+        metrics.inc("server_days_total")
+        metrics.gauge("server_storage_queue", storage_queue.qsize())
+        print(f"📦 Queued {day_key} from {device_id} for upload and storage.")
 
-            except Exception as e:
-                print("❌ Error during connection handling:", e)
+    async def handle_device(reader, writer):
+        addr = writer.get_extra_info('peername')
+        device_id = addr[0] if addr else 'unknown'
+        print(f"🔗 Connected by {addr}")
+        metrics.inc("server_connections_total")
+        state["connections"] += 1
+        metrics.gauge("server_open_connections", state["connections"])
+        received = 0
+        try:
+            # Sensors may send one message and disconnect, or keep the socket open and stream.
+            # A message is either a binary frame (wire_protocol.py) or a legacy text line.
+            while True:
+                first = await asyncio.wait_for(reader.read(1), timeout=CLIENT_IDLE_TIMEOUT)
+                if not first:
+                    break
+                if first[0] == MAGIC:
+                    frame = await asyncio.wait_for(read_frame(reader), timeout=CLIENT_IDLE_TIMEOUT)
+                    if frame is None:
+                        print(f"⚠️ Skipped a frame from {device_id} with a newer protocol version")
+                        continue
+                    with metrics.timer("server_reading_seconds", format="frame"):
+                        values = reading_values(frame.readings)
+                        sender = frame.device_id or device_id
+                        print(f"📩 Received {len(values)} reading(s) from {sender}")
+                        record_readings(sender, values)
+                    metrics.inc("server_frames_total")
+                    metrics.inc("server_bytes_total", frame.size)
+                    if frame.timestamp > 0:
+                        metrics.observe("server_frame_lag_seconds", max(0.0, time.time() - frame.timestamp))
+                else:
+                    line = first if first == b'\n' else first + await asyncio.wait_for(reader.readline(), timeout=CLIENT_IDLE_TIMEOUT)
+                    with metrics.timer("server_reading_seconds", format="text"):
+                        data = line.decode(errors='replace').strip()
+                        if not data:
+                            continue
+                        print(f"📩 Received data from {device_id}: {data}")
+                        values = [parse_reading(data)]
+                        record_readings(device_id, values)
+                    metrics.inc("server_bytes_total", len(line))
+                metrics.inc("server_readings_total", len(values))
+                received += len(values)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Closing idle connection from {addr}")
+        except (ProtocolError, asyncio.IncompleteReadError) as e:
+            print(f"⚠️ Dropping {addr}: bad or truncated frame ({e})")
+        except Exception as e:
+            print("❌ Error during connection handling:", e)
+        finally:
+            if received == 0:
+                print("⚠️ No data received.")
+            state["connections"] -= 1
+            metrics.gauge("server_open_connections", state["connections"])
+            writer.close()
+
+    try:
+        server = await asyncio.start_server(handle_device, HOST or None, PORT)
+    except Exception as e:
+        print("❌ Error binding the socket:", e)
+        for worker in workers:
+            worker.cancel()
+        uploads.stop()
+        return
+
+    startup = time.perf_counter() - PROCESS_STARTED
+    print(f"🚀 Server listening on port {PORT}... (ready in {startup:.2f}s)")
+    metrics.gauge("startup_seconds", startup)
+    if startup > SERVER_STARTUP_BUDGET:
+        print(f"⚠️ Startup took {startup:.2f}s, over the {SERVER_STARTUP_BUDGET:g}s budget")
+    # Host lookup can block on DNS, so it runs after the socket is accepting
+    asyncio.get_running_loop().run_in_executor(None, print_server_ips)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # Flush any days still waiting for storage or upload
+        await storage_queue.join()
+        for worker in workers:
+            worker.cancel()
+        store.flush()
+        await asyncio.to_thread(uploads.stop)
+
+def main():
+    metrics.configure("data_server", SERVER_METRICS_PORT)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("🛑 Server stopped.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
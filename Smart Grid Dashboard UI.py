@@ -1,56 +1,77 @@
 import streamlit as st
 from streamlit_option_menu import option_menu
 import time
-import matplotlib.pyplot as plt
+import os
+import threading
+import io
 import numpy as np
-import firebase_admin
-from firebase_admin import credentials, db
 from datetime import datetime
 from dotenv import load_dotenv
+from history_explorer import HistoryExplorer, day_number
+from resolution import READINGS_PER_DAY, downsample
+from schedule_explorer import EXPLORER_DAYS, explore, frontier_rows
+from storage import open_storage
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-# --- Initialize Firebase ---
+# --- Initialize Storage (STORAGE_BACKEND: firebase, sqlite or memory) ---
 firebase_creds_path = os.getenv('FIREBASE_CREDENTIALS_PATH_UNAIS')
 firebase_db_url = os.getenv('FIREBASE_DATABASE_URL')
 
-cred = credentials.Certificate(firebase_creds_path)
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred, {
-        'databaseURL': firebase_db_url
-    })
+@st.cache_resource
+def get_storage():
+    return open_storage(firebase_creds_path, firebase_db_url)
+
+storage = get_storage()
 
 # --- Constants ---
 DAY_DURATION = 720  # 720 seconds = 1 "day" in the simulation
 HOUR_DURATION = DAY_DURATION / 24  # Each "hour" lasts 30 seconds
 
+CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', DAY_DURATION))  # Max snapshot age without a change event
+CHART_MODE = os.getenv('DASHBOARD_CHART_MODE', 'image')             # image (cached matplotlib PNG) | native
+RENDER_CACHE_ENTRIES = int(os.getenv('DASHBOARD_RENDER_CACHE_ENTRIES', 256))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 30))  # Days per page in the history explorer
+DASHBOARD_METRICS_PORT = os.getenv('DASHBOARD_METRICS_PORT')  # Prometheus /metrics endpoint (off if unset)
+
+@st.cache_resource
+def start_metrics():
+    # Once per server process, not once per session rerun
+    return metrics.configure("dashboard", DASHBOARD_METRICS_PORT)
+
+start_metrics()
+
 # --- Session State Initialization ---
 if "previous_data" not in st.session_state:
     st.session_state.previous_data = None
 if "simulation_start_time" not in st.session_state:
     st.session_state.simulation_start_time = time.time()
-if "last_fetch_time" not in st.session_state:
-    st.session_state.last_fetch_time = 0
+if "snapshot_version" not in st.session_state:
+    st.session_state.snapshot_version = 0
 
 # --- Firebase Fetch Logic ---
 def parse_24_hour_data(data):
+    """Stored slots (READINGS_PER_DAY of them) -> 24 hourly values for the charts."""
     if isinstance(data, dict):
-        return [int(data.get(str(i), 0)) for i in range(24)]
+        values = [float(data.get(str(i), 0) or 0) for i in range(READINGS_PER_DAY)]
     elif isinstance(data, list):
-        return [int(data[i]) if i < len(data) else 0 for i in range(24)]
-    return [0] * 24
+        values = [float(data[i] or 0) if i < len(data) else 0 for i in range(READINGS_PER_DAY)]
+    else:
+        return [0] * 24
+    return [int(v) for v in downsample(values)]
 
 def fetch_firebase_data():
     # Battery Timing
-    battery_data = db.reference("Battery Data").get()
+    battery_data = storage.get("Battery Data")
     best_charge_start = battery_data.get("best_charge_start", 0) if battery_data else 0
     best_charge_duration = battery_data.get("best_charge_duration", 0) if battery_data else 0
     best_discharge_start = battery_data.get("best_discharge_start", 0) if battery_data else 0
     best_discharge_duration = battery_data.get("best_discharge_duration", 0) if battery_data else 0
 
     # Tariff + Power Data
-    optimized_data = db.reference("Optimized Data").get()
+    optimized_data = storage.get("Optimized Data")
     cost_with_battery = optimized_data.get("cost_with_battery", 0) if optimized_data else 0
     cost_without_battery = optimized_data.get("cost_without_battery", 0) if optimized_data else 0
     optimized_consumption = optimized_data.get("optimized_consumption", {}) if optimized_data else {}
@@ -71,6 +92,61 @@ def fetch_firebase_data():
         "fetch_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
 
+# --- Shared Snapshot (one fetcher for every session) ---
+class SharedSnapshot:
+    """Process-wide copy of the latest Firebase data.
+
+    A single background thread refreshes the snapshot when a Firebase
+    listener reports a change on "Battery Data" or "Optimized Data", or at
+    the latest after CACHE_TTL seconds. Sessions only read it from memory,
+    so Firebase reads stay constant however many dashboards are open.
+    """
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.data = None
+        self.version = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._ready = threading.Event()
+        self._listeners = []
+
+    def start(self):
+        for path in ("Battery Data", "Optimized Data"):
+            try:
+                # Any event on the node just wakes the fetcher; the first event fires right away
+                self._listeners.append(storage.listen(path, lambda event: self._changed.set()))
+            except Exception as e:
+                print(f"⚠️ Listener on '{path}' unavailable, polling every {self.ttl:.0f}s: {e}")
+        threading.Thread(target=self._run, name="snapshot-fetcher", daemon=True).start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                with metrics.timer("dashboard_fetch_seconds"):
+                    data = fetch_firebase_data()
+                with self._lock:
+                    self.data = data
+                    self.version += 1
+                print(f"✅ New data fetched at {data['fetch_time']}")
+            except Exception as e:
+                print(f"⚠️ Snapshot refresh failed: {e}")
+            self._ready.set()
+            self._changed.wait(self.ttl)
+            self._changed.clear()
+
+    def get(self, wait=0):
+        """(version, data) of the latest snapshot; optionally wait briefly for the first fetch."""
+        if wait:
+            self._ready.wait(wait)
+        with self._lock:
+            return self.version, self.data
+
+@st.cache_resource
+def get_shared_snapshot():
+    return SharedSnapshot().start()
+
 # --- Battery Simulation Functions ---
 def calculate_battery_state(current_data):
     elapsed_time = time.time() - st.session_state.simulation_start_time
@@ -120,20 +196,56 @@ def calculate_battery_state(current_data):
         "day_progress": (elapsed_time / DAY_DURATION) * 100
     }
 
-def show_battery_display(battery_state):
+# --- Figure Rendering (cached by input data, shared by all sessions) ---
+def figure_to_png(fig):
+    """Render a figure to PNG bytes and release it, so figures never pile up in pyplot."""
+    import matplotlib.pyplot as plt
+    buffer = io.BytesIO()
+    try:
+        with metrics.timer("dashboard_render_seconds", mode="image"):
+            fig.savefig(buffer, format="png", bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=RENDER_CACHE_ENTRIES, show_spinner=False)
+def render_battery_png(charge_percent, current_hour):
+    import matplotlib.pyplot as plt  # Loaded on the first image render only; native mode never needs it
     fig, ax = plt.subplots(figsize=(8, 2))
-    charge = battery_state["charge"]
-    
-    color = 'green' if charge > 66 else 'orange' if charge > 33 else 'red'
+    color = 'green' if charge_percent > 66 else 'orange' if charge_percent > 33 else 'red'
     ax.add_patch(plt.Rectangle((0, 0), 100, 10, fill=False, edgecolor='black', linewidth=2))
-    ax.add_patch(plt.Rectangle((0, 0), charge, 10, color=color))
+    ax.add_patch(plt.Rectangle((0, 0), charge_percent, 10, color=color))
     ax.set_xlim(0, 100)
     ax.set_ylim(0, 10)
     ax.set_xticks([])
     ax.set_yticks([])
-    ax.set_title(f"Battery: {int(charge)}% (Hour: {int(battery_state['current_hour'])})", fontsize=12)
-    
-    st.pyplot(fig)
+    ax.set_title(f"Battery: {charge_percent}% (Hour: {current_hour})", fontsize=12)
+    return figure_to_png(fig)
+
+@st.cache_data(max_entries=RENDER_CACHE_ENTRIES, show_spinner=False)
+def render_power_png(original_power, optimized_power):
+    import matplotlib.pyplot as plt
+    hours = list(range(24))
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.plot(hours, original_power, marker="o", linestyle="-", color="red", label="Original Power Consumption")
+    ax.plot(hours, optimized_power, marker="s", linestyle="--", color="green", label="Optimized Power Consumption")
+    ax.set_xlabel("Hour of the Day")
+    ax.set_ylabel("Power Consumption (W)")
+    ax.set_title("Power Consumption Comparison")
+    ax.legend()
+    ax.grid(True, linestyle="--", alpha=0.7)
+    return figure_to_png(fig)
+
+def show_battery_display(battery_state):
+    # The bar only shows whole percents and hours, so the cache key is quantized to those
+    charge = int(battery_state["charge"])
+    current_hour = int(battery_state["current_hour"])
+
+    if CHART_MODE == "native":
+        st.markdown(f"**Battery: {charge}% (Hour: {current_hour})**")
+        st.progress(charge)
+    else:
+        st.image(render_battery_png(charge, current_hour))
     
     if "discharging" in battery_state["status"]:
         st.warning(f"⚡ {battery_state['status']} | Day Progress: {battery_state['day_progress']:.1f}%")
@@ -145,16 +257,16 @@ def show_battery_display(battery_state):
 # --- UI Sections ---
 def show_live_monitoring(original_power, optimized_power):
     st.subheader("📊 Live Monitoring")
-    hours = list(range(24))
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(hours, original_power, marker="o", linestyle="-", color="red", label="Original Power Consumption")
-    ax.plot(hours, optimized_power, marker="s", linestyle="--", color="green", label="Optimized Power Consumption")
-    ax.set_xlabel("Hour of the Day")
-    ax.set_ylabel("Power Consumption (W)")
-    ax.set_title("Power Consumption Comparison")
-    ax.legend()
-    ax.grid(True, linestyle="--", alpha=0.7)
-    st.pyplot(fig)
+    if CHART_MODE == "native":
+        # Vega-Lite chart: the browser gets 48 numbers instead of a re-rendered image
+        st.line_chart(
+            {"Original Power Consumption": original_power, "Optimized Power Consumption": optimized_power},
+            x_label="Hour of the Day",
+            y_label="Power Consumption (W)",
+            color=["#FF0000", "#008000"],
+        )
+    else:
+        st.image(render_power_png(tuple(original_power), tuple(optimized_power)))
 
 def show_savings_calculation(cost_with_battery, cost_without_battery, cost_savings):
     st.subheader("💰 Savings (Tariff Calculation)")
@@ -210,6 +322,105 @@ def show_savings_calculation(cost_with_battery, cost_without_battery, cost_savin
             </div>
         """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_history_explorer():
+    return HistoryExplorer(storage.reference)
+
+@st.cache_data(max_entries=RENDER_CACHE_ENTRIES, show_spinner=False)
+def explore_schedules(loads, current):
+    """Pareto front per plan plus the current schedule's (cost, peak reduction), cached per input."""
+    with metrics.timer("dashboard_render_seconds", mode="explorer"):
+        result = explore(np.array(loads), current=list(current))
+    current_points = {
+        plan: (float(result["current"]["cost"][p]), result["baseline_peak"] - result["current"]["peak"])
+        for p, plan in enumerate(result["plans"])
+    }
+    return {plan: frontier_rows(result, plan) for plan in result["plans"]}, current_points
+
+def clock(hours):
+    """6.25 -> '06:15'."""
+    return f"{int(hours):02d}:{round(hours % 1 * 60):02d}"
+
+def show_schedule_alternatives(current_data):
+    st.subheader("🔀 Alternative Schedules")
+    days = get_history_explorer().page(0, EXPLORER_DAYS)
+    loads = tuple(tuple(record["power_consumption"]) for _, record in days
+                  if len(record.get("power_consumption") or []) == READINGS_PER_DAY)
+    if not loads:
+        st.info("No optimized history yet to compare schedules on.")
+        return
+    current = (current_data["charging_start_time"], current_data["charging_duration"],
+               current_data["discharging_start_time"], current_data["discharging_duration"])
+    fronts, current_points = explore_schedules(loads, current)
+
+    plan = next(iter(fronts))
+    if len(fronts) > 1:
+        plan = st.selectbox("Tariff plan", list(fronts), key="explorer_plan")
+    rows = fronts[plan]
+    cost, reduction = current_points[plan]
+    st.caption(f"Every charge/discharge window pair scored on the last {len(loads)} day(s): "
+               f"schedules no other schedule beats on both cost and peak reduction. "
+               f"Current schedule: ₹{cost:.2f}/day, peak reduction {reduction:.2f}.")
+    st.dataframe(
+        {
+            "Charge": [f"{clock(row['charge_start'])} for {row['charge_duration']:g} h" for row in rows],
+            "Discharge": [f"{clock(row['discharge_start'])} for {row['discharge_duration']:g} h" for row in rows],
+            "Cost (₹/day)": [round(row["cost"], 2) for row in rows],
+            "Savings (₹/day)": [round(row["savings"], 2) for row in rows],
+            "Peak reduction": [round(row["peak_reduction"], 2) for row in rows],
+        },
+        hide_index=True,
+    )
+    if len(rows) > 1:
+        st.scatter_chart(
+            {"Peak reduction": [row["peak_reduction"] for row in rows], "Cost (₹/day)": [row["cost"] for row in rows]},
+            x="Peak reduction",
+            y="Cost (₹/day)",
+        )
+
+def show_history_explorer():
+    st.subheader("🗂️ Savings History")
+    explorer = get_history_explorer()
+    zoom = st.radio("Zoom", ["Day", "Week", "Month", "Year"], horizontal=True, key="history_zoom")
+
+    if zoom == "Day":
+        # Raw days, one page at a time (page 1 = most recent)
+        pages = explorer.page_count(HISTORY_PAGE_SIZE)
+        page = st.number_input(f"Page (1-{pages}, 1 = most recent)", 1, pages, 1, key="history_page")
+        days = explorer.page(page - 1, HISTORY_PAGE_SIZE)
+        if not days:
+            st.info("No optimized history yet.")
+            return
+        st.line_chart(
+            {
+                "Day": [day_number(key) for key, _ in days],
+                "Savings": [record.get("savings", 0) for _, record in days],
+                "Cost With Battery": [record.get("cost_with_battery", 0) for _, record in days],
+                "Cost Without Battery": [record.get("cost_without_battery", 0) for _, record in days],
+            },
+            x="Day",
+            y_label="₹ per day",
+        )
+        return
+
+    # Week / month / year: precomputed min/mean/max per bucket, no raw days downloaded
+    buckets = explorer.zoom(zoom.lower())
+    if not buckets:
+        st.info(f"No {zoom.lower()}ly aggregates yet.")
+        return
+    st.line_chart(
+        {
+            zoom: [day_number(bucket) for bucket, _ in buckets],
+            "Min Savings": [stats["savings"]["min"] for _, stats in buckets],
+            "Mean Savings": [stats["savings"]["mean"] for _, stats in buckets],
+            "Max Savings": [stats["savings"]["max"] for _, stats in buckets],
+        },
+        x=zoom,
+        y_label="₹ per day",
+    )
+    total = sum(stats["savings"]["mean"] * stats["days"] for _, stats in buckets)
+    st.metric(f"Total savings over {sum(stats['days'] for _, stats in buckets)} days", f"₹{total:.2f}")
+
 # --- Main UI ---
 def main():
     st.title("IoT-driven Peak Load Shifting Dashboard")
@@ -217,20 +428,18 @@ def main():
     with st.sidebar:
         option = option_menu(
             "IoT-driven Peak Load Shifting",
-            ["Live Monitoring", "Battery Status", "Savings (Tariff Calculation)"],
-            icons=["bar-chart", "battery", "dollar-sign"],
+            ["Live Monitoring", "Battery Status", "Savings (Tariff Calculation)", "History"],
+            icons=["bar-chart", "battery", "dollar-sign", "clock-history"],
             default_index=0
         )
 
-    # Fetch new data only once per day (720 seconds)
-    if (time.time() - st.session_state.last_fetch_time) > DAY_DURATION:
-        current_data = fetch_firebase_data()
+    # Read the process-wide snapshot; restart the day simulation whenever it changes
+    version, current_data = get_shared_snapshot().get(wait=2)
+    if version != st.session_state.snapshot_version and current_data is not None:
         st.session_state.previous_data = current_data
-        st.session_state.last_fetch_time = time.time()
+        st.session_state.snapshot_version = version
         st.session_state.simulation_start_time = time.time()
-        print(f"✅ New data fetched at {current_data['fetch_time']}")
-    else:
-        current_data = st.session_state.previous_data
+    current_data = st.session_state.previous_data
 
     if current_data is None:
         st.warning("Initializing... Please wait")
@@ -238,18 +447,22 @@ def main():
         st.rerun()
 
     # --- UI Display ---
-    if option == "Live Monitoring":
-        show_live_monitoring(current_data["original_power"], current_data["optimized_power"])
-    elif option == "Battery Status":
-        battery_state = calculate_battery_state(current_data)
-        show_battery_display(battery_state)
-    elif option == "Savings (Tariff Calculation)":
-        cost_savings = current_data["cost_without_battery"] - current_data["cost_with_battery"]
-        show_savings_calculation(
-            current_data["cost_with_battery"],
-            current_data["cost_without_battery"],
-            cost_savings
-        )
+    with metrics.timer("dashboard_page_seconds", page=option):
+        if option == "Live Monitoring":
+            show_live_monitoring(current_data["original_power"], current_data["optimized_power"])
+        elif option == "Battery Status":
+            battery_state = calculate_battery_state(current_data)
+            show_battery_display(battery_state)
+        elif option == "Savings (Tariff Calculation)":
+            cost_savings = current_data["cost_without_battery"] - current_data["cost_with_battery"]
+            show_savings_calculation(
+                current_data["cost_with_battery"],
+                current_data["cost_without_battery"],
+                cost_savings
+            )
+            show_schedule_alternatives(current_data)
+        elif option == "History":
+            show_history_explorer()
 
     # Refresh every 10 seconds (adjust as needed)
     time.sleep(10)
@@ -1,157 +1,323 @@
-import firebase_admin
-from firebase_admin import credentials, db
 import numpy as np
+import math
 import time
 import os
+import json
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from upload_queue import UploadQueue
+from change_feed import FirebaseDayFeed
+from tariff_engine import TariffEngine
+from battery_sim import BatteryParams, simulate, smooth
+from history_explorer import aggregate_writes
+from resolution import READINGS_PER_DAY, SLOT_HOURS, as_hours
+from sensor_archive import SensorArchive
+from storage import open_storage
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-# ---- Initialize Firebase ----
+# ---- Initialize Storage (STORAGE_BACKEND: firebase, sqlite or memory) ----
 firebase_creds_path = os.getenv('FIREBASE_CREDENTIALS_PATH_UNAIS')
 firebase_db_url = os.getenv('FIREBASE_DATABASE_URL')
 
-cred = credentials.Certificate(firebase_creds_path)
-firebase_admin.initialize_app(cred, {
-    'databaseURL': firebase_db_url
-})
+storage = open_storage(firebase_creds_path, firebase_db_url)
 
-# ---- Firebase References ----
-sensor_ref = db.reference('sensor_data')
-battery_ref = db.reference('Battery Data')
-optimized_ref = db.reference('Optimized Data')
-history_ref = db.reference('Optimized History')
+# ---- Storage References ----
+sensor_ref = storage.reference('sensor_data')
+battery_ref = storage.reference('Battery Data')
+sensor_archive = SensorArchive(storage)  # Old days are read back through the archive index
+
+# ---- Durable, batched result uploads ----
+UPLOAD_WAL_PATH = os.getenv('TARIFF_UPLOAD_WAL_PATH', 'tariff_upload.wal')
+BACKFILL_WAL_PATH = os.getenv('BACKFILL_UPLOAD_WAL_PATH', 'tariff_backfill.wal')  # Never shared with the live loop
+uploads = None
+
+def open_uploads(wal_path=UPLOAD_WAL_PATH):
+    """Start the upload queue on `wal_path`; one process per WAL, so a backfill gets its own."""
+    global uploads
+    uploads = UploadQueue(wal_path, root_ref=storage.reference('/')).start()
+    return uploads
+
+if __name__ != '__main__':
+    open_uploads()  # Imported (e.g. by pipeline.py): the live optimizer's WAL
+FEED_WAIT_TIMEOUT = 720  # Upper bound on one wait for new days
+FEED_RETRY_DELAY = 720   # Seconds before a day that could not be processed is read again
+
+# ---- Per-stage timings on /metrics (off unless TARIFF_METRICS_PORT or METRICS_LOG_PATH is set) ----
+TARIFF_METRICS_PORT = os.getenv('TARIFF_METRICS_PORT')
 
 # ---- Tariff Structure ----
-base_tariff = 0.4
-peak_tariff = 1
-offpeak_tariff = 0.2
-peak_hours = list(range(8, 22))
-offpeak_hours = list(range(22, 24)) + list(range(0, 8))
-
-# ---- Function to Compute Tariff ----
-def compute_tariff(consumption):
-    total_cost = 0
-    for hour, usage in enumerate(consumption):
-        if hour in peak_hours:
-            total_cost += usage * peak_tariff
-        elif hour in offpeak_hours:
-            total_cost += usage * offpeak_tariff
-        else:
-            total_cost += usage * base_tariff
-    return total_cost
-
-# ---- Tracking Last Fetched Data ----
-last_day = None
-
-while True:
-    # ---- Fetch Sensor Data ----
-    sensor_data = sensor_ref.get()
-    if sensor_data:
-        latest_day = sorted(sensor_data.keys(), key=lambda x: int(x.split('_')[-1]))[-1]
-
-        if latest_day != last_day:
-            latest_values = sensor_data[latest_day]
-
-            # ---- DEBUG: Print raw Firebase data ----
-            print(f"\n[DEBUG] Data for {latest_day}:", latest_values)
-
-            # ---- Parse power data safely (list or dict) ----
-            try:
-                if isinstance(latest_values, list):
-                    power_consumption = np.array([
-                        int(float(x)) if str(x).replace('.', '', 1).isdigit() else 0 for x in latest_values
-                    ])
-                elif isinstance(latest_values, dict):
-                    power_consumption = np.array([
-                        int(float(latest_values.get(str(i), 0))) for i in range(24)
-                    ])
-                else:
-                    print(f"[ERROR] Unexpected data format for {latest_day}")
-                    time.sleep(720)
-                    continue
-            except Exception as e:
-                print(f"[ERROR] Failed to parse power data: {e}")
-                time.sleep(720)
-                continue
+# Plans come from TARIFF_PLANS_PATH (JSON) or the built-in peak/off-peak plan
+tariff_engine = TariffEngine.from_config(slots=READINGS_PER_DAY)
 
-            print("[DEBUG] Parsed power_consumption:", power_consumption.tolist())
-            print("[DEBUG] Data Length:", len(power_consumption))
+# ---- Battery Model (BATTERY_* environment variables) ----
+battery_params = BatteryParams()
+SMOOTH_WINDOW = int(3 / SLOT_HOURS) | 1  # Centered 3-hour moving average, in (odd) slots
 
-            if len(power_consumption) < 24:
-                print(f"⚠️ Skipping {latest_day}: Not enough hourly data.")
-                time.sleep(720)
-                continue
+# ---- Parse power data safely (list or dict) ----
+def reading_value(x):
+    """One stored reading as an int: numbers pass straight through, legacy text is parsed, gaps are 0."""
+    if not isinstance(x, (int, float)):
+        try:
+            x = float(x)  # Days stored before readings were typed hold the raw text
+        except (TypeError, ValueError):
+            return 0
+    return int(x) if math.isfinite(x) else 0
 
-            # ---- Fetch Battery Data ----
-            battery_data = battery_ref.get()
-            battery_schedule = [
-                int(battery_data.get("best_charge_start", 0)),
-                int(battery_data.get("best_charge_duration", 0)),
-                int(battery_data.get("best_discharge_start", 0)),
-                int(battery_data.get("best_discharge_duration", 0))
-            ] if battery_data else [0, 0, 0, 0]
-
-            print("[DEBUG] Battery Schedule:", battery_schedule)
-
-            # ---- Optimization ----
-            optimized_consumption = power_consumption.copy()
-            battery_capacity = 9
-            charge_start, charge_duration, discharge_start, discharge_duration = battery_schedule
-            charging_hours = list(range(charge_start, min(charge_start + charge_duration, 24)))
-            discharging_hours = list(range(discharge_start, min(discharge_start + discharge_duration, 24)))
-            charge_profile = [battery_capacity] * len(charging_hours)
-            discharge_profile = [battery_capacity] * len(discharging_hours)
-
-            print("[DEBUG] Charging Hours:", charging_hours)
-            print("[DEBUG] Discharging Hours:", discharging_hours)
-
-            try:
-                for i, hour in enumerate(discharging_hours):
-                    optimized_consumption[hour] -= discharge_profile[i]
-
-                for i, hour in enumerate(charging_hours):
-                    optimized_consumption[hour] += charge_profile[i]
-            except IndexError as e:
-                print(f"[ERROR] Index error during optimization: {e}")
-                time.sleep(720)
-                continue
+def parse_power_data(day_key, values):
+    """Return the day's readings as an int array, or None if they can't be parsed."""
+    try:
+        if isinstance(values, list):
+            return np.array([reading_value(x) for x in values])
+        elif isinstance(values, dict):
+            return np.array([
+                reading_value(values.get(str(i), 0)) for i in range(READINGS_PER_DAY)
+            ])
+        print(f"[ERROR] Unexpected data format for {day_key}")
+    except Exception as e:
+        print(f"[ERROR] Failed to parse power data: {e}")
+    return None
+
+# ---- Fetch Battery Data ----
+def fetch_battery_schedule():
+    battery_data = battery_ref.get()
+    return [
+        as_hours(battery_data.get("best_charge_start", 0)),
+        as_hours(battery_data.get("best_charge_duration", 0)),
+        as_hours(battery_data.get("best_discharge_start", 0)),
+        as_hours(battery_data.get("best_discharge_duration", 0))
+    ] if battery_data else [0, 0, 0, 0]
+
+# ---- Vectorized Optimization (one day or a whole batch) ----
+def optimize_days(power_consumption, battery_schedule):
+    """(..., slots) consumption -> (optimized int consumption, cost without battery, cost with battery, dispatch)."""
+    with metrics.timer("tariff_stage_seconds", stage="battery_sim"):
+        dispatch = simulate(power_consumption, battery_schedule, battery_params)
+
+        # ---- Clamp values and smooth ----
+        optimized_consumption = smooth(np.clip(dispatch["optimized"], 10, 30), SMOOTH_WINDOW)
+        optimized_consumption = np.round(optimized_consumption).astype(int)
+
+    # ---- Tariff Calculation ----
+    with metrics.timer("tariff_stage_seconds", stage="tariff"):
+        cost_without_battery = tariff_engine.cost(power_consumption)
+        cost_with_battery = tariff_engine.cost(optimized_consumption)
+    return optimized_consumption, cost_without_battery, cost_with_battery, dispatch
+
+# ---- Week / Month / Year Aggregates for the History Explorer ----
+# Buckets folded into so far; the summary writes go out through the upload queue,
+# so a bucket is only read back from storage on a miss, with still-queued writes laid over it
+AGGREGATE_CACHE_BUCKETS = 64
+summary_cache = OrderedDict()
+
+def read_summary(path):
+    summaries = dict(storage.get(path) or {})
+    for queued_path, value in uploads.pending_writes(path).items():
+        day_key = queued_path.strip('/')[len(path) + 1:]
+        if day_key and '/' not in day_key:
+            summaries[day_key] = value
+    return summaries
+
+def fold_into_aggregates(results):
+    try:
+        with metrics.timer("tariff_stage_seconds", stage="aggregates"):
+            writes = aggregate_writes(results, read_summary, summary_cache)
+    except Exception as e:
+        print(f"⚠️ Could not update history aggregates: {e}")
+        return {}
+    while len(summary_cache) > AGGREGATE_CACHE_BUCKETS:
+        summary_cache.popitem(last=False)
+    return writes
+
+# ---- Process One Day ----
+def process_day(day_key, values, battery_schedule=None):
+    """Optimize and price one day; `battery_schedule` defaults to the stored 'Battery Data'."""
+    # ---- DEBUG: Print raw Firebase data ----
+    print(f"\n[DEBUG] Data for {day_key}:", values)
+
+    power_consumption = parse_power_data(day_key, values)
+    if power_consumption is None:
+        return None
+
+    print("[DEBUG] Parsed power_consumption:", power_consumption.tolist())
+    print("[DEBUG] Data Length:", len(power_consumption))
+
+    if len(power_consumption) < READINGS_PER_DAY:
+        print(f"⚠️ Skipping {day_key}: Not enough readings ({len(power_consumption)}/{READINGS_PER_DAY}).")
+        return None
+
+    if battery_schedule is None:
+        with metrics.timer("tariff_stage_seconds", stage="fetch_schedule"):
+            battery_schedule = fetch_battery_schedule()
+    print("[DEBUG] Battery Schedule:", battery_schedule)
+
+    # ---- Optimization, Clamping, Smoothing & Tariff ----
+    optimized_consumption, cost_without_battery, cost_with_battery, dispatch = optimize_days(
+        power_consumption[:READINGS_PER_DAY], battery_schedule
+    )
+    print("[DEBUG] Battery SOC:", np.round(dispatch["soc"], 2).tolist())
+    print(f"[DEBUG] Battery Throughput: {dispatch['throughput']:.1f}")
+    cost_without_battery = float(cost_without_battery)
+    cost_with_battery = float(cost_with_battery)
+    savings = cost_without_battery - cost_with_battery
 
-            # ---- Clamp values and smooth ----
-            optimized_consumption = np.clip(optimized_consumption, 10, 30)
-            for i in range(1, len(optimized_consumption) - 1):
-                optimized_consumption[i] = (
-                    optimized_consumption[i - 1] + optimized_consumption[i] + optimized_consumption[i + 1]
-                ) / 3
-            optimized_consumption = np.round(optimized_consumption).astype(int)
-
-            # ---- Tariff Calculation ----
-            cost_without_battery = compute_tariff(power_consumption)
-            cost_with_battery = compute_tariff(optimized_consumption)
-            savings = cost_without_battery - cost_with_battery
-
-            # ---- Print Results ----
-            print(f"\n✅ Processed {latest_day}")
-            print("Original Power Consumption:", power_consumption.tolist())
-            print("Optimized Power Consumption:", optimized_consumption.tolist())
-            print(f"Tariff without Battery: ₹{cost_without_battery}")
-            print(f"Tariff with Battery: ₹{cost_with_battery}")
-            print(f"💰 Savings: ₹{savings}")
-
-            # ---- Push to Firebase ----
-            result_data = {
-                "power_consumption": power_consumption.tolist(),
-                "optimized_consumption": optimized_consumption.tolist(),
-                "cost_without_battery": cost_without_battery,
-                "cost_with_battery": cost_with_battery,
-                "savings": savings
-            }
-
-            optimized_ref.set(result_data)
-            history_ref.child(latest_day).set(result_data)
+    # ---- Print Results ----
+    print(f"\n✅ Processed {day_key}")
+    print("Original Power Consumption:", power_consumption.tolist())
+    print("Optimized Power Consumption:", optimized_consumption.tolist())
+    print(f"Tariff without Battery: ₹{cost_without_battery}")
+    print(f"Tariff with Battery: ₹{cost_with_battery}")
+    print(f"💰 Savings: ₹{savings}")
+
+    # ---- Push to Firebase ----
+    result_data = {
+        "power_consumption": power_consumption.tolist(),
+        "optimized_consumption": optimized_consumption.tolist(),
+        "cost_without_battery": cost_without_battery,
+        "cost_with_battery": cost_with_battery,
+        "savings": savings
+    }
+
+    # Latest snapshot, history entry and zoom aggregates go out together in one multi-path update
+    writes = {
+        "Optimized Data": result_data,
+        f"Optimized History/{day_key}": result_data,
+    }
+    writes.update(fold_into_aggregates({day_key: result_data}))
+    uploads.put_many(writes)
+    metrics.inc("tariff_days_total", mode="live")
+    return result_data
+
+# ---- Historical Backfill / Reprocessing ----
+BACKFILL_CHUNK_DAYS = int(os.getenv('BACKFILL_CHUNK_DAYS', 64))        # Days fetched, optimized and written together
+BACKFILL_CHECKPOINT_PATH = os.getenv('BACKFILL_CHECKPOINT_PATH', 'backfill_checkpoint.json')
+
+def latest_stored_day():
+    """Newest Day_N in sensor_data (or the archive), from a shallow (keys only) read."""
+    return sensor_archive.latest_day()
+
+def fetch_days(day_numbers):
+    """Read a chunk of days in one range query -> [(day_key, values)] for days that exist, hot or archived."""
+    return list(sensor_archive.range(day_numbers[0], day_numbers[-1]).items())
+
+def load_checkpoint(start, end):
+    """Last finished day of an interrupted backfill over the same range, else start - 1."""
+    try:
+        with open(BACKFILL_CHECKPOINT_PATH, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("start") == start and checkpoint.get("end") == end:
+            return int(checkpoint["done"])
+    except (OSError, ValueError, KeyError):
+        pass
+    return start - 1
+
+def save_checkpoint(start, end, done):
+    tmp_path = BACKFILL_CHECKPOINT_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({"start": start, "end": end, "done": done}, f)
+    os.replace(tmp_path, BACKFILL_CHECKPOINT_PATH)
+
+def backfill(start, end=None, resume=True):
+    """Recompute `Optimized History` for Day_start..Day_end.
+
+    Days are streamed in chunks: each chunk is read concurrently, optimized and
+    priced as one (days x slots) batch, and written back as one multi-path update.
+    Results only depend on the stored readings and the current schedule, so
+    re-running is idempotent; a checkpoint after each acknowledged chunk lets an
+    interrupted run resume where it stopped.
+    """
+    end = end or latest_stored_day()
+    done = load_checkpoint(start, end) if resume else start - 1
+    if done >= end:
+        print(f"✅ Backfill Day_{start}..Day_{end} already complete.")
+        return
+    if done >= start:
+        print(f"♻️ Resuming backfill after Day_{done}")
+
+    battery_schedule = fetch_battery_schedule()
+    print(f"🔁 Backfilling Day_{done + 1}..Day_{end} with schedule {battery_schedule}")
+    started = time.perf_counter()
+    written = 0
+
+    def chunk(first):
+        return range(first, min(first + BACKFILL_CHUNK_DAYS, end + 1))
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        # Fetch the next chunk while the current one is optimized and written
+        pending = prefetch.submit(fetch_days, chunk(done + 1))
+        for chunk_start in range(done + 1, end + 1, BACKFILL_CHUNK_DAYS):
+            chunk_end = chunk(chunk_start)[-1]
+            with metrics.timer("tariff_stage_seconds", stage="backfill_fetch_wait"):
+                days = pending.result()
+            if chunk_end < end:
+                pending = prefetch.submit(fetch_days, chunk(chunk_end + 1))
+
+            parsed = [(key, parse_power_data(key, values)) for key, values in days]
+            parsed = [(key, power[:READINGS_PER_DAY]) for key, power in parsed
+                      if power is not None and len(power) >= READINGS_PER_DAY]
+            if parsed:
+                day_keys = [key for key, _ in parsed]
+                power = np.stack([p for _, p in parsed])
+                optimized, cost_without, cost_with, _ = optimize_days(power, battery_schedule)
+                savings = cost_without - cost_with
+                results = {
+                    key: {
+                        "power_consumption": power[i].tolist(),
+                        "optimized_consumption": optimized[i].tolist(),
+                        "cost_without_battery": float(cost_without[i]),
+                        "cost_with_battery": float(cost_with[i]),
+                        "savings": float(savings[i])
+                    }
+                    for i, key in enumerate(day_keys)
+                }
+                writes = {f"Optimized History/{key}": result for key, result in results.items()}
+                writes.update(fold_into_aggregates(results))
+                uploads.put_many(writes)
+                with metrics.timer("tariff_stage_seconds", stage="backfill_upload"):
+                    uploads.flush()
+                written += len(day_keys)
+                metrics.inc("tariff_days_total", len(day_keys), mode="backfill")
+
+            save_checkpoint(start, end, chunk_end)
+            print(f"📦 Day_{chunk_start}..Day_{chunk_end}: {len(parsed)} day(s) written")
+
+    print(f"✅ Backfill finished: {written} day(s) in {time.perf_counter() - started:.1f}s")
+
+# ---- Main Loop: run as soon as a new day lands ----
+def run(feed):
+    while True:
+        for day_key, values in feed.next_days(timeout=FEED_WAIT_TIMEOUT):
+            with metrics.timer("tariff_stage_seconds", stage="process_day"):
+                result = process_day(day_key, values)
+
+            if result is None:
+                # ---- Short or unreadable day: read it again later ----
+                print(f"⏳ {day_key} not processed; retrying in {FEED_RETRY_DELAY}s")
+                metrics.inc("tariff_days_deferred_total")
+                feed.defer(day_key, FEED_RETRY_DELAY)
+                continue
 
             # ---- Mark Day as Processed ----
-            last_day = latest_day
+            feed.mark_processed(day_key)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tariff & load optimizer")
+    parser.add_argument("--backfill", nargs="+", type=int, metavar=("START", "END"),
+                        help="Recompute Optimized History for Day_START..Day_END (END defaults to the latest day)")
+    parser.add_argument("--restart", action="store_true", help="Ignore any backfill checkpoint and start over")
+    parser.add_argument("--wal", help=f"Upload WAL (default: {UPLOAD_WAL_PATH}, or {BACKFILL_WAL_PATH} with --backfill)")
+    args = parser.parse_args()
+    if args.backfill and len(args.backfill) > 2:
+        parser.error("--backfill takes START and an optional END")
+    metrics.configure("tariff_optimizer", TARIFF_METRICS_PORT)
+    open_uploads(args.wal or (BACKFILL_WAL_PATH if args.backfill else UPLOAD_WAL_PATH))
 
-    time.sleep(720)
+    if args.backfill:
+        backfill(args.backfill[0], args.backfill[1] if len(args.backfill) > 1 else None, resume=not args.restart)
+        uploads.stop(timeout=None)
+    else:
+        run(FirebaseDayFeed(sensor_ref))
@@ -0,0 +1,129 @@
+import os
+import numpy as np
+
+# ----------------- Battery Configuration -----------------
+# Defaults reproduce the original optimizer: ±9 units per scheduled hour,
+# enough capacity for a 4-hour window, lossless, and a daily cycle in which
+# whatever is charged gets discharged (whichever window comes first).
+BATTERY_CAPACITY = float(os.getenv('BATTERY_CAPACITY', 36))             # Usable energy (units)
+BATTERY_CHARGE_POWER = float(os.getenv('BATTERY_CHARGE_POWER', 9))      # Grid-side units per hour
+BATTERY_DISCHARGE_POWER = float(os.getenv('BATTERY_DISCHARGE_POWER', 9))
+BATTERY_EFFICIENCY = float(os.getenv('BATTERY_EFFICIENCY', 1.0))        # Round-trip, split evenly per direction
+BATTERY_SOC_MIN = float(os.getenv('BATTERY_SOC_MIN', 0.0))              # Fraction of capacity
+BATTERY_SOC_MAX = float(os.getenv('BATTERY_SOC_MAX', 1.0))
+BATTERY_INITIAL_SOC = os.getenv('BATTERY_INITIAL_SOC', 'cyclic')       # Fraction, or 'cyclic' for the daily steady state
+
+class BatteryParams:
+    def __init__(self, capacity=BATTERY_CAPACITY, charge_power=BATTERY_CHARGE_POWER,
+                 discharge_power=BATTERY_DISCHARGE_POWER, efficiency=BATTERY_EFFICIENCY,
+                 soc_min=BATTERY_SOC_MIN, soc_max=BATTERY_SOC_MAX, initial_soc=BATTERY_INITIAL_SOC):
+        if not 0 < efficiency <= 1:
+            raise ValueError("efficiency must be in (0, 1]")
+        initial_soc = None if initial_soc in (None, 'cyclic') else float(initial_soc)
+        if not 0 <= soc_min <= soc_max <= 1:
+            raise ValueError("expected 0 <= soc_min <= soc_max <= 1")
+        if initial_soc is not None and not soc_min <= initial_soc <= soc_max:
+            raise ValueError("initial_soc must lie within [soc_min, soc_max]")
+        self.capacity = capacity
+        self.charge_power = charge_power
+        self.discharge_power = discharge_power
+        self.efficiency = efficiency
+        self.soc_min = soc_min
+        self.soc_max = soc_max
+        self.initial_soc = initial_soc
+
+    @property
+    def one_way_efficiency(self):
+        return np.sqrt(self.efficiency)
+
+def window_mask(starts, durations, slots):
+    """(..., slots) mask of slots inside [start, start + duration) hours, cut off at the end of the day."""
+    slot_hours = np.arange(slots) * 24.0 / slots
+    starts = np.asarray(starts, dtype=np.float64)[..., None]
+    ends = np.minimum(starts + np.asarray(durations, dtype=np.float64)[..., None], 24)
+    return (slot_hours >= starts) & (slot_hours < ends)
+
+def simulate(load, schedules, params=None, allow_export=True):
+    """Apply battery schedules to a batch of days.
+
+    load:      (..., slots) consumption per slot (average power; energy = load x 24 / slots hours)
+    schedules: (..., 4) rows of [charge_start, charge_duration, discharge_start, discharge_duration] in hours
+    Leading axes broadcast, so load[:, None] with schedules[None] evaluates every
+    schedule on every day. SOC is tracked per slot with power, capacity and
+    efficiency limits; where the two windows overlap, charging wins. With
+    allow_export=False the battery never discharges more than the load it offsets.
+
+    Returns a dict of arrays:
+      optimized  (..., slots)      grid consumption after the battery (same units as load)
+      soc        (..., slots + 1)  state of charge as a fraction of capacity (index 0 = start of day)
+      charged    (...)             grid energy drawn to charge
+      discharged (...)             energy delivered to the load
+      throughput (...)             charged + discharged
+    """
+    params = params or BatteryParams()
+    load = np.asarray(load, dtype=np.float64)
+    schedules = np.asarray(schedules, dtype=np.float64)
+    slots = load.shape[-1]
+    dt = 24.0 / slots
+    batch = np.broadcast_shapes(load.shape[:-1], schedules.shape[:-1])
+    load = np.broadcast_to(load, batch + (slots,))
+
+    charging = window_mask(schedules[..., 0], schedules[..., 1], slots)
+    discharging = window_mask(schedules[..., 2], schedules[..., 3], slots) & ~charging
+    charging = np.broadcast_to(charging, batch + (slots,))
+    discharging = np.broadcast_to(discharging, batch + (slots,))
+
+    eta = params.one_way_efficiency
+    e_min = params.soc_min * params.capacity
+    e_max = params.soc_max * params.capacity
+    charge_step = params.charge_power * dt
+    discharge_step = params.discharge_power * dt
+
+    def run_day(energy):
+        soc = np.empty(batch + (slots + 1,))
+        soc[..., 0] = energy
+        grid_delta = np.zeros(batch + (slots,))
+
+        # Slots are sequential (SOC carries over); every slot step is vectorized over the whole batch
+        for t in range(slots):
+            stored = np.minimum(charge_step * eta, e_max - energy)
+            stored = np.where(charging[..., t], np.maximum(stored, 0), 0)
+
+            delivered = np.minimum(discharge_step, (energy - e_min) * eta)
+            if not allow_export:
+                delivered = np.minimum(delivered, np.maximum(load[..., t], 0) * dt)
+            delivered = np.where(discharging[..., t], np.maximum(delivered, 0), 0)
+
+            energy = energy + stored - delivered / eta
+            soc[..., t + 1] = energy
+            grid_delta[..., t] = stored / eta - delivered
+        return energy, soc, grid_delta
+
+    if params.initial_soc is None:
+        # Cyclic: warm up one day from empty, then start the real day where the warm-up ended
+        start_energy, _, _ = run_day(np.full(batch, e_min))
+    else:
+        start_energy = np.full(batch, params.initial_soc * params.capacity)
+    _, soc, grid_delta = run_day(start_energy)
+
+    charged = np.where(grid_delta > 0, grid_delta, 0).sum(axis=-1)
+    discharged = np.where(grid_delta < 0, -grid_delta, 0).sum(axis=-1)
+    return {
+        "optimized": load + grid_delta / dt,
+        "soc": soc / params.capacity if params.capacity else soc,
+        "charged": charged,
+        "discharged": discharged,
+        "throughput": charged + discharged,
+    }
+
+def smooth(series, window=3):
+    """Centered moving average along the last axis; the first and last window//2 slots are left as-is."""
+    series = np.asarray(series, dtype=np.float64)
+    half = window // 2
+    if series.shape[-1] < window:
+        return series.copy()
+    csum = np.cumsum(series, axis=-1)
+    csum = np.concatenate([np.zeros(series.shape[:-1] + (1,)), csum], axis=-1)
+    smoothed = series.copy()
+    smoothed[..., half:series.shape[-1] - half] = (csum[..., window:] - csum[..., :-window]) / window
+    return smoothed
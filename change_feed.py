@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+# ----------------- Change Feed Configuration -----------------
+FEED_POLL_INTERVAL = float(os.getenv('FEED_POLL_INTERVAL', 5))  # Seconds between next-day probes
+
+def day_number(day_key):
+    """'Day_12' -> 12 (non-day keys sort first)."""
+    try:
+        return int(str(day_key).split('_')[-1])
+    except ValueError:
+        return -1
+
+class DayFeed:
+    """Delivers `Day_N` entries under `sensor_data` as they land.
+
+    Only days that have not been processed yet are mirrored locally;
+    `mark_processed()` drops a day from the mirror once it has been handled,
+    and `defer()` sets one aside to be offered again (freshly read) later.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._mirror = {}    # day key -> readings, not yet processed
+        self._deferred = {}  # day key -> (monotonic time it is due again, readings)
+
+    def _add(self, day_key, values):
+        with self._cond:
+            self._mirror[day_key] = values
+            self._cond.notify_all()
+
+    def pending(self):
+        """Unprocessed days in day order."""
+        with self._cond:
+            return sorted(self._mirror.items(), key=lambda item: day_number(item[0]))
+
+    def mark_processed(self, day_key):
+        with self._cond:
+            self._mirror.pop(day_key, None)
+            self._deferred.pop(day_key, None)
+
+    def defer(self, day_key, delay):
+        """Take an unprocessed day out of the feed; it is re-read and offered again after `delay` seconds."""
+        with self._cond:
+            values = self._mirror.pop(day_key, None)
+            self._deferred[day_key] = (time.monotonic() + delay, values)
+
+    def _release_due(self):
+        """Move deferred days whose delay has passed back into the mirror (caller holds the lock)."""
+        now = time.monotonic()
+        for day_key, (due, values) in list(self._deferred.items()):
+            if due <= now:
+                del self._deferred[day_key]
+                values = self._reload(day_key, values)
+                if values is not None:
+                    self._mirror[day_key] = values
+
+    def _reload(self, day_key, values):
+        return values
+
+    def next_days(self, timeout=None):
+        """Block until at least one unprocessed day is available (or `timeout` expires)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._release_due()
+                if self._mirror:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                if self._deferred:
+                    # Wake up in time for the next deferred day
+                    due = min(due for due, _ in self._deferred.values()) - time.monotonic()
+                    remaining = max(0.0, due if remaining is None else min(remaining, due))
+                self._wait(remaining)
+        return self.pending()
+
+    def _wait(self, remaining):
+        self._cond.wait(remaining)
+
+class FirebaseDayFeed(DayFeed):
+    """Key-bounded feed over a Firebase `sensor_data` reference.
+
+    `Day_N` keys are not zero-padded, so `order_by_key()` sorts them
+    lexicographically (Day_10 < Day_9) and cannot find the newest day.
+    Instead the feed reads the key list once with a shallow query, mirrors
+    only the newest day, then probes `Day_{N+1}` directly. Each probe
+    downloads at most one day, no matter how long the history is.
+    """
+
+    def __init__(self, ref, poll_interval=FEED_POLL_INTERVAL, start_after=None):
+        super().__init__()
+        self.ref = ref
+        self.poll_interval = poll_interval
+        self._next_day = None if start_after is None else day_number(start_after) + 1
+
+    def bootstrap(self):
+        """Find the newest stored day from a shallow key listing and mirror it."""
+        keys = self.ref.get(shallow=True) or {}
+        numbers = [day_number(key) for key in keys if day_number(key) >= 0]
+        if not numbers:
+            self._next_day = 1
+            return
+        latest = max(numbers)
+        self._next_day = latest
+        self.poll()
+
+    def poll(self):
+        """Fetch any days after the last one seen. Returns the number of new days."""
+        if self._next_day is None:
+            self.bootstrap()
+            return len(self._mirror)
+        found = 0
+        while True:
+            day_key = f'Day_{self._next_day}'
+            values = self.ref.child(day_key).get()
+            if values is None:
+                return found
+            self._add(day_key, values)
+            self._next_day += 1
+            found += 1
+
+    def _reload(self, day_key, values):
+        # A deferred day may have been completed since it was first read
+        return self.ref.child(day_key).get()
+
+    def _wait(self, remaining):
+        # Firebase has no push here, so waiting means probing for the next key
+        self._cond.release()
+        try:
+            self.poll()
+        finally:
+            self._cond.acquire()
+        if not self._mirror:
+            delay = self.poll_interval if remaining is None else min(self.poll_interval, remaining)
+            self._cond.wait(delay)
+
+class MemoryDayFeed(DayFeed):
+    """In-memory stand-in for tests and local runs: call `publish()` to land a day."""
+
+    def publish(self, day_key, values):
+        self._add(day_key, values)
@@ -0,0 +1,113 @@
+import os
+import numpy as np
+
+# scikit-learn takes over a second to import, so each backend imports what it needs on first use
+
+# ----------------- Clustering Configuration -----------------
+CLUSTER_BACKEND = os.getenv('CLUSTER_BACKEND', 'exact')           # exact | approx | minibatch
+EPS_SAMPLE_SIZE = int(os.getenv('EPS_SAMPLE_SIZE', 2000))         # Days queried for the knee-point eps
+DBSCAN_SAMPLE_SIZE = int(os.getenv('DBSCAN_SAMPLE_SIZE', 5000))   # Days DBSCAN is fitted on in `approx`
+MINIBATCH_CLUSTERS = int(os.getenv('MINIBATCH_CLUSTERS', 8))      # k for the `minibatch` backend
+MINIBATCH_SIZE = int(os.getenv('MINIBATCH_SIZE', 1024))
+N_NEIGHBORS = 5
+EPS_QUANTILE = 0.9
+MIN_SAMPLES = 3
+RANDOM_SEED = 0
+
+BACKENDS = ('exact', 'approx', 'minibatch')
+
+def subsample(n_rows, size, rng):
+    """Sorted random row indices, or None if all rows fit in `size`."""
+    if n_rows <= size:
+        return None
+    return np.sort(rng.choice(n_rows, size=size, replace=False))
+
+def estimate_eps(X_scaled, sample_size=EPS_SAMPLE_SIZE, rng=None):
+    """Knee-point eps: the 90th percentile of k-th neighbour distances.
+
+    The neighbour index covers every day, but only a bounded random subsample
+    is queried, so the cost is O(sample_size * log n) instead of O(n log n)
+    queries and the distance matrix never exceeds sample_size x k.
+    """
+    from sklearn.neighbors import NearestNeighbors
+    rng = rng or np.random.default_rng(RANDOM_SEED)
+    n_neighbors = min(N_NEIGHBORS, len(X_scaled))
+    neighbors_fit = NearestNeighbors(n_neighbors=n_neighbors).fit(X_scaled)
+    idx = subsample(len(X_scaled), sample_size, rng)
+    queries = X_scaled if idx is None else X_scaled[idx]
+    distances, _ = neighbors_fit.kneighbors(queries)
+
+    sorted_distances = np.sort(distances[:, -1])
+    return float(sorted_distances[int(EPS_QUANTILE * len(sorted_distances))])
+
+def cluster_exact(X_scaled, rng):
+    from sklearn.cluster import DBSCAN
+    eps_value = estimate_eps(X_scaled, rng=rng)
+    return DBSCAN(eps=eps_value, min_samples=MIN_SAMPLES).fit_predict(X_scaled), eps_value
+
+def cluster_approx(X_scaled, rng):
+    """DBSCAN on a bounded subsample; every other day joins the cluster of its nearest core day within eps."""
+    from sklearn.cluster import DBSCAN
+    from sklearn.neighbors import NearestNeighbors
+    idx = subsample(len(X_scaled), DBSCAN_SAMPLE_SIZE, rng)
+    if idx is None:
+        return cluster_exact(X_scaled, rng)
+
+    sample = X_scaled[idx]
+    # eps comes from the same subsample so its density matches the points DBSCAN sees
+    eps_value = estimate_eps(sample, rng=rng)
+    dbscan = DBSCAN(eps=eps_value, min_samples=MIN_SAMPLES).fit(sample)
+
+    labels = np.full(len(X_scaled), -1, dtype=int)
+    core = dbscan.core_sample_indices_
+    if len(core) == 0:
+        return labels, eps_value
+
+    distances, nearest = NearestNeighbors(n_neighbors=1).fit(sample[core]).kneighbors(X_scaled)
+    within = distances[:, 0] <= eps_value
+    labels[within] = dbscan.labels_[core][nearest[within, 0]]
+    labels[idx] = dbscan.labels_  # Sampled days keep their own DBSCAN label (incl. border points)
+    return labels, eps_value
+
+def cluster_minibatch(X_scaled, rng):
+    """MiniBatchKMeans: bounded memory, no noise label, suited to very large histories."""
+    from sklearn.cluster import MiniBatchKMeans
+    n_clusters = max(1, min(MINIBATCH_CLUSTERS, len(X_scaled)))
+    kmeans = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        batch_size=MINIBATCH_SIZE,
+        n_init=3,
+        random_state=int(rng.integers(2**31 - 1)),
+    )
+    return kmeans.fit_predict(X_scaled), None
+
+def cluster_days(X_scaled, backend=None):
+    """Label each day with a cluster id (-1 = noise). Returns (labels, eps or None)."""
+    backend = backend or CLUSTER_BACKEND
+    rng = np.random.default_rng(RANDOM_SEED)
+    if backend == 'exact':
+        return cluster_exact(X_scaled, rng)
+    if backend == 'approx':
+        return cluster_approx(X_scaled, rng)
+    if backend == 'minibatch':
+        return cluster_minibatch(X_scaled, rng)
+    raise ValueError(f"Unknown CLUSTER_BACKEND '{backend}' (expected one of {', '.join(BACKENDS)})")
+
+def demand_profiles(X, labels):
+    """Mean hourly profile of the lowest- and highest-consumption clusters, or None if every day is noise.
+
+    Clusters are ranked by the total daily consumption of their mean day in the
+    original (unscaled) units, so the choice is comparable across backends.
+    """
+    valid = labels >= 0
+    if not valid.any():
+        return None
+    order = np.argsort(labels[valid], kind='stable')
+    sorted_labels = labels[valid][order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    sums = np.add.reduceat(X[valid][order], starts, axis=0)
+    counts = np.diff(np.r_[starts, len(sorted_labels)])
+    cluster_means = sums / counts[:, None]
+
+    totals = cluster_means.sum(axis=1)
+    return cluster_means[np.argmin(totals)], cluster_means[np.argmax(totals)]
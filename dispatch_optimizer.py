@@ -0,0 +1,196 @@
+import argparse
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from battery_sim import BatteryParams
+from resolution import as_hours
+import metrics
+
+# ----------------- Dispatch Optimizer Configuration -----------------
+DISPATCH_SOC_STEPS = int(os.getenv('DISPATCH_SOC_STEPS', 36))             # SOC grid intervals between soc_min and soc_max
+DISPATCH_ALLOW_EXPORT = os.getenv('DISPATCH_ALLOW_EXPORT', '1') == '1'    # 0: never discharge more than the load
+DISPATCH_CHUNK_DAYS = int(os.getenv('DISPATCH_CHUNK_DAYS', 256))          # Days solved per vectorized pass
+TIE_BREAK = 1e-6  # Cost nudge per unit of energy: among equal-cost plans, prefer less cycling and shaving high load
+
+def soc_step(span, charge_energy, discharge_energy, soc_steps):
+    """SOC grid spacing near span / soc_steps that fits the per-slot power limits best.
+
+    A power limit that falls between levels is rounded down, which costs up
+    to one level of energy every full-power slot. Steps of either limit
+    divided into whole levels are tried, and the one losing the least
+    energy per full-power slot wins (a top level below soc_max only loses
+    capacity once).
+    """
+    nominal = span / soc_steps
+    candidates = [nominal] + [energy / max(1, round(energy / nominal)) for energy in (charge_energy, discharge_energy) if energy > 0]
+
+    def lost(step):
+        return sum(energy - int(energy / step + 1e-9) * step for energy in (charge_energy, discharge_energy)) + \
+            (span - int(span / step + 1e-9) * step) / 24
+    return min(candidates, key=lost)
+
+def optimize_dispatch(prices, load=None, params=None, allow_export=DISPATCH_ALLOW_EXPORT, soc_steps=DISPATCH_SOC_STEPS):
+    """Cost-minimal battery plan for a batch of days: dynamic program over a discretized SOC grid.
+
+    prices: (..., slots) energy price per slot, e.g. TariffPlan.prices
+    load:   (..., slots) consumption; needed for allow_export=False, and used to break ties
+            between equal-cost plans towards discharging at the highest load
+
+    SOC takes soc_steps + 1 levels between soc_min and soc_max. Each slot the
+    battery moves between levels within its charge/discharge power, paying
+    price x grid energy (charging draws stored / eta, discharging delivers
+    removed x eta, with eta the one-way efficiency as in battery_sim). The day
+    starts at initial_soc (soc_min when unset) and must end at least as full,
+    so energy is never borrowed from the next day. The backward pass is
+    vectorized over (days, levels, moves); only the slot loop is sequential.
+
+    Returns a dict of arrays:
+      grid    (..., slots)      battery grid energy per slot (+ charging, - discharging)
+      soc     (..., slots + 1)  state of charge as a fraction of capacity
+      cost    (...)             price x grid energy: the battery's change to the bill (negative = saving)
+    """
+    params = params or BatteryParams()
+    prices = np.asarray(prices, dtype=np.float64)
+    slots = prices.shape[-1]
+    batch = prices.shape[:-1] if load is None else np.broadcast_shapes(prices.shape[:-1], np.shape(load)[:-1])
+    prices = np.broadcast_to(prices, batch + (slots,)).reshape(-1, slots)
+    days = len(prices)
+    dt = 24.0 / slots
+
+    eta = params.one_way_efficiency
+    e_min = params.soc_min * params.capacity
+    e_max = params.soc_max * params.capacity
+    if soc_steps < 1 or e_max <= e_min:
+        raise ValueError("The battery needs capacity and soc_max > soc_min to dispatch")
+    step = soc_step(e_max - e_min, params.charge_power * dt * eta, params.discharge_power * dt / eta, soc_steps)
+    up = int(params.charge_power * dt * eta / step + 1e-9)      # Levels gained per slot at full charge power
+    down = int(params.discharge_power * dt / eta / step + 1e-9)  # Levels lost per slot at full discharge power
+    moves = np.arange(-down, up + 1)
+    grid_per_move = np.where(moves > 0, moves * step / eta, moves * step * eta)  # (M,)
+
+    levels = np.arange(int((e_max - e_min) / step + 1e-9) + 1)
+    start_energy = e_min if params.initial_soc is None else params.initial_soc * params.capacity
+    start = int(round((start_energy - e_min) / step))
+
+    if load is not None:
+        load = np.broadcast_to(np.asarray(load, dtype=np.float64), batch + (slots,)).reshape(-1, slots)
+        shave = load / max(float(np.abs(load).max()), 1e-9)  # 0..1 weight of each slot's load
+    tie_break = TIE_BREAK * np.abs(grid_per_move)
+
+    grid = np.empty((days, slots))
+    soc = np.empty((days, slots + 1))
+    feasible = np.empty(days, dtype=bool)
+    with metrics.timer("dispatch_stage_seconds", stage="solve"):
+        # Chunks of days keep the (days, levels, moves) working set in cache
+        for first in range(0, days, DISPATCH_CHUNK_DAYS):
+            part = slice(first, first + DISPATCH_CHUNK_DAYS)
+            n = len(prices[part])
+            value = np.broadcast_to(np.where(levels >= start, 0.0, np.inf), (n, len(levels)))
+            choice = np.empty((slots, n, len(levels)), dtype=np.int16)
+            for t in range(slots - 1, -1, -1):
+                move_cost = prices[part, t, None] * grid_per_move + tie_break               # (n, M)
+                if load is not None:
+                    move_cost = move_cost + TIE_BREAK * shave[part, t, None] * grid_per_move
+                    if not allow_export:
+                        exported = -grid_per_move > np.maximum(load[part, t, None], 0) * dt + 1e-9
+                        move_cost = np.where(exported, np.inf, move_cost)
+                # next[b, k, j] = value[b, k + moves[j]], inf off the grid
+                padded = np.pad(value, ((0, 0), (down, up)), constant_values=np.inf)
+                total = sliding_window_view(padded, len(moves), axis=1) + move_cost[:, None, :]  # (n, K, M)
+                choice[t] = total.argmin(axis=-1)
+                value = np.take_along_axis(total, choice[t][..., None].astype(np.intp), axis=-1)[..., 0]
+            feasible[part] = np.isfinite(value[:, start])
+
+            # Forward pass: follow the stored decisions from the starting level
+            level = np.full(n, start)
+            rows = np.arange(n)
+            soc[part, 0] = level
+            for t in range(slots):
+                move = choice[t, rows, level]
+                grid[part, t] = grid_per_move[move]
+                level = level + moves[move]
+                soc[part, t + 1] = level
+
+    if not feasible.all():
+        raise ValueError("No feasible dispatch for some days (check the battery limits)")
+    soc = (e_min + soc * step) / params.capacity
+    return {
+        "grid": grid.reshape(batch + (slots,)),
+        "soc": soc.reshape(batch + (slots + 1,)),
+        "cost": (prices * grid).sum(axis=-1).reshape(batch),
+    }
+
+def best_windows(weight, lengths, tie_break):
+    """Start slot of each row's `lengths`-slot window with the largest total weight (prefix sums).
+
+    weight, tie_break: (B, slots); lengths: (B,) ints. Ties go to the larger
+    tie_break total, then to the earliest start.
+    """
+    days, slots = weight.shape
+    score = weight + TIE_BREAK * tie_break
+    csum = np.concatenate([np.zeros((days, 1)), np.cumsum(score, axis=1)], axis=1)
+    starts = np.arange(slots)
+    ends = starts + lengths[:, None]                                               # (B, slots)
+    sums = np.take_along_axis(csum, np.minimum(ends, slots), axis=1) - csum[:, :slots]
+    sums = np.where(ends <= slots, sums, -np.inf)
+    return sums.argmax(axis=1)
+
+def plan_windows(grid, prices=None):
+    """(..., slots) per-slot plan -> (..., 4) [charge_start, charge_duration, discharge_start, discharge_duration] hours.
+
+    The ESP32 runs one charge and one discharge window a day at full power.
+    Each window is as long as the number of slots the plan charges (or
+    discharges) in, and placed where it covers the most planned energy;
+    with `prices`, equal cover goes to the cheaper (or dearer) window. A day
+    without charging or discharging gets duration 0.
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    slots = grid.shape[-1]
+    flat = grid.reshape(-1, slots)
+    prices = np.zeros_like(flat) if prices is None else np.broadcast_to(np.asarray(prices, dtype=np.float64), grid.shape).reshape(-1, slots)
+    charge, discharge = np.maximum(flat, 0), np.maximum(-flat, 0)
+    charge_length = (charge > 1e-9).sum(axis=1)
+    discharge_length = (discharge > 1e-9).sum(axis=1)
+    charge_start = np.where(charge_length > 0, best_windows(charge, charge_length, -prices), 0)
+    discharge_start = np.where(discharge_length > 0, best_windows(discharge, discharge_length, prices), 0)
+    windows = np.stack([charge_start, charge_length, discharge_start, discharge_length], axis=-1) * 24.0 / slots
+    return windows.reshape(grid.shape[:-1] + (4,))
+
+def optimal_schedule(prices, load=None, params=None, allow_export=DISPATCH_ALLOW_EXPORT):
+    """One day's optimal plan as the (start, duration, start, duration) schedule the controllers take."""
+    plan = optimize_dispatch(prices, load, params, allow_export)
+    return tuple(as_hours(v) for v in plan_windows(plan["grid"], prices))
+
+def main():
+    import time
+    from battery_sim import simulate
+    from tariff_engine import TariffEngine, TARIFF_PLAN
+
+    engine = TariffEngine.from_config()
+    parser = argparse.ArgumentParser(description="Cost-minimal battery dispatch by dynamic programming")
+    parser.add_argument("--days", type=int, default=10000, help="Random site-days solved in one batch")
+    parser.add_argument("--plan", choices=engine.names, help="Tariff plan whose price vector is used "
+                        "(default: TARIFF_PLAN, else the first configured plan)")
+    args = parser.parse_args()
+
+    if args.plan is None and os.getenv('TARIFF_PLAN') and TARIFF_PLAN not in engine.index:
+        parser.error(f"unknown TARIFF_PLAN '{TARIFF_PLAN}' (choose from {', '.join(engine.names)})")
+    plan = engine.plans[engine.index.get(args.plan or TARIFF_PLAN, 0)]
+    rng = np.random.default_rng(0)
+    load = rng.uniform(5, 15, (args.days, plan.slots)) + 10 * plan.prices / plan.prices.max()
+
+    started = time.perf_counter()
+    result = optimize_dispatch(plan.prices, load)
+    elapsed = time.perf_counter() - started
+    windows = plan_windows(result["grid"], plan.prices)
+    print(f"⚡ {args.days} site-day(s) in {elapsed:.2f}s ({args.days / elapsed:,.0f}/s) under '{plan.name}'")
+
+    # How much of the exact optimum the single-window command keeps
+    dispatched = simulate(load, windows)
+    window_delta = (dispatched["optimized"] - load) @ engine.slot_prices[engine.index[plan.name]]
+    print(f"   optimal battery saving {-result['cost'].mean():.2f}/day, "
+          f"as start,duration windows {-window_delta.mean():.2f}/day; "
+          f"day 0 command: {','.join(f'{as_hours(v):g}' for v in windows[0])}")
+
+if __name__ == '__main__':
+    main()
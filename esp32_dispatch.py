@@ -0,0 +1,150 @@
+import asyncio
+import os
+import threading
+import time
+import metrics
+
+# ----------------- Dispatcher Configuration -----------------
+DISPATCH_TIMEOUT = float(os.getenv('DISPATCH_TIMEOUT', 5))            # Seconds per connect / reply
+DISPATCH_RETRIES = int(os.getenv('DISPATCH_RETRIES', 2))              # Extra attempts after the first
+DISPATCH_BACKOFF = float(os.getenv('DISPATCH_BACKOFF', 0.5))          # First retry delay, doubled each time
+DISPATCH_MAX_CONCURRENCY = int(os.getenv('DISPATCH_MAX_CONCURRENCY', 512))
+
+ACK = "ACK"
+
+class ControllerConnection:
+    """A kept-alive TCP connection to one ESP32 controller."""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()  # One command in flight per controller
+
+    def is_open(self):
+        return self.writer is not None and not self.writer.is_closing() and not self.reader.at_eof()
+
+    async def open(self, host, port, timeout):
+        self.close()
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+class Esp32Dispatcher:
+    """Fans schedule commands out to many controllers in parallel.
+
+    Connections are pooled per controller and reused while the controller
+    keeps them open. The current firmware closes the socket after its ACK,
+    so the next command then reconnects. Every command waits for a reply
+    line: "ACK" confirms it. Any other reply (e.g. "ERROR") is a rejection
+    and is not retried. Timeouts and socket errors are retried with
+    exponential backoff. The dispatcher owns a background event loop, so the
+    pool survives between calls from synchronous code.
+    """
+
+    def __init__(self, timeout=DISPATCH_TIMEOUT, retries=DISPATCH_RETRIES, backoff=DISPATCH_BACKOFF):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._connections = {}
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+
+    # ----------------- Event Loop -----------------
+    def _ensure_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="esp32-dispatch", daemon=True)
+            self._thread.start()
+        return self._loop
+
+    # ----------------- Async API -----------------
+    async def send(self, device, command):
+        """Send one command line to (host, port) and wait for its reply."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(DISPATCH_MAX_CONCURRENCY)
+        host, port = device
+        conn = self._connections.setdefault(device, ControllerConnection())
+        payload = command if command.endswith("\n") else command + "\n"
+        started = time.perf_counter()
+        error = None
+
+        async with conn.lock, self._semaphore:
+            for attempt in range(1, self.retries + 2):
+                try:
+                    if not conn.is_open():
+                        await conn.open(host, port, self.timeout)
+                    conn.writer.write(payload.encode())
+                    await conn.writer.drain()
+                    line = await asyncio.wait_for(conn.reader.readline(), self.timeout)
+                    if not line:
+                        raise ConnectionError("connection closed before reply")
+                    response = line.decode(errors="replace").strip()
+                    metrics.observe("esp32_command_seconds", time.perf_counter() - started,
+                                    outcome="ack" if response == ACK else "rejected")
+                    metrics.inc("esp32_attempts_total", attempt)
+                    return {
+                        "device": device,
+                        "ok": response == ACK,
+                        "response": response,
+                        "attempts": attempt,
+                        "seconds": time.perf_counter() - started,
+                    }
+                except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+                    conn.close()
+                    error = str(e) or type(e).__name__
+                    if attempt <= self.retries:
+                        await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+        metrics.observe("esp32_command_seconds", time.perf_counter() - started, outcome="unreachable")
+        metrics.inc("esp32_attempts_total", self.retries + 1)
+        return {
+            "device": device,
+            "ok": False,
+            "response": None,
+            "error": error,
+            "attempts": self.retries + 1,
+            "seconds": time.perf_counter() - started,
+        }
+
+    async def dispatch_async(self, commands):
+        """{(host, port): command} -> {(host, port): result}, all controllers at once."""
+        results = await asyncio.gather(*(self.send(device, command) for device, command in commands.items()))
+        return {result["device"]: result for result in results}
+
+    # ----------------- Sync API -----------------
+    def dispatch(self, commands):
+        """Blocking wrapper around dispatch_async() for the scheduler scripts."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self.dispatch_async(commands), loop).result()
+
+    def close(self):
+        if self._loop is None:
+            return
+
+        async def close_all():
+            for conn in self._connections.values():
+                conn.close()
+
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = self._thread = None
+        self._semaphore = None
+        self._connections = {}
+
+def summarize(results):
+    """One-line summary of which controllers confirmed."""
+    confirmed = [r for r in results.values() if r["ok"]]
+    rejected = [r for r in results.values() if r["response"] is not None and not r["ok"]]
+    unreachable = [r for r in results.values() if r["response"] is None]
+    slowest = max((r["seconds"] for r in results.values()), default=0)
+    summary = f"{len(confirmed)}/{len(results)} controller(s) confirmed, slowest {slowest:.2f}s"
+    if rejected:
+        summary += f"; rejected: {', '.join(f'{h}:{p}' for h, p in (r['device'] for r in rejected))}"
+    if unreachable:
+        summary += f"; unreachable: {', '.join(f'{h}:{p}' for h, p in (r['device'] for r in unreachable))}"
+    return summary
@@ -0,0 +1,120 @@
+import json
+import math
+import os
+import threading
+import time
+import numpy as np
+
+# ----------------- Forecaster Configuration -----------------
+FORECAST_STATE_PATH = os.getenv('FORECAST_STATE_PATH', 'load_forecast.json')
+FORECAST_ALPHA = float(os.getenv('FORECAST_ALPHA', 0.1))        # Weight of the newest day per hour (~1/alpha days of memory)
+FORECAST_MIN_DAYS = int(os.getenv('FORECAST_MIN_DAYS', 3))      # Observations per hour before the forecast is usable
+FORECAST_Z = 1.96                                               # 95% interval
+
+class HourlyForecaster:
+    """Streaming per-hour load forecast: exponentially weighted mean and variance.
+
+    Each reading updates its hour's mean and variance in O(1). The state is
+    three arrays of `hours` floats, however long the history gets. Until an
+    hour has seen 1/alpha readings its weight is 1/n, so early forecasts are
+    plain running means rather than biased towards the first day.
+    """
+
+    def __init__(self, hours=24, alpha=FORECAST_ALPHA):
+        self.hours = hours
+        self.alpha = alpha
+        # Plain lists: per-element float math on them is several times faster than on NumPy arrays
+        self.mean = [0.0] * hours
+        self.var = [0.0] * hours
+        self.count = [0] * hours
+        self.updated = None
+        self._lock = threading.Lock()
+
+    def update(self, hour, value):
+        """Fold one reading for `hour` (0..hours-1) into the state; NaN/inf readings are ignored."""
+        if not math.isfinite(value):
+            return
+        with self._lock:
+            n = self.count[hour] + 1
+            weight = max(self.alpha, 1.0 / n)
+            diff = value - self.mean[hour]
+            step = weight * diff
+            self.mean[hour] += step
+            self.var[hour] = (1 - weight) * (self.var[hour] + diff * step)
+            self.count[hour] = n
+            self.updated = time.time()
+
+    def update_day(self, values):
+        """Fold a whole day of readings (one per hour)."""
+        for hour, value in enumerate(values[:self.hours]):
+            self.update(hour, float(value))
+
+    @classmethod
+    def from_history(cls, rows, hours=24, alpha=FORECAST_ALPHA):
+        """Seed from a (days x hours) matrix in chronological order, e.g. HistoryStore.ordered()."""
+        forecaster = cls(hours, alpha)
+        for row in rows:
+            forecaster.update_day(row)
+        return forecaster
+
+    def ready(self, min_days=FORECAST_MIN_DAYS):
+        return min(self.count) >= min_days
+
+    @property
+    def observations(self):
+        return sum(self.count)
+
+    def forecast(self, z=FORECAST_Z):
+        """Next-day forecast: {"mean", "std", "lower", "upper", "count"} lists of `hours` values."""
+        with self._lock:
+            mean, std, count = np.array(self.mean), np.sqrt(self.var), list(self.count)
+        return {
+            "mean": mean.tolist(),
+            "std": std.tolist(),
+            "lower": (mean - z * std).tolist(),
+            "upper": (mean + z * std).tolist(),
+            "count": count,
+        }
+
+    # ----------------- Persistence -----------------
+    def to_dict(self):
+        with self._lock:
+            return {
+                "hours": self.hours,
+                "alpha": self.alpha,
+                "mean": list(self.mean),
+                "var": list(self.var),
+                "count": list(self.count),
+                "updated": self.updated,
+            }
+
+    @classmethod
+    def from_dict(cls, state):
+        forecaster = cls(state["hours"], state["alpha"])
+        forecaster.mean = [float(v) for v in state["mean"]]
+        forecaster.var = [float(v) for v in state["var"]]
+        forecaster.count = [int(v) for v in state["count"]]
+        forecaster.updated = state.get("updated")
+        return forecaster
+
+    def save(self, path=FORECAST_STATE_PATH):
+        """Atomically replace the state file (a few hundred bytes)."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=FORECAST_STATE_PATH):
+        """Forecaster saved at `path`, or None if there is no usable state file."""
+        try:
+            with open(path, 'r') as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(path):
+                print(f"⚠️ Ignoring unreadable forecast state {path}: {e}", flush=True)
+            return None
+
+def format_forecast(forecast):
+    """Compact one-line rendering: hour:mean±std."""
+    return " ".join(f"{hour}:{mean:.1f}±{std:.1f}" for hour, (mean, std) in enumerate(zip(forecast["mean"], forecast["std"])))
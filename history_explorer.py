@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------- History Explorer Configuration -----------------
+HISTORY_PATH = 'Optimized History'
+SUMMARY_PATH = 'Optimized Summary'        # {zoom}/{bucket}/{Day_N}: per-day scalar metrics
+AGGREGATES_PATH = 'Optimized Aggregates'  # {zoom}/{bucket}: min/mean/max of those metrics
+HISTORY_CACHE_DAYS = int(os.getenv('HISTORY_CACHE_DAYS', 1000))    # LRU size for full day records
+HISTORY_FETCH_WORKERS = int(os.getenv('HISTORY_FETCH_WORKERS', 8))
+HISTORY_KEYS_TTL = float(os.getenv('HISTORY_KEYS_TTL', 60))        # Seconds a key listing / zoom level is reused
+
+ZOOM_DAYS = {"week": 7, "month": 30, "year": 365}  # Simulated days per bucket
+METRICS = ("savings", "cost_with_battery", "cost_without_battery", "energy", "peak")
+
+def day_number(day_key):
+    return int(str(day_key).split('_')[-1])
+
+def bucket_key(zoom, day):
+    """Bucket holding `day` at a zoom level, e.g. ('week', 9) -> 'Week_2'."""
+    return f"{zoom.capitalize()}_{(day - 1) // ZOOM_DAYS[zoom] + 1}"
+
+def day_summary(result):
+    """Compact scalar metrics for one `Optimized History` entry."""
+    consumption = result.get("power_consumption") or [0]
+    slot_hours = 24 / len(consumption) if len(consumption) > 1 else 1  # Readings are power per slot
+    return {
+        "savings": float(result.get("savings", 0)),
+        "cost_with_battery": float(result.get("cost_with_battery", 0)),
+        "cost_without_battery": float(result.get("cost_without_battery", 0)),
+        "energy": float(sum(consumption) * slot_hours),
+        "peak": float(max(consumption)),
+    }
+
+def bucket_stats(summaries):
+    """min/mean/max of every metric over a bucket's {Day_N: summary} map."""
+    days = sorted(summaries, key=day_number)
+    stats = {"days": len(days), "first_day": day_number(days[0]), "last_day": day_number(days[-1])}
+    for metric in METRICS:
+        values = [summaries[day][metric] for day in days]
+        stats[metric] = {"min": min(values), "mean": sum(values) / len(values), "max": max(values)}
+    return stats
+
+def aggregate_writes(results, read, cache=None):
+    """Multi-path writes that fold new day results into the summary and aggregate nodes.
+
+    results: {Day_N: Optimized History entry}
+    read:    callable(path) -> stored value, used once per touched bucket
+    cache:   optional {summary path: {Day_N: summary}} kept by the caller across
+             calls; touched buckets are read from it first and updated in it,
+             so a bucket whose last writes are still queued is not read stale
+    Day summaries are keyed by day, so re-processing a day replaces it rather
+    than counting it twice.
+    """
+    writes = {}
+    folded = {}
+    for zoom in ZOOM_DAYS:
+        touched = {}
+        for day_key, result in results.items():
+            touched.setdefault(bucket_key(zoom, day_number(day_key)), {})[day_key] = day_summary(result)
+        for bucket, new_summaries in touched.items():
+            path = f"{SUMMARY_PATH}/{zoom}/{bucket}"
+            if cache is not None and path in cache:
+                summaries = dict(cache[path])
+            else:
+                summaries = dict(read(path) or {})
+            summaries.update(new_summaries)
+            folded[path] = summaries
+            for day_key, summary in new_summaries.items():
+                writes[f"{path}/{day_key}"] = summary
+            writes[f"{AGGREGATES_PATH}/{zoom}/{bucket}"] = bucket_stats(summaries)
+    if cache is not None:
+        # Only once every bucket folded cleanly; re-inserted so an OrderedDict cache stays in LRU order
+        for path, summaries in folded.items():
+            cache.pop(path, None)
+            cache[path] = summaries
+    return writes
+
+class HistoryExplorer:
+    """Lazy, paginated reader over `Optimized History` for the dashboard.
+
+    The day list comes from a shallow (keys only) read. Full day records are
+    fetched a page at a time and kept in an LRU. Week/month/year views read
+    only the precomputed `Optimized Aggregates` buckets, never raw days.
+    """
+
+    def __init__(self, reference, cache_days=HISTORY_CACHE_DAYS):
+        self.reference = reference  # Callable path -> Firebase reference (e.g. storage.reference)
+        self.cache_days = cache_days
+        self._lock = threading.Lock()
+        self._days = OrderedDict()  # LRU: Day_N -> record
+        self._keys = (0, [])        # (fetched at, day numbers newest first)
+        self._zooms = {}            # zoom -> (fetched at, buckets)
+        self._pool = ThreadPoolExecutor(max_workers=HISTORY_FETCH_WORKERS)
+
+    def day_numbers(self):
+        """All stored day numbers, newest first."""
+        fetched_at, numbers = self._keys
+        if time.time() - fetched_at > HISTORY_KEYS_TTL:
+            keys = self.reference(HISTORY_PATH).get(shallow=True) or {}
+            numbers = sorted((day_number(key) for key in keys), reverse=True)
+            self._keys = (time.time(), numbers)
+        return numbers
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self.day_numbers()) // page_size))
+
+    def get_days(self, numbers):
+        """Records for the given day numbers, served from the LRU where possible."""
+        keys = [f"Day_{n}" for n in numbers]
+        with self._lock:
+            missing = [key for key in keys if key not in self._days]
+        fetched = self._pool.map(lambda key: self.reference(f"{HISTORY_PATH}/{key}").get(), missing)
+
+        with self._lock:
+            for key, record in zip(missing, fetched):
+                if record is not None:
+                    self._days[key] = record
+            records = {}
+            for key in keys:
+                if key in self._days:
+                    self._days.move_to_end(key)
+                    records[key] = self._days[key]
+            while len(self._days) > self.cache_days:
+                self._days.popitem(last=False)
+        return records
+
+    def page(self, index, page_size=30):
+        """One page of days (page 0 = newest), oldest first within the page."""
+        numbers = self.day_numbers()[index * page_size:(index + 1) * page_size]
+        records = self.get_days(numbers)
+        return [(key, records[key]) for key in sorted(records, key=day_number)]
+
+    def zoom(self, level):
+        """Precomputed buckets for 'week', 'month' or 'year', oldest first."""
+        if level not in ZOOM_DAYS:
+            raise ValueError(f"Unknown zoom level '{level}'")
+        fetched_at, buckets = self._zooms.get(level, (0, []))
+        if time.time() - fetched_at > HISTORY_KEYS_TTL:
+            data = self.reference(f"{AGGREGATES_PATH}/{level}").get() or {}
+            buckets = sorted(data.items(), key=lambda item: day_number(item[0]))
+            self._zooms[level] = (time.time(), buckets)
+        return buckets
@@ -0,0 +1,167 @@
+import csv
+import mmap
+import os
+import numpy as np
+from resolution import slot_columns
+
+# ----------------- File Layout -----------------
+# [header (64 bytes)] [day index: capacity x int64] [readings: capacity x columns x float32]
+MAGIC = b'SGHS'
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('columns', '<u4'),
+    ('capacity', '<u4'),
+    ('count', '<u8'),  # Total days ever appended (slot = count % capacity)
+])
+
+def default_store_path(csv_path):
+    """Binary store that sits next to the CSV file, e.g. data.csv -> data.bin."""
+    return os.path.splitext(csv_path)[0] + '.bin'
+
+def parse_reading(value):
+    """Convert a raw reading to float; anything non-numeric becomes NaN."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def parse_day_number(day_key):
+    """'Day_12' -> 12."""
+    return int(str(day_key).split('_')[-1])
+
+class HistoryStore:
+    """Fixed-width float32 ring buffer of daily readings in a memory-mapped file.
+
+    Appends are O(1): one row write plus a header update. Once `capacity`
+    days have been stored the oldest row is overwritten.
+    """
+
+    def __init__(self, path, capacity, columns):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self._create(path, capacity, columns)
+
+        self._file = open(path, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._mm, offset=0)
+
+        if bytes(self._header['magic']) != MAGIC or int(self._header['version']) != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a history store (bad magic/version)")
+        if int(self._header['columns']) != columns or int(self._header['capacity']) != capacity:
+            found = (int(self._header['capacity']), int(self._header['columns']))
+            self.close()
+            raise ValueError(f"{path} has shape {found}, expected {(capacity, columns)}")
+
+        self.capacity = capacity
+        self.columns = columns
+        index_offset = HEADER_SIZE
+        data_offset = index_offset + capacity * 8
+        self._index = np.ndarray((capacity,), dtype='<i8', buffer=self._mm, offset=index_offset)
+        self._data = np.ndarray((capacity, columns), dtype='<f4', buffer=self._mm, offset=data_offset)
+
+    @staticmethod
+    def _create(path, capacity, columns):
+        header = np.zeros((), dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['columns'] = columns
+        header['capacity'] = capacity
+        size = HEADER_SIZE + capacity * 8 + capacity * columns * 4
+        with open(path, 'wb') as f:
+            f.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+            f.truncate(size)
+
+    def __len__(self):
+        return min(int(self._header['count']), self.capacity)
+
+    @property
+    def total_days(self):
+        """Number of days ever appended, including ones rotated out of the buffer."""
+        return int(self._header['count'])
+
+    @property
+    def last_day(self):
+        """Day number of the newest row, or 0 when the store is empty."""
+        count = int(self._header['count'])
+        if count == 0:
+            return 0
+        return int(self._index[(count - 1) % self.capacity])
+
+    def append(self, day, values):
+        """Write one day into the next ring slot."""
+        row = np.asarray(values, dtype=np.float32)
+        if row.shape != (self.columns,):
+            raise ValueError(f"Expected {self.columns} readings, got {row.shape}")
+        count = int(self._header['count'])
+        slot = count % self.capacity
+        self._data[slot] = row
+        self._index[slot] = day
+        # Publish the row only after its data is in place
+        self._header['count'] = count + 1
+
+    def values(self):
+        """Zero-copy view of all stored rows (ring order, not chronological once wrapped)."""
+        return self._data[:len(self)]
+
+    def days(self):
+        """Zero-copy view of the day numbers matching `values()`."""
+        return self._index[:len(self)]
+
+    def ordered(self):
+        """(days, values) in chronological order; copies only when the ring has wrapped."""
+        count = int(self._header['count'])
+        if count <= self.capacity:
+            return self._index[:count], self._data[:count]
+        head = count % self.capacity
+        order = np.r_[head:self.capacity, 0:head]
+        return self._index[order], self._data[order]
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._header = self._index = self._data = None
+        if getattr(self, '_mm', None) is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # Views handed out by values()/days() are still alive; GC will unmap
+            self._mm = None
+        if getattr(self, '_file', None) is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ----------------- CSV Compatibility -----------------
+def export_csv(store, csv_path):
+    """Write the store to the legacy `Day,Hour_0..Hour_N` CSV layout (`Slot_i` columns below hourly)."""
+    days, values = store.ordered()
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Day'] + slot_columns(store.columns))
+        for day, row in zip(days, values):
+            writer.writerow([f'Day_{int(day)}'] + ['' if np.isnan(v) else f'{v:g}' for v in row])
+
+def import_csv(store, csv_path):
+    """Append every row of a legacy CSV file to the store. Returns the number of rows read."""
+    imported = 0
+    with open(csv_path, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Skip header
+        for row in reader:
+            if not row:
+                continue
+            readings = [parse_reading(v) for v in row[1:store.columns + 1]]
+            readings += [np.nan] * (store.columns - len(readings))
+            store.append(parse_day_number(row[0]), readings)
+            imported += 1
+    return imported
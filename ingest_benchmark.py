@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+from wire_protocol import encode_frame
+
+# ----------------- Benchmark Configuration -----------------
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Real-Time Data Server for Smart Grid.py')
+BENCH_PORT = int(os.getenv('BENCH_PORT', 5600))
+BENCH_OUTPUT = os.getenv('BENCH_OUTPUT', 'ingest_benchmark.json')
+
+# Named load profiles; any command-line option overrides the profile value
+SCENARIOS = {
+    "steady":      {"clients": 1000, "rate": 1.0, "jitter": 0.1, "mode": "persistent", "payload": "plain"},
+    "per-reading": {"clients": 500,  "rate": 0.5, "jitter": 0.2, "mode": "per-reading", "payload": "plain"},
+    "bursty":      {"clients": 1000, "rate": 2.0, "jitter": 0.9, "mode": "persistent", "payload": "plain"},
+    "hostile":     {"clients": 1000, "rate": 1.0, "jitter": 0.2, "mode": "persistent", "payload": "mixed",
+                    "slow_fraction": 0.1, "drop_rate": 0.02},
+    "framed":      {"clients": 1000, "rate": 1.0, "jitter": 0.1, "mode": "per-reading", "payload": "framed",
+                    "batch": 8},
+}
+DEFAULTS = {"slow_fraction": 0.0, "slow_delay": 0.05, "drop_rate": 0.0, "batch": 1}
+PAYLOAD_SHAPES = ("plain", "crlf", "padded", "framed")
+
+# Lower is worse for these metrics, higher is worse for the rest
+HIGHER_IS_BETTER = {"persisted_per_s"}
+REGRESSION_METRICS = ("persisted_per_s", "latency_p99_ms", "server_cpu_percent", "server_peak_rss_mb",
+                      "startup_p50_s")
+
+# ----------------- Firebase Stand-in -----------------
+def install_firebase_standin(log_path, latency=0.0):
+    """Register a fake `firebase_admin` that appends every write to a JSON-lines log.
+
+    Each line is {"t": wall-clock time of the write, "paths": {path: value}},
+    so the harness can match persisted readings back to their send times.
+    `latency` (seconds) is slept inside every write to mimic the network.
+    """
+    log = open(log_path, 'a', buffering=1)
+    lock = threading.Lock()
+
+    class Reference:
+        def __init__(self, path='/'):
+            self.path = path.strip('/')
+
+        def child(self, key):
+            return Reference(f"{self.path}/{key}")
+
+        def get(self, shallow=False):
+            return None
+
+        def set(self, value):
+            self._write({self.path: value})
+
+        def update(self, values):
+            prefix = f"{self.path}/" if self.path else ''
+            self._write({prefix + path: value for path, value in values.items()})
+
+        def _write(self, paths):
+            if latency:
+                time.sleep(latency)
+            with lock:
+                log.write(json.dumps({"t": time.time(), "paths": paths}) + "\n")
+
+    firebase_admin = types.ModuleType('firebase_admin')
+    credentials = types.ModuleType('firebase_admin.credentials')
+    db = types.ModuleType('firebase_admin.db')
+    credentials.Certificate = lambda path: None
+    firebase_admin._apps = {}
+    firebase_admin.initialize_app = lambda *args, **kwargs: firebase_admin._apps.setdefault('[DEFAULT]', True)
+    db.reference = Reference
+    firebase_admin.credentials, firebase_admin.db = credentials, db
+    sys.modules.update({'firebase_admin': firebase_admin,
+                        'firebase_admin.credentials': credentials,
+                        'firebase_admin.db': db})
+
+def serve_with_standin(log_path, latency):
+    """Run the real data server against the stand-in (the benchmark's server subprocess)."""
+    install_firebase_standin(log_path, latency)
+    spec = importlib.util.spec_from_file_location('data_server', SERVER_SCRIPT)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    server.main()
+
+# ----------------- Process Metrics -----------------
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def process_usage(pid):
+    """(cpu seconds, RSS MB, peak RSS MB) of a live process, read from /proc."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    memory = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                memory[key] = int(value.split()[0]) / 1024
+    return cpu, memory.get('VmRSS', 0.0), memory.get('VmHWM', 0.0)
+
+def raise_fd_limit():
+    """Thousands of sockets need more than the usual 1024 descriptors."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+# ----------------- Sensor Clients -----------------
+def client_address(index):
+    """Distinct loopback source address per client, so the server sees separate devices."""
+    return f"127.{1 + index // 62500}.{index // 250 % 250}.{index % 250 + 1}"
+
+def frame(payloads, shape, rng, device_id):
+    """Wire bytes for a batch of reading strings: one binary frame, or one text line each."""
+    if shape == "mixed":
+        shape = rng.choice(PAYLOAD_SHAPES)
+    if shape == "framed":
+        # float64 so the tag digits survive; real sensors would send float32
+        return encode_frame([float(p) for p in payloads], device_id, dtype='d')
+    if shape == "crlf":
+        text = "".join(f"{p}\r\n" for p in payloads)
+    elif shape == "padded":
+        text = "".join(f"  {p} \t\n" for p in payloads)
+    else:
+        text = "".join(f"{p}\n" for p in payloads)
+    return text.encode()
+
+class LoadStats:
+    def __init__(self):
+        self.sent = {}          # reading value -> wall-clock time its message was fully written
+        self.errors = 0
+        self.dropped = 0
+        self.connections = 0
+
+async def sensor_client(index, config, port, deadline, stats, sequence):
+    """One simulated ESP32: sends `batch` tagged readings every batch/rate seconds until `deadline`.
+
+    Every payload is a plausible wattage whose low-order digits carry a unique
+    sequence number, so each reading can be found again in the persisted data.
+    """
+    rng = random.Random(config["seed"] * 1_000_003 + index)
+    slow = rng.random() < config["slow_fraction"]
+    interval = config["batch"] / config["rate"]
+    local_addr = (client_address(index), 0)
+    writer = None
+
+    await asyncio.sleep(rng.uniform(0, interval))  # Spread connection start-up
+    while time.time() < deadline:
+        try:
+            if writer is None:
+                _, writer = await asyncio.open_connection('127.0.0.1', port, local_addr=local_addr)
+                stats.connections += 1
+            payloads = [f"{rng.uniform(0, 500):.2f}{next(sequence):08d}" for _ in range(config["batch"])]
+            line = frame(payloads, config["payload"], rng, f"sensor-{index}")
+
+            if rng.random() < config["drop_rate"]:
+                # Misbehaving sensor: half a line, then the connection vanishes
+                writer.write(line[:len(line) // 2])
+                await writer.drain()
+                writer.transport.abort()
+                writer = None
+                stats.dropped += 1
+            else:
+                if slow:
+                    for i in range(len(line)):
+                        writer.write(line[i:i + 1])
+                        await writer.drain()
+                        await asyncio.sleep(config["slow_delay"])
+                else:
+                    writer.write(line)
+                    await writer.drain()
+                sent_at = time.time()
+                for payload in payloads:
+                    stats.sent[float(payload)] = sent_at
+                if config["mode"] == "per-reading":
+                    writer.close()
+                    writer = None
+        except (OSError, asyncio.IncompleteReadError):
+            stats.errors += 1
+            if writer is not None:
+                writer.transport.abort()
+            writer = None
+        await asyncio.sleep(max(0.0, interval * (1 + rng.uniform(-config["jitter"], config["jitter"]))))
+
+    if writer is not None:
+        writer.close()
+
+async def generate_load(config, port, duration):
+    stats = LoadStats()
+    deadline = time.time() + duration
+    sequence = itertools.count()
+    await asyncio.gather(*(sensor_client(i, config, port, deadline, stats, sequence)
+                           for i in range(config["clients"])))
+    return stats
+
+# ----------------- Benchmark Run -----------------
+def wait_for_port(port, proc, timeout=30, interval=0.2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited during start-up (code {proc.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(interval)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+def start_server(args, workdir, log_path):
+    """Launch the data server (with the Firebase stand-in) on args.port, storing its files in `workdir`."""
+    env = dict(os.environ,
+               SERVER_PORT=str(args.port),
+               STORAGE_BACKEND='firebase',  # Persistence is measured at the stand-in
+               CSV_FILE_PATH=os.path.join(workdir, 'sensor_data.csv'),
+               HISTORY_STORE_PATH=os.path.join(workdir, 'sensor_data.bin'),
+               SENSOR_UPLOAD_WAL_PATH=os.path.join(workdir, 'sensor_upload.wal'),
+               FORECAST_STATE_PATH=os.path.join(workdir, 'load_forecast.json'))
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', log_path,
+                             '--firebase-latency', str(args.firebase_latency)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def measure_startup(args):
+    """Time-to-first-accept over args.startup fresh launches of the data server."""
+    timings = []
+    for _ in range(args.startup):
+        workdir = tempfile.mkdtemp(prefix='ingest-bench-')
+        log_path = os.path.join(workdir, 'firebase.jsonl')
+        launched = time.perf_counter()
+        proc = start_server(args, workdir, log_path)
+        try:
+            wait_for_port(args.port, proc, interval=0.005)
+            timings.append(time.perf_counter() - launched)
+        finally:
+            stop_server(proc)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "scenario": "startup",
+        "runs": len(timings),
+        "startup_p50_s": float(np.percentile(timings, 50)),
+        "startup_max_s": max(timings),
+    }
+
+def read_persisted(log_path):
+    """[(write time, readings dict)] for every `sensor_data/Day_N` write in the stand-in log."""
+    days = []
+    with open(log_path) as f:
+        for line in f:
+            entry = json.loads(line)
+            for path, value in entry["paths"].items():
+                if path.startswith('sensor_data/') and isinstance(value, dict):
+                    days.append((entry["t"], value))
+    return days
+
+def wait_until_idle(log_path, timeout, quiet=1.0):
+    """Wait (up to `timeout`) until the stand-in log has stopped growing for `quiet` seconds."""
+    deadline = time.time() + timeout
+    size, changed = -1, time.time()
+    while time.time() < deadline:
+        current = os.path.getsize(log_path)
+        if current != size:
+            size, changed = current, time.time()
+        elif time.time() - changed >= quiet:
+            return
+        time.sleep(0.1)
+
+def run_scenario(name, config, args):
+    """Start a fresh server, drive it with `config` for args.duration seconds, and measure it."""
+    workdir = tempfile.mkdtemp(prefix='ingest-bench-')
+    log_path = os.path.join(workdir, 'firebase.jsonl')
+    open(log_path, 'w').close()
+    proc = start_server(args, workdir, log_path)
+    try:
+        wait_for_port(args.port, proc)
+        print(f"⏱️ {name}: {config['clients']} clients at {config['rate']}/s for {args.duration:.0f}s...", flush=True)
+
+        # Sample server CPU over the steady window only (after warm-up)
+        samples = {}
+        def sample():
+            time.sleep(args.warmup)
+            samples["start"] = (time.time(), process_usage(proc.pid))
+            time.sleep(max(0.0, args.duration - args.warmup))
+            samples["end"] = (time.time(), process_usage(proc.pid))
+        sampler = threading.Thread(target=sample, daemon=True)
+        load_started = time.time()
+        sampler.start()
+        stats = asyncio.run(generate_load(config, args.port, args.duration))
+        load_ended = time.time()
+        sampler.join()
+
+        wait_until_idle(log_path, args.drain)
+        _, final_rss, peak_rss = process_usage(proc.pid)
+    finally:
+        stop_server(proc)
+
+    # Match persisted days back to send times: a day's latency runs from the
+    # reading that completed it to the moment its Firebase write landed.
+    # Steady throughput only counts readings that were also sent after warm-up.
+    steady_from = load_started + args.warmup
+    latencies, persisted, persisted_steady, untracked = [], 0, 0, 0
+    persisted_values = set()
+    persisted_days = read_persisted(log_path)
+    shutil.rmtree(workdir, ignore_errors=True)
+    for written_at, readings in persisted_days:
+        values = [readings[key] for key in sorted(readings, key=int)]
+        persisted += len(values)
+        persisted_values.update(values)
+        for value in values:
+            sent_at = stats.sent.get(value)
+            if sent_at is None:
+                untracked += 1
+            elif sent_at >= steady_from:
+                persisted_steady += 1
+        completed_at = stats.sent.get(values[-1])
+        if completed_at is not None and completed_at >= steady_from:
+            latencies.append((written_at - completed_at) * 1000)
+
+    (t0, (cpu0, _, _)), (t1, (cpu1, _, _)) = samples["start"], samples["end"]
+    steady_seconds = max(load_ended - steady_from, 1e-9)
+    sent_steady = sum(1 for sent_at in stats.sent.values() if sent_at >= steady_from)
+    percentile = lambda q: float(np.percentile(latencies, q)) if latencies else None
+    return {
+        "scenario": name,
+        "config": config,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "readings_sent": len(stats.sent),
+        "readings_persisted": persisted,
+        "untracked_persisted": untracked,   # e.g. half lines from dropped connections
+        "readings_lost": sum(1 for value in stats.sent if value not in persisted_values),  # Incl. an unfinished last day
+        "sent_per_s": sent_steady / steady_seconds,
+        "persisted_per_s": persisted_steady / steady_seconds,
+        "latency_samples": len(latencies),
+        "latency_p50_ms": percentile(50),
+        "latency_p99_ms": percentile(99),
+        "latency_max_ms": max(latencies) if latencies else None,
+        "server_cpu_percent": 100 * (cpu1 - cpu0) / max(t1 - t0, 1e-9),
+        "server_rss_mb": final_rss,
+        "server_peak_rss_mb": peak_rss,
+        "client_connections": stats.connections,
+        "client_errors": stats.errors,
+        "dropped_connections": stats.dropped,
+    }
+
+def compare(results, baseline, tolerance):
+    """Regressions of each scenario against a previous results file, as printable strings."""
+    previous = {result["scenario"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if metric in HIGHER_IS_BETTER else (new - old) / old
+            if change > tolerance:
+                regressions.append(f"{result['scenario']}.{metric}: {old:.1f} -> {new:.1f} ({change:+.0%} worse)")
+    return regressions
+
+def scenario_config(name, args):
+    config = dict(DEFAULTS, **SCENARIOS[name], seed=args.seed)
+    for key in ("clients", "rate", "jitter", "mode", "payload", "batch", "slow_fraction", "slow_delay", "drop_rate"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    return config
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest benchmark for the real-time data server.")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS) + ['all'],
+                        help="Load profile to run (repeatable, default: steady)")
+    parser.add_argument('--clients', type=int, help="Simulated sensors")
+    parser.add_argument('--rate', type=float, help="Readings per second per sensor")
+    parser.add_argument('--jitter', type=float, help="Fractional jitter on the reporting interval (0-1)")
+    parser.add_argument('--mode', choices=['persistent', 'per-reading'],
+                        help="Keep one connection open, or reconnect for every reading like the stock firmware")
+    parser.add_argument('--payload', choices=PAYLOAD_SHAPES + ('mixed',),
+                        help="Text line shape, or binary frames (wire_protocol.py)")
+    parser.add_argument('--batch', type=int, help="Readings per message (one frame, or consecutive lines)")
+    parser.add_argument('--slow-fraction', type=float, help="Share of sensors that dribble one byte at a time")
+    parser.add_argument('--slow-delay', type=float, help="Seconds between bytes for slow sensors")
+    parser.add_argument('--drop-rate', type=float, help="Chance per reading of dropping the connection mid-line")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of load per scenario")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds excluded from rates, latency and CPU")
+    parser.add_argument('--drain', type=float, default=15, help="Max seconds to wait for uploads after the load stops")
+    parser.add_argument('--firebase-latency', type=float, default=0.0, help="Seconds added to every stand-in write")
+    parser.add_argument('--port', type=int, default=BENCH_PORT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=BENCH_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument('--baseline', help="Previous results file; exit non-zero on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown vs. the baseline")
+    parser.add_argument('--startup', type=int, default=0, metavar='RUNS',
+                        help="Also measure time-to-first-accept over RUNS fresh server launches")
+    parser.add_argument('--serve', metavar='LOG', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_with_standin(args.serve, args.firebase_latency)
+        return
+
+    raise_fd_limit()
+    names = args.scenario or ([] if args.startup else ['steady'])
+    if 'all' in names:
+        names = list(SCENARIOS)
+
+    results = []
+    if args.startup:
+        result = measure_startup(args)
+        results.append(result)
+        print(f"⏱️ startup: first accept after {result['startup_p50_s']:.2f}s median "
+              f"({result['startup_max_s']:.2f}s max over {result['runs']} launches)", flush=True)
+    for name in names:
+        result = run_scenario(name, scenario_config(name, args), args)
+        results.append(result)
+        p50, p99 = result["latency_p50_ms"], result["latency_p99_ms"]
+        print(f"   {result['persisted_per_s']:.0f} readings/s persisted ({result['sent_per_s']:.0f}/s sent), "
+              f"p50 {p50 if p50 is None else round(p50, 1)} ms, p99 {p99 if p99 is None else round(p99, 1)} ms, "
+              f"CPU {result['server_cpu_percent']:.0f}%, peak RSS {result['server_peak_rss_mb']:.0f} MB; "
+              f"{result['readings_lost']} sent but not persisted, {result['untracked_persisted']} untracked", flush=True)
+
+    report = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against the baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ----------------- Metrics Configuration -----------------
+METRICS_LOG_PATH = os.getenv('METRICS_LOG_PATH')      # JSON-lines log of every timing / count (off if unset)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # Interface for the /metrics endpoint
+
+# Latency buckets in seconds: sub-millisecond parsing up to multi-second fits and uploads
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """Counters, gauges and histograms keyed by (name, sorted labels)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram()
+            histogram.observe(value)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (series_name, labels), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{name}{fmt(labels)} {value:g}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{fmt(labels)} {h.sum:g}")
+                    lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+_service = None
+_enabled = False
+_log = None
+_log_lock = threading.Lock()
+
+def enabled():
+    return _enabled
+
+def configure(service, port=None, log_path=METRICS_LOG_PATH):
+    """Turn instrumentation on for this process if a port or log path is configured.
+
+    port:     serve Prometheus text on http://METRICS_HOST:port/metrics
+    log_path: append one JSON line per observation
+    Returns True when metrics are being collected.
+    """
+    global _service, _enabled, _log
+    _service = service
+    if log_path:
+        _log = open(log_path, 'a', buffering=1)
+    if port:
+        start_http_server(int(port))
+    _enabled = bool(port or log_path)
+    return _enabled
+
+def _emit(kind, name, labels, value):
+    record = {"t": round(time.time(), 6), "service": _service, "kind": kind, "name": name, "value": value}
+    if labels:
+        record["labels"] = dict(labels)
+    line = json.dumps(record) + "\n"
+    with _log_lock:
+        _log.write(line)
+
+# ----------------- Recording API -----------------
+# Each call returns immediately when metrics are off, so they can stay in hot paths.
+def inc(name, value=1, **labels):
+    if not _enabled:
+        return
+    labels = tuple(sorted(labels.items()))
+    registry.inc(name, labels, value)
+    if _log is not None:
+        _emit("counter", name, labels, value)
+
+def gauge(name, value, **labels):
+    if not _enabled:
+        return
+    labels = tuple(sorted(labels.items()))
+    registry.set(name, labels, value)
+    if _log is not None:
+        _emit("gauge", name, labels, value)
+
+def observe(name, value, **labels):
+    if not _enabled:
+        return
+    labels = tuple(sorted(labels.items()))
+    registry.observe(name, labels, value)
+    if _log is not None:
+        _emit("histogram", name, labels, value)
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = dict(self.labels, error=exc_type.__name__) if exc_type else self.labels
+        observe(self.name, time.perf_counter() - self.started, **labels)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name, **labels):
+    """`with timer('stage_seconds', stage='fit'):` records the block's wall time in a histogram."""
+    return _Timer(name, labels) if _enabled else _NULL_TIMER
+
+def timed(name, **labels):
+    """Decorator form of timer()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(name, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# ----------------- HTTP Endpoint -----------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the console
+
+def start_http_server(port, host=METRICS_HOST):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,211 @@
+import asyncio
+import importlib.util
+import os
+import time
+import metrics
+import sensor_archive
+
+# ----------------- Pipeline Configuration -----------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(SCRIPT_DIR, 'Real-Time Data Server for Smart Grid.py')
+ML_SCRIPT = os.path.join(SCRIPT_DIR, 'ML-Based Load Scheduling for IoT Grid.py')
+TARIFF_SCRIPT = os.path.join(SCRIPT_DIR, 'Tariff & Load Optimizer.py')
+
+PIPELINE_METRICS_PORT = os.getenv('PIPELINE_METRICS_PORT')  # Prometheus /metrics endpoint (off if unset)
+
+# Seconds each stage may take before its dependents are skipped for this run
+STAGE_TIMEOUTS = {
+    "ingest": float(os.getenv('PIPELINE_INGEST_TIMEOUT', 30)),
+    "schedule": float(os.getenv('PIPELINE_SCHEDULE_TIMEOUT', 120)),
+    "dispatch": float(os.getenv('PIPELINE_DISPATCH_TIMEOUT', 60)),
+    "save_schedule": float(os.getenv('PIPELINE_SAVE_SCHEDULE_TIMEOUT', 30)),
+    "tariff": float(os.getenv('PIPELINE_TARIFF_TIMEOUT', 60)),
+    "publish": float(os.getenv('PIPELINE_PUBLISH_TIMEOUT', 60)),
+    "compact": float(os.getenv('PIPELINE_COMPACT_TIMEOUT', 120)),
+}
+
+class Stage:
+    """One step of the DAG: `func(days, *results of after)` run in a worker thread."""
+
+    def __init__(self, name, func, after=(), timeout=None):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.timeout = timeout if timeout is not None else STAGE_TIMEOUTS.get(name, 60)
+
+class Pipeline:
+    """Runs stages as soon as everything they depend on has finished.
+
+    Stages with no path between them run concurrently. A stage that fails
+    or exceeds its timeout marks its dependents as skipped; the rest of the
+    DAG carries on. A timed-out stage's thread cannot be interrupted, so it
+    finishes in the background and its result is discarded.
+    """
+
+    def __init__(self, stages):
+        names = set()
+        for stage in stages:
+            missing = [dep for dep in stage.after if dep not in names]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on undeclared stage(s) {missing}")
+            names.add(stage.name)
+        self.stages = list(stages)
+
+    async def run(self, days):
+        """Run the DAG once for a batch of days -> {stage: {"status", "value", "started", "finished"}}."""
+        tasks = {}
+
+        async def run_stage(stage):
+            deps = [await tasks[dep] for dep in stage.after]
+            started = time.perf_counter()
+            if any(dep["status"] != "ok" for dep in deps):
+                return {"status": "skipped", "value": None, "started": started, "finished": started}
+            try:
+                value = await asyncio.wait_for(
+                    asyncio.to_thread(stage.func, days, *(dep["value"] for dep in deps)), stage.timeout)
+                status, error = "ok", None
+            except (asyncio.TimeoutError, TimeoutError) as e:
+                # Either wait_for gave up, or the stage bounded its own wait and raised
+                value, status, error = None, "timeout", str(e) or f"exceeded {stage.timeout:g}s"
+            except Exception as e:
+                value, status, error = None, "error", str(e) or type(e).__name__
+            finished = time.perf_counter()
+            metrics.observe("pipeline_stage_seconds", finished - started, stage=stage.name, outcome=status)
+            if error:
+                print(f"⚠️ Stage '{stage.name}' {status}: {error}", flush=True)
+            return {"status": status, "value": value, "started": started, "finished": finished}
+
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+        return {name: await task for name, task in tasks.items()}
+
+# ----------------- Smart Grid Orchestrator -----------------
+def load_script(name, path):
+    """Import one of the top-level scripts (their file names are not valid module names)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Orchestrator:
+    """Data server, ML scheduler and tariff optimizer in one process, driven by completed days.
+
+    Instead of each script waking on its own 720 s clock, every day the
+    server completes runs through:
+
+        ingest -> schedule -> dispatch        (ESP32 command + ACK)
+                           -> save_schedule   ('Battery Data')
+                           -> tariff -> publish ('Optimized Data' / History upload)
+                                               -> compact (ARCHIVE_AUTO=1: old sensor_data days to the archive)
+
+    The dashboard listens on 'Battery Data' and 'Optimized Data', so the
+    save_schedule and publish writes are what refresh it. Days that complete
+    while a run is in progress are coalesced into the next run: each is
+    stored and priced, but the model is fitted once per run.
+    """
+
+    def __init__(self, server, ml, tariff):
+        self.server = server
+        self.ml = ml
+        self.tariff = tariff
+        self.runs = 0
+
+    def build(self, store_job):
+        def ingest(days):
+            for day_key, readings, _ in days:
+                store_job(day_key, readings)
+
+        def schedule(days, _):
+            planned, _ = self.ml.plan_schedule()
+            # Without clusters the tariff falls back to the stored schedule, as before
+            return planned
+
+        def dispatch(days, planned):
+            return self.ml.dispatch_schedule(planned) if planned is not None else None
+
+        def save_schedule(days, planned):
+            if planned is not None:
+                self.ml.update_firebase(*planned)
+
+        def tariff(days, planned):
+            battery_schedule = list(planned) if planned is not None else None
+            return {
+                day_key: self.tariff.process_day(day_key, list(readings.values()), battery_schedule)
+                for day_key, readings, _ in days
+            }
+
+        def publish(days, results):
+            # Bounded, so an outage does not leave a worker thread blocked in the shared executor
+            timeout = STAGE_TIMEOUTS["publish"]
+            if not self.tariff.uploads.flush(timeout):
+                raise TimeoutError(f"uploads not acknowledged within {timeout:g}s "
+                                   f"({self.tariff.uploads.pending()} still queued in the WAL)")
+            return results
+
+        def compact(days, _):
+            return self.tariff.sensor_archive.compact()
+
+        stages = [
+            Stage("ingest", ingest),
+            Stage("schedule", schedule, after=["ingest"]),
+            Stage("dispatch", dispatch, after=["schedule"]),
+            Stage("save_schedule", save_schedule, after=["schedule"]),
+            Stage("tariff", tariff, after=["schedule"]),
+            Stage("publish", publish, after=["tariff"]),
+        ]
+        if sensor_archive.ARCHIVE_AUTO:
+            stages.append(Stage("compact", compact, after=["publish"]))
+        return Pipeline(stages)
+
+    async def consume(self, queue, store_job):
+        """Take over the server's completed-day queue (passed to serve() as `day_pipeline`)."""
+        pipeline = self.build(store_job)
+        while True:
+            days = [await queue.get()]
+            while not queue.empty():
+                days.append(queue.get_nowait())
+            try:
+                self.report(days, await pipeline.run(days))
+            except Exception as e:
+                print(f"❌ Pipeline error while handling {days[0][0]}..{days[-1][0]}:", e, flush=True)
+            finally:
+                for _ in days:
+                    queue.task_done()
+
+    def report(self, days, results):
+        """Per-stage timings and day-completed -> published latency for one run."""
+        self.runs += 1
+        completed = min(completed_at for _, _, completed_at in days)
+        finished = max(result["finished"] for result in results.values())
+        latency = finished - completed
+        failed = [name for name, result in results.items() if result["status"] != "ok"]
+
+        metrics.observe("pipeline_latency_seconds", latency, outcome="error" if failed else "ok")
+        metrics.inc("pipeline_days_total", len(days))
+        stages = ", ".join(
+            f"{name} {result['finished'] - result['started']:.2f}s" if result["status"] == "ok" else f"{name} {result['status']}"
+            for name, result in results.items()
+        )
+        label = days[0][0] if len(days) == 1 else f"{days[0][0]}..{days[-1][0]}"
+        print(f"⏱️ {label}: end-to-end {latency:.2f}s ({stages})", flush=True)
+
+    def close(self):
+        self.tariff.uploads.stop(timeout=None)
+        self.ml.dispatcher.close()
+
+def main():
+    server = load_script('data_server', SERVER_SCRIPT)
+    ml = load_script('ml_scheduler', ML_SCRIPT)
+    tariff = load_script('tariff_optimizer', TARIFF_SCRIPT)
+    metrics.configure("pipeline", PIPELINE_METRICS_PORT)
+
+    orchestrator = Orchestrator(server, ml, tariff)
+    try:
+        asyncio.run(server.serve(day_pipeline=orchestrator.consume))
+    except KeyboardInterrupt:
+        print("🛑 Pipeline stopped.")
+    finally:
+        orchestrator.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+
+# ----------------- Resolution Configuration -----------------
+# One reading per slot. 60 keeps the original 24 hourly columns; 15 gives 96, 1 gives 1440.
+# Coarser slots are rejected: the dashboard and the ESP32 work in (at least) hourly steps.
+SLOT_MINUTES = int(os.getenv('SLOT_MINUTES', 60))
+if SLOT_MINUTES <= 0 or SLOT_MINUTES > 60 or 1440 % SLOT_MINUTES:
+    raise ValueError(f"SLOT_MINUTES={SLOT_MINUTES} must be at most 60 and divide a day (1440 minutes)")
+
+READINGS_PER_DAY = 1440 // SLOT_MINUTES
+SLOT_HOURS = SLOT_MINUTES / 60     # Length of one slot in hours (energy = power x SLOT_HOURS)
+HOURLY_SLOTS = 24
+
+def slot_columns(slots=READINGS_PER_DAY):
+    """CSV column names: the legacy Hour_0..Hour_23 at hourly resolution, otherwise Slot_0..Slot_{n-1}."""
+    prefix = 'Hour' if slots == HOURLY_SLOTS else 'Slot'
+    return [f'{prefix}_{i}' for i in range(slots)]
+
+def as_hours(value):
+    """Hours as an int when whole (so hourly schedules look as before), else a float."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def slot_to_hours(slot, slots=READINGS_PER_DAY):
+    """Slot index -> hour of day."""
+    return as_hours(slot * 24 / slots)
+
+def hours_to_slots(hours, slots=READINGS_PER_DAY):
+    """Window length in hours -> whole slots."""
+    count = hours * slots / 24
+    if not float(count).is_integer():
+        raise ValueError(f"{hours} h is not a whole number of {24 * 60 // slots}-minute slots")
+    return int(count)
+
+def downsample(values, slots=HOURLY_SLOTS):
+    """Average (..., n) readings into (..., slots) coarser buckets, ignoring NaN gaps.
+
+    Returns `values` unchanged when it is already at (or coarser than) `slots`
+    or when n is not a multiple of it. A bucket with no readings stays NaN.
+    """
+    values = np.asarray(values)
+    n = values.shape[-1]
+    if n <= slots or n % slots:
+        return values
+    blocks = values.reshape(values.shape[:-1] + (slots, n // slots))
+    observed = ~np.isnan(blocks)
+    counts = observed.sum(axis=-1)
+    totals = np.where(observed, blocks, 0).sum(axis=-1, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+def window_sums(values, width):
+    """Sum of every `width`-slot window along the last axis via prefix sums: (..., n) -> (..., n - width + 1)."""
+    values = np.asarray(values, dtype=np.float64)
+    csum = np.cumsum(values, axis=-1)
+    csum = np.concatenate([np.zeros(values.shape[:-1] + (1,)), csum], axis=-1)
+    return csum[..., width:] - csum[..., :-width]
+
+def best_window(profile, hours, lowest=True):
+    """Start hour of the `hours`-long window with the lowest (or highest) total in a one-day profile."""
+    slots = len(profile)
+    sums = window_sums(profile, hours_to_slots(hours, slots))
+    start = np.argmin(sums) if lowest else np.argmax(sums)
+    return slot_to_hours(int(start), slots)
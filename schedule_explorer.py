@@ -0,0 +1,163 @@
+import argparse
+import os
+import numpy as np
+from battery_sim import BatteryParams, simulate
+from tariff_engine import TariffEngine
+import metrics
+
+# ----------------- Explorer Configuration -----------------
+EXPLORER_MAX_HOURS = int(os.getenv('EXPLORER_MAX_HOURS', 8))              # Longest charge/discharge window tried
+EXPLORER_DAYS = int(os.getenv('EXPLORER_DAYS', 7))                        # Recent days each schedule is scored on
+EXPLORER_CHUNK_CELLS = int(os.getenv('EXPLORER_CHUNK_CELLS', 4_000_000))  # day x schedule x slot values per pass
+
+def candidate_windows(max_hours=EXPLORER_MAX_HOURS, step=1):
+    """(W, 2) [start, duration] in hours: every window of 1..max_hours that fits inside the day.
+
+    Windows running past midnight are left out: the battery model cuts them
+    at the end of the day, so they would duplicate a shorter window.
+    """
+    durations = np.arange(step, max_hours + step / 2, step)
+    return np.array([(start, duration) for duration in durations
+                     for start in np.arange(0, 24 - duration + step / 2, step)])
+
+def candidate_schedules(max_hours=EXPLORER_MAX_HOURS, step=1):
+    """(S, 4) [charge_start, charge_duration, discharge_start, discharge_duration]: every window pair."""
+    windows = candidate_windows(max_hours, step)
+    charge, discharge = np.meshgrid(np.arange(len(windows)), np.arange(len(windows)), indexing='ij')
+    return np.concatenate([windows[charge.ravel()], windows[discharge.ravel()]], axis=1)
+
+def unique_rows(values, decimals=9):
+    """(unique rows, inverse) of a 2-D array, comparing rows as raw bytes after rounding."""
+    rounded = np.ascontiguousarray(np.round(values, decimals) + 0.0)  # + 0.0 folds -0.0 into 0.0
+    keys = rounded.view(np.dtype((np.void, rounded.dtype.itemsize * rounded.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return values[first], inverse.ravel()
+
+def pareto_front(cost, gain):
+    """Indices of the points no other point beats on both lower `cost` and higher `gain`, by ascending cost."""
+    order = np.lexsort((-gain, cost))
+    best_before = np.concatenate([[-np.inf], np.maximum.accumulate(gain[order])[:-1]])
+    return order[gain[order] > best_before]
+
+def explore(load, schedules=None, engine=None, params=None, current=None, max_hours=EXPLORER_MAX_HOURS):
+    """Score every candidate battery schedule on every day under every tariff plan.
+
+    load:      (days, slots) consumption
+    schedules: (S, 4) candidates, by default every window pair up to `max_hours`
+    current:   optional [cs, cd, ds, dd] schedule reported alongside for comparison
+
+    The battery model lets the battery export (as the tariff optimizer does),
+    so its grid draw depends on the schedule alone: each schedule is simulated
+    once on an empty load. Many schedules dispatch identically (a window
+    longer than the battery needs to fill or empty), so only the distinct
+    (U, slots) deltas are broadcast against the days, in chunks of
+    EXPLORER_CHUNK_CELLS. Costs are plain battery dispatch, without the
+    optimizer's display clipping and smoothing.
+
+    Returns a dict:
+      schedules      (S, 4)
+      plans          plan names
+      cost           (S, plans)  mean daily cost with the schedule
+      peak           (S,)        mean daily peak with the schedule
+      baseline_cost  (plans,)    mean daily cost without a battery
+      baseline_peak  float
+      frontier       {plan: indices into schedules}: cost / peak-reduction Pareto front, cheapest first
+      current        {"cost": (plans,), "peak": float} when `current` was given
+    """
+    load = np.atleast_2d(np.asarray(load, dtype=np.float64))
+    slots = load.shape[-1]
+    engine = engine or TariffEngine.from_config(slots=slots)
+    params = params or BatteryParams()
+    schedules = candidate_schedules(max_hours) if schedules is None else np.atleast_2d(np.asarray(schedules, dtype=np.float64))
+    if current is not None:
+        schedules = np.concatenate([np.asarray(current, dtype=np.float64)[None], schedules])
+
+    with metrics.timer("explorer_stage_seconds", stage="simulate"):
+        delta = simulate(np.zeros(slots), schedules, params)["optimized"]     # (S, slots)
+        delta, profile = unique_rows(delta)                                   # (U, slots), (S,)
+
+    with metrics.timer("explorer_stage_seconds", stage="score"):
+        cost = np.zeros((len(delta), len(engine.names)))
+        peak = np.zeros(len(delta))
+        chunk = max(1, EXPLORER_CHUNK_CELLS // (len(delta) * slots * len(engine.names)))
+        for first in range(0, len(load), chunk):
+            days = load[first:first + chunk, None, :] + delta[None]            # (days, U, slots)
+            cost += engine.costs(days).sum(axis=0)
+            peak += days.max(axis=-1).sum(axis=0)
+        cost = cost[profile] / len(load)
+        peak = peak[profile] / len(load)
+
+    result = {
+        "plans": list(engine.names),
+        "baseline_cost": engine.costs(load).mean(axis=0),
+        "baseline_peak": float(load.max(axis=-1).mean()),
+    }
+    if current is not None:
+        result["current"] = {"cost": cost[0], "peak": float(peak[0])}
+        schedules, cost, peak = schedules[1:], cost[1:], peak[1:]
+    result.update(schedules=schedules, cost=cost, peak=peak)
+    # Rounded so float noise between equivalent schedules does not add frontier points
+    gain = np.round(result["baseline_peak"] - peak, 6)
+    result["frontier"] = {
+        plan: pareto_front(np.round(cost[:, p], 6), gain)
+        for p, plan in enumerate(result["plans"])
+    }
+    return result
+
+def frontier_rows(result, plan=None):
+    """The Pareto front of one plan (default: the first) as display rows."""
+    plan = plan or result["plans"][0]
+    p = result["plans"].index(plan)
+    baseline = result["baseline_cost"][p]
+    return [
+        {
+            "charge_start": float(result["schedules"][i, 0]),
+            "charge_duration": float(result["schedules"][i, 1]),
+            "discharge_start": float(result["schedules"][i, 2]),
+            "discharge_duration": float(result["schedules"][i, 3]),
+            "cost": float(result["cost"][i, p]),
+            "savings": float(baseline - result["cost"][i, p]),
+            "peak_reduction": float(result["baseline_peak"] - result["peak"][i]),
+        }
+        for i in result["frontier"][plan]
+    ]
+
+def main():
+    import time
+    from dotenv import load_dotenv
+    from history_explorer import HistoryExplorer
+    from storage import open_storage
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Cost / peak-reduction trade-offs of every battery schedule")
+    parser.add_argument("--days", type=int, default=EXPLORER_DAYS, help="Most recent Optimized History days to score on")
+    parser.add_argument("--max-hours", type=int, default=EXPLORER_MAX_HOURS, help="Longest window tried")
+    parser.add_argument("--plan", help="Tariff plan to show (default: the first configured plan)")
+    args = parser.parse_args()
+
+    storage = open_storage(os.getenv('FIREBASE_CREDENTIALS_PATH_UNAIS'), os.getenv('FIREBASE_DATABASE_URL'))
+    days = HistoryExplorer(storage.reference).page(0, args.days)
+    load = [record["power_consumption"] for _, record in days if record.get("power_consumption")]
+    if not load:
+        print("⚠️ No Optimized History days to explore yet.")
+        return
+    battery = storage.get("Battery Data") or {}
+    current = [battery.get(key, 0) for key in
+               ("best_charge_start", "best_charge_duration", "best_discharge_start", "best_discharge_duration")]
+
+    started = time.perf_counter()
+    result = explore(load, current=current, max_hours=args.max_hours)
+    elapsed = time.perf_counter() - started
+    plan = args.plan or result["plans"][0]
+    p = result["plans"].index(plan)
+    print(f"🔀 {len(result['schedules'])} schedules x {len(load)} day(s) x {len(result['plans'])} plan(s) "
+          f"in {elapsed * 1000:.0f} ms; Pareto front for '{plan}':")
+    print(f"   current {current}: cost {result['current']['cost'][p]:.2f}, "
+          f"peak reduction {result['baseline_peak'] - result['current']['peak']:.2f}")
+    for row in frontier_rows(result, plan):
+        print(f"   charge {row['charge_start']:g}+{row['charge_duration']:g}h, "
+              f"discharge {row['discharge_start']:g}+{row['discharge_duration']:g}h: "
+              f"cost {row['cost']:.2f} (saves {row['savings']:.2f}), peak reduction {row['peak_reduction']:.2f}")
+
+if __name__ == '__main__':
+    main()
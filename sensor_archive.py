@@ -0,0 +1,225 @@
+import argparse
+import base64
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from history_explorer import ZOOM_DAYS, bucket_key
+from storage import in_range, key_number
+import metrics
+
+# ----------------- Archive Configuration -----------------
+SENSOR_PATH = 'sensor_data'
+ARCHIVE_PATH = 'sensor_archive'              # {Week_N | Month_N}: compressed block (ARCHIVE_TARGET=node)
+ARCHIVE_INDEX_PATH = 'sensor_archive_index'  # {Week_N | Month_N}: {"first", "last", "days", "bytes", "file", "version"}
+ARCHIVE_HORIZON_DAYS = int(os.getenv('ARCHIVE_HORIZON_DAYS', 90))  # Newest days kept in `sensor_data`
+ARCHIVE_BLOCK = os.getenv('ARCHIVE_BLOCK', 'week')                 # week | month
+ARCHIVE_TARGET = os.getenv('ARCHIVE_TARGET', 'node')               # node | files
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'sensor_archive')           # Block files for ARCHIVE_TARGET=files
+ARCHIVE_AUTO = os.getenv('ARCHIVE_AUTO', '0') == '1'               # Compact after every pipeline run
+ARCHIVE_CACHE_BLOCKS = 8                                           # Decoded blocks kept for range reads
+
+BLOCKS = ('week', 'month')
+TARGETS = ('node', 'files')
+
+def encode_block(days):
+    """{Day_N: readings} -> zlib-compressed JSON bytes."""
+    return zlib.compress(json.dumps(days, separators=(',', ':')).encode('utf-8'), 9)
+
+def decode_block(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def block_span(block, day):
+    """First and last day number of the `block` bucket holding `day`."""
+    size = ZOOM_DAYS[block]
+    first = (day - 1) // size * size + 1
+    return first, first + size - 1
+
+class SensorArchive:
+    """Cold storage for `sensor_data`: old days rolled up into per-week or per-month blocks.
+
+    `compact()` moves every day older than the horizon out of the hot
+    `sensor_data` node into one compressed block per week (or month), stored
+    either under `sensor_archive` or as files in ARCHIVE_DIR. A small index
+    of archived ranges lives at `sensor_archive_index`. Only whole blocks are
+    rolled up, so the hot node holds at most horizon + one block of days.
+
+    `range()` reads through the index: archived blocks are decoded (and kept
+    in a small LRU), the hot node is only queried for days after the last
+    archived one, plus any older day a shallow key read still finds there. A
+    day that lands in `sensor_data` after its block was archived (e.g. a
+    replayed upload) wins over the archived copy until the next compaction
+    merges it into the block.
+    """
+
+    def __init__(self, storage, horizon=ARCHIVE_HORIZON_DAYS, block=ARCHIVE_BLOCK,
+                 target=ARCHIVE_TARGET, archive_dir=ARCHIVE_DIR):
+        if block not in BLOCKS:
+            raise ValueError(f"Unknown ARCHIVE_BLOCK '{block}' (expected one of {', '.join(BLOCKS)})")
+        if target not in TARGETS:
+            raise ValueError(f"Unknown ARCHIVE_TARGET '{target}' (expected one of {', '.join(TARGETS)})")
+        if horizon < 1:
+            raise ValueError("ARCHIVE_HORIZON_DAYS must be at least 1")
+        self.storage = storage
+        self.horizon = horizon
+        self.block = block
+        self.target = target
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()  # LRU: (block key, version) -> {Day_N: readings}
+
+    # ----------------- Index -----------------
+    def index(self):
+        """{block key: entry} for every archived block, oldest first."""
+        entries = self.storage.get(ARCHIVE_INDEX_PATH) or {}
+        return dict(sorted(entries.items(), key=lambda item: item[1]["first"]))
+
+    def latest_day(self):
+        """Newest stored day number, hot or archived (0 if there is none)."""
+        hot = [key_number(key) for key in self.storage.get(SENSOR_PATH, shallow=True) or {}]
+        hot = [n for n in hot if n is not None]
+        if hot:
+            return max(hot)
+        return max((entry["last"] for entry in self.index().values()), default=0)
+
+    # ----------------- Blocks -----------------
+    def _file(self, key):
+        return os.path.join(self.archive_dir, f"{key}.json.z")
+
+    def read_block(self, key, entry):
+        """Decoded {Day_N: readings} of one archived block."""
+        cache_key = (key, entry.get("version"))
+        with self._lock:
+            if cache_key in self._blocks:
+                self._blocks.move_to_end(cache_key)
+                return self._blocks[cache_key]
+        with metrics.timer("archive_stage_seconds", stage="read_block"):
+            if entry.get("file"):
+                with open(entry["file"], 'rb') as f:
+                    data = f.read()
+            else:
+                stored = self.storage.get(f"{ARCHIVE_PATH}/{key}")
+                if stored is None:
+                    raise LookupError(f"Archive block {key} is indexed but missing")
+                data = base64.b64decode(stored["data"])
+            days = decode_block(data)
+        with self._lock:
+            self._blocks[cache_key] = days
+            while len(self._blocks) > ARCHIVE_CACHE_BLOCKS:
+                self._blocks.popitem(last=False)
+        return days
+
+    def _write_block(self, key, data, writes):
+        """Store a block's bytes; returns its index entry fields. Node blocks join the `writes` update."""
+        if self.target == 'files':
+            os.makedirs(self.archive_dir, exist_ok=True)
+            path = self._file(key)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            writes[f"{ARCHIVE_PATH}/{key}"] = None  # A block moved from the node to a file
+            return {"file": path}
+        writes[f"{ARCHIVE_PATH}/{key}"] = {"encoding": "zlib+json", "data": base64.b64encode(data).decode('ascii')}
+        return {"file": None}
+
+    # ----------------- Reads -----------------
+    def range(self, start=None, end=None):
+        """{Day_N: readings} for days in [start, end] from the archive and the hot node, in day order."""
+        days = {}
+        archived_through = None
+        for key, entry in self.index().items():
+            archived_through = max(archived_through or 0, entry["last"])
+            if (end is not None and entry["first"] > end) or (start is not None and entry["last"] < start):
+                continue
+            days.update((day, value) for day, value in self.read_block(key, entry).items()
+                        if in_range(key_number(day), start, end))
+
+        # Archived days are gone from the hot node; skip probing them, but pick up days
+        # that landed there after their block was archived (found by one shallow read)
+        hot_start = start
+        if archived_through is not None:
+            hot_start = max(start or 0, archived_through + 1)
+            late = [key for key in self.storage.get(SENSOR_PATH, shallow=True) or {}
+                    if key_number(key) is not None and key_number(key) <= archived_through
+                    and in_range(key_number(key), start, end)]
+            for key in late:
+                value = self.storage.get(f"{SENSOR_PATH}/{key}")
+                if value is not None:
+                    days[key] = value
+        if end is None or hot_start is None or hot_start <= end:
+            days.update(self.storage.range(SENSOR_PATH, hot_start, end))
+        return dict(sorted(days.items(), key=lambda item: key_number(item[0])))
+
+    # ----------------- Compaction -----------------
+    def compact(self, dry_run=False):
+        """Roll every whole block older than the horizon into the archive -> {block key: days archived}."""
+        keys = self.storage.get(SENSOR_PATH, shallow=True) or {}
+        numbers = sorted(n for n in map(key_number, keys) if n is not None)
+        if not numbers:
+            return {}
+        cutoff = numbers[-1] - self.horizon  # Days up to here are cold
+
+        cold = {}
+        for day in numbers:
+            if block_span(self.block, day)[1] <= cutoff:
+                cold.setdefault(bucket_key(self.block, day), []).append(day)
+        if dry_run:
+            return {key: len(days) for key, days in cold.items()}
+
+        index = self.storage.get(ARCHIVE_INDEX_PATH) or {}
+        archived = {}
+        for key, day_numbers in cold.items():
+            with metrics.timer("archive_stage_seconds", stage="compact_block"):
+                hot = self.storage.range(SENSOR_PATH, day_numbers[0], day_numbers[-1])
+                days = dict(self.read_block(key, index[key])) if key in index else {}
+                days.update(hot)
+                days = dict(sorted(days.items(), key=lambda item: key_number(item[0])))
+
+                # Block (node target) + index + hot deletes in one multi-path update;
+                # a file block is written first, so a crash leaves the hot days in place
+                writes = {}
+                data = encode_block(days)
+                entry = self._write_block(key, data, writes)
+                first, last = block_span(self.block, day_numbers[0])
+                version = index[key].get("version", 0) + 1 if key in index else 1
+                entry.update({"first": first, "last": last, "days": len(days), "bytes": len(data), "version": version})
+                writes[f"{ARCHIVE_INDEX_PATH}/{key}"] = entry
+                writes.update({f"{SENSOR_PATH}/{day}": None for day in hot})
+                self.storage.update('/', writes)
+            index[key] = entry
+            archived[key] = len(hot)
+            metrics.inc("archive_days_total", len(hot))
+            print(f"🗄️ {key}: {len(hot)} day(s) archived ({len(days)} in block, {len(data)} bytes)", flush=True)
+        return archived
+
+def main():
+    from dotenv import load_dotenv
+    from storage import open_storage
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Roll old sensor_data days into compressed archive blocks")
+    parser.add_argument("--horizon", type=int, default=ARCHIVE_HORIZON_DAYS, help="Newest days kept in sensor_data")
+    parser.add_argument("--block", choices=BLOCKS, default=ARCHIVE_BLOCK)
+    parser.add_argument("--target", choices=TARGETS, default=ARCHIVE_TARGET)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+    parser.add_argument("--read", nargs=2, type=int, metavar=("START", "END"),
+                        help="Print the readings of Day_START..Day_END through the archive index")
+    args = parser.parse_args()
+
+    storage = open_storage(os.getenv('FIREBASE_CREDENTIALS_PATH_UNAIS'), os.getenv('FIREBASE_DATABASE_URL'))
+    archive = SensorArchive(storage, args.horizon, args.block, args.target)
+    if args.read:
+        for day_key, readings in archive.range(*args.read).items():
+            print(day_key, json.dumps(readings))
+        return
+    archived = archive.compact(dry_run=args.dry_run)
+    verb = "would be archived" if args.dry_run else "archived"
+    print(f"✅ {sum(archived.values())} day(s) in {len(archived)} block(s) {verb}; "
+          f"{len(archive.index())} block(s) indexed")
+
+if __name__ == '__main__':
+    main()
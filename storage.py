@@ -0,0 +1,544 @@
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# ----------------- Storage Configuration -----------------
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firebase')             # firebase | sqlite | memory
+STORAGE_SQLITE_PATH = os.getenv('STORAGE_SQLITE_PATH', 'smart_grid.db')
+STORAGE_POLL_INTERVAL = float(os.getenv('STORAGE_POLL_INTERVAL', 0.5))  # Seconds between SQLite change-log checks
+STORAGE_SYNC_WAL_PATH = os.getenv('STORAGE_SYNC_WAL_PATH')             # Set to mirror local writes to Firebase
+STORAGE_FETCH_WORKERS = int(os.getenv('STORAGE_FETCH_WORKERS', 16))    # Concurrent child reads for Firebase ranges
+
+INDEXED_KEY = re.compile(r'^[A-Za-z][\w ]*_(\d+)$')  # Day_12, Week_3, site_7 ...
+
+def split_path(path):
+    return [part for part in str(path).split('/') if part]
+
+def join_path(parts):
+    return '/'.join(parts)
+
+def key_number(key):
+    """'Day_12' -> 12; None for keys without a numeric suffix."""
+    match = INDEXED_KEY.match(str(key))
+    return int(match.group(1)) if match else None
+
+def in_range(number, start, end):
+    return number is not None and (start is None or number >= start) and (end is None or number <= end)
+
+def _copy(value):
+    # JSON round trip: the same types Firebase would hand back, and no shared mutable state
+    return None if value is None else json.loads(json.dumps(value))
+
+def _descend(node, parts):
+    for part in parts:
+        if isinstance(node, dict):
+            node = node.get(part)
+        elif isinstance(node, list) and part.isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        else:
+            return None
+    return node
+
+def _assign(node, parts, value):
+    """Return `node` with `value` stored at `parts` (None deletes, empty parents are pruned)."""
+    if not parts:
+        return value if value != {} else None
+    if isinstance(node, list):
+        node = {str(i): item for i, item in enumerate(node)}
+    node = dict(node) if isinstance(node, dict) else {}
+    child = _assign(node.get(parts[0]), parts[1:], value)
+    if child is None:
+        node.pop(parts[0], None)
+    else:
+        node[parts[0]] = child
+    return node or None
+
+def _shallow(value):
+    return {key: True for key in value} if isinstance(value, dict) else value
+
+class Event:
+    """Change notification, shaped like firebase_admin.db.Event."""
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+class Reference:
+    """Firebase-style handle on one path of a Storage (get/set/update/child/listen)."""
+
+    def __init__(self, storage, path='/'):
+        self.storage = storage
+        self.path = '/' + join_path(split_path(path))
+
+    @property
+    def key(self):
+        parts = split_path(self.path)
+        return parts[-1] if parts else None
+
+    def child(self, path):
+        return Reference(self.storage, f"{self.path}/{path}")
+
+    def get(self, shallow=False):
+        return self.storage.get(self.path, shallow=shallow)
+
+    def set(self, value):
+        self.storage.set(self.path, value)
+
+    def update(self, values):
+        self.storage.update(self.path, values)
+
+    def delete(self):
+        self.storage.set(self.path, None)
+
+    def listen(self, callback):
+        return self.storage.listen(self.path, callback)
+
+class Storage(ABC):
+    """Path-addressed JSON tree: the slice of the Firebase Realtime Database API the scripts use.
+
+    Paths look like 'sensor_data/Day_12'. `update()` takes multi-path writes
+    relative to its path, and `range()` returns the `Day_N`-style children of
+    a node whose number lies in [start, end].
+    """
+
+    name = 'storage'
+
+    def reference(self, path='/'):
+        return Reference(self, path)
+
+    @abstractmethod
+    def get(self, path, shallow=False):
+        ...
+
+    @abstractmethod
+    def set(self, path, value):
+        ...
+
+    @abstractmethod
+    def update(self, path, values):
+        ...
+
+    @abstractmethod
+    def range(self, path, start=None, end=None, prefix='Day'):
+        ...
+
+    @abstractmethod
+    def listen(self, path, callback):
+        ...
+
+    def close(self):
+        pass
+
+# ----------------- Firebase -----------------
+_firebase_lock = threading.Lock()
+_firebase = None
+
+def firebase_db(credentials_path=None, database_url=None):
+    """Shared firebase_admin `db` module, initializing the default app on the first call only.
+
+    firebase_admin is imported here rather than at module load, so scripts
+    start (and can be imported by tests) without the SDK or credentials
+    until something actually talks to Firebase.
+    """
+    global _firebase
+    if _firebase is None:
+        with _firebase_lock:
+            import firebase_admin
+            from firebase_admin import credentials, db
+            if not firebase_admin._apps:
+                with metrics.timer("firebase_init_seconds"):
+                    firebase_admin.initialize_app(credentials.Certificate(credentials_path), {'databaseURL': database_url})
+                print("✅ Firebase initialized successfully.")
+            _firebase = db
+    return _firebase
+
+class FirebaseStorage(Storage):
+    """The Firebase Realtime Database, through firebase_admin (connected on first use)."""
+
+    name = 'firebase'
+
+    def __init__(self, credentials_path=None, database_url=None):
+        self.credentials_path = credentials_path
+        self.database_url = database_url
+        self._pool = ThreadPoolExecutor(max_workers=STORAGE_FETCH_WORKERS)
+
+    @property
+    def _db(self):
+        return firebase_db(self.credentials_path, self.database_url)
+
+    def get(self, path, shallow=False):
+        with metrics.timer("storage_request_seconds", backend=self.name, op="get"):
+            return self._db.reference(path).get(shallow=shallow)
+
+    def set(self, path, value):
+        with metrics.timer("storage_request_seconds", backend=self.name, op="set"):
+            self._db.reference(path).set(value)
+
+    def update(self, path, values):
+        with metrics.timer("storage_request_seconds", backend=self.name, op="update"):
+            self._db.reference(path).update(values)
+
+    def range(self, path, start=None, end=None, prefix='Day'):
+        # Day_N keys are not zero-padded, so order_by_key() cannot bound them:
+        # a closed range probes the keys directly, an open one lists keys first
+        if start is not None and end is not None:
+            keys = [f"{prefix}_{n}" for n in range(start, end + 1)]
+        else:
+            listing = self.get(path, shallow=True) or {}
+            keys = sorted((key for key in listing if in_range(key_number(key), start, end)), key=key_number)
+        with metrics.timer("storage_request_seconds", backend=self.name, op="range"):
+            values = list(self._pool.map(lambda key: self._db.reference(f"{path}/{key}").get(), keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def listen(self, path, callback):
+        return self._db.reference(path).listen(callback)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+# ----------------- Local Stores -----------------
+class ListenerRegistration:
+    def __init__(self, storage, listener_id):
+        self._storage = storage
+        self._id = listener_id
+
+    def close(self):
+        self._storage._remove_listener(self._id)
+
+class LocalStorage(Storage):
+    """Shared listener dispatch and optional cloud mirroring for the local stores.
+
+    Listeners get an initial 'put' with the current value (as Firebase
+    does), then a 'put' for every write that touches their path. Callbacks
+    run on one dispatcher thread. With `mirror_to(queue)`, every local
+    write is also handed to an UploadQueue, which syncs it to the cloud in
+    the background.
+    """
+
+    def __init__(self):
+        self._listeners = {}  # id -> (path parts, callback)
+        self._listener_ids = 0
+        self._listeners_lock = threading.Lock()
+        self._events = None
+        self._mirror = None
+
+    def mirror_to(self, upload_queue):
+        self._mirror = upload_queue
+        return self
+
+    def _mirror_writes(self, writes):
+        if self._mirror is not None:
+            self._mirror.put_many(writes)
+
+    def listen(self, path, callback):
+        if self._events is None:
+            self._events = queue.Queue()
+            threading.Thread(target=self._dispatch, name=f"{self.name}-listeners", daemon=True).start()
+        with self._listeners_lock:
+            self._listener_ids += 1
+            listener_id = self._listener_ids
+            self._listeners[listener_id] = (split_path(path), callback)
+        self._events.put((callback, Event('put', '/', self.get(path))))
+        return ListenerRegistration(self, listener_id)
+
+    def _remove_listener(self, listener_id):
+        with self._listeners_lock:
+            self._listeners.pop(listener_id, None)
+
+    def _notify(self, paths):
+        """Queue events for every listener whose path overlaps one of the written paths."""
+        if self._events is None:
+            return
+        with self._listeners_lock:
+            listeners = list(self._listeners.values())
+        for written in paths:
+            written = split_path(written)
+            for parts, callback in listeners:
+                if written[:len(parts)] == parts:
+                    relative = written[len(parts):]
+                    self._events.put((callback, Event('put', '/' + join_path(relative), self.get(join_path(written)))))
+                elif parts[:len(written)] == written:
+                    self._events.put((callback, Event('put', '/', self.get(join_path(parts)))))
+
+    def _dispatch(self):
+        while True:
+            callback, event = self._events.get()
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"⚠️ Storage listener error: {e}")
+
+class MemoryStorage(LocalStorage):
+    """In-process dict tree: no persistence, for tests and single-process runs."""
+
+    name = 'memory'
+
+    def __init__(self):
+        super().__init__()
+        self._root = None
+        self._lock = threading.RLock()
+
+    def get(self, path, shallow=False):
+        with self._lock:
+            value = _descend(self._root, split_path(path))
+            return _shallow(value) if shallow else _copy(value)
+
+    def set(self, path, value):
+        self.update('/', {join_path(split_path(path)): value})
+
+    def update(self, path, values):
+        base = split_path(path)
+        written = {join_path(base + split_path(key)): value for key, value in values.items()}
+        with self._lock:
+            for key, value in written.items():
+                self._root = _assign(self._root, split_path(key), _copy(value))
+        self._mirror_writes(written)
+        self._notify(written)
+
+    def range(self, path, start=None, end=None, prefix='Day'):
+        with self._lock:
+            node = _descend(self._root, split_path(path))
+            if not isinstance(node, dict):
+                return {}
+            keys = sorted((key for key in node if in_range(key_number(key), start, end)), key=key_number)
+            return {key: _copy(node[key]) for key in keys}
+
+class SQLiteStorage(LocalStorage):
+    """Embedded SQLite store with indexed `Day_N` records.
+
+    Each record is one row holding a JSON value. A record is anchored at
+    the deepest numbered key of its path (`sensor_data/Day_12`,
+    `Optimized Summary/week/Week_2/Day_8`), or at its top-level node when
+    the path has no numbered key (`Battery Data`). Writing a dict of
+    numbered children fans out into one row per child. Rows are indexed by
+    (parent, day number), so `range()` is an index scan. Rows never nest:
+    a write below an existing row rewrites that row.
+
+    Every write also appends its path to a change log. Listeners poll the
+    log, so they also see writes made by other processes on the same file.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS nodes (
+            path   TEXT PRIMARY KEY,
+            parent TEXT NOT NULL,
+            day    INTEGER,
+            value  TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS nodes_parent_day ON nodes (parent, day);
+        CREATE TABLE IF NOT EXISTS changes (
+            seq  INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL
+        );
+    """
+    CHANGES_KEPT = 10000  # Change-log rows kept for slow listeners
+
+    def __init__(self, path=STORAGE_SQLITE_PATH, poll_interval=STORAGE_POLL_INTERVAL):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._poller = None
+        self._stop = threading.Event()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ----------------- Reads -----------------
+    def _owner(self, conn, parts):
+        """The row at `parts` or at one of its ancestors, as (row parts, value)."""
+        prefixes = [join_path(parts[:i]) for i in range(1, len(parts) + 1)]
+        if not prefixes:
+            return None
+        row = conn.execute(
+            f"SELECT path, value FROM nodes WHERE path IN ({','.join('?' * len(prefixes))})", prefixes
+        ).fetchone()
+        return (split_path(row[0]), json.loads(row[1])) if row else None
+
+    def _descendants(self, conn, parts, columns='path, value'):
+        if not parts:
+            return conn.execute(f"SELECT {columns} FROM nodes").fetchall()
+        base = join_path(parts)
+        # '/' sorts just before '0', so this is a prefix scan on the primary key
+        return conn.execute(f"SELECT {columns} FROM nodes WHERE path > ? AND path < ?",
+                            (base + '/', base + '0')).fetchall()
+
+    def _read(self, conn, parts):
+        owner = self._owner(conn, parts)
+        if owner is not None:
+            owner_parts, value = owner
+            return _descend(value, parts[len(owner_parts):])
+        tree = None
+        for path, value in self._descendants(conn, parts):
+            tree = _assign(tree, split_path(path)[len(parts):], json.loads(value))
+        return tree
+
+    @metrics.timed("storage_request_seconds", backend='sqlite', op="get")
+    def get(self, path, shallow=False):
+        conn = self._connect()
+        parts = split_path(path)
+        if shallow and self._owner(conn, parts) is None:
+            children = {split_path(row[0])[len(parts)] for row in self._descendants(conn, parts, 'path')}
+            return {key: True for key in sorted(children)} or None
+        value = self._read(conn, parts)
+        return _shallow(value) if shallow else value
+
+    @metrics.timed("storage_request_seconds", backend='sqlite', op="range")
+    def range(self, path, start=None, end=None, prefix='Day'):
+        conn = self._connect()
+        parts = split_path(path)
+        base = join_path(parts)
+        owner = self._owner(conn, parts)
+        nested = conn.execute("SELECT 1 FROM nodes WHERE parent > ? AND parent < ? LIMIT 1",
+                              (base + '/', base + '0')).fetchone() if parts else True
+        if owner is not None or nested:
+            # Children are stored inside a larger record, or spread over deeper rows
+            node = self._read(conn, parts)
+            if not isinstance(node, dict):
+                return {}
+            keys = sorted((key for key in node if in_range(key_number(key), start, end)), key=key_number)
+            return {key: node[key] for key in keys}
+        rows = conn.execute(
+            "SELECT path, value FROM nodes WHERE parent = ? AND day BETWEEN ? AND ? ORDER BY day",
+            (base, -2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end),
+        ).fetchall()
+        return {split_path(path)[-1]: json.loads(value) for path, value in rows}
+
+    # ----------------- Writes -----------------
+    @staticmethod
+    def _anchor(parts):
+        """Record path for a write: up to the deepest numbered key, else the top-level node."""
+        for i in range(len(parts) - 1, -1, -1):
+            if key_number(parts[i]) is not None:
+                return parts[:i + 1]
+        return parts[:1]
+
+    @staticmethod
+    def _rows(parts, value):
+        """Split a value into records: dicts at the root or with only numbered keys fan out."""
+        if value is None or value == {}:
+            return
+        if isinstance(value, dict) and (not parts or all(key_number(key) is not None for key in value)):
+            for key, child in value.items():
+                yield from SQLiteStorage._rows(parts + [str(key)], child)
+        else:
+            yield parts, value
+
+    def _write_tree(self, conn, parts, value):
+        base = join_path(parts)
+        if parts:
+            conn.execute("DELETE FROM nodes WHERE path = ? OR (path > ? AND path < ?)", (base, base + '/', base + '0'))
+        else:
+            conn.execute("DELETE FROM nodes")
+        conn.executemany(
+            "INSERT INTO nodes (path, parent, day, value) VALUES (?, ?, ?, ?)",
+            [(join_path(row), join_path(row[:-1]), key_number(row[-1]), json.dumps(row_value))
+             for row, row_value in self._rows(parts, value)],
+        )
+
+    def _write(self, conn, parts, value):
+        owner = self._owner(conn, parts)
+        if owner is not None and len(owner[0]) < len(parts):
+            # Inside an existing record: rewrite that record
+            owner_parts, record = owner
+            record = _assign(record, parts[len(owner_parts):], value)
+            self._write_tree(conn, owner_parts, record)
+            return
+        anchor = self._anchor(parts)
+        if len(anchor) < len(parts):
+            record = _assign(self._read(conn, anchor), parts[len(anchor):], value)
+            self._write_tree(conn, anchor, record)
+        else:
+            self._write_tree(conn, parts, value)
+
+    def set(self, path, value):
+        self.update('/', {join_path(split_path(path)): value})
+
+    @metrics.timed("storage_request_seconds", backend='sqlite', op="update")
+    def update(self, path, values):
+        base = split_path(path)
+        written = {join_path(base + split_path(key)): _copy(value) for key, value in values.items()}
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, value in written.items():
+                self._write(conn, split_path(key), value)
+            conn.executemany("INSERT INTO changes (path) VALUES (?)", [(key,) for key in written])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._mirror_writes(written)
+
+    # ----------------- Listeners -----------------
+    def listen(self, path, callback):
+        if self._poller is None:
+            self._last_change = self._connect().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            self._poller = threading.Thread(target=self._poll_changes, name="sqlite-changes", daemon=True)
+            self._poller.start()
+        return super().listen(path, callback)
+
+    def _poll_changes(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                conn = self._connect()
+                rows = conn.execute("SELECT seq, path FROM changes WHERE seq > ? ORDER BY seq",
+                                    (self._last_change,)).fetchall()
+                if not rows:
+                    continue
+                self._last_change = rows[-1][0]
+                self._notify(dict.fromkeys(path for _, path in rows))
+                conn.execute("DELETE FROM changes WHERE seq <= ?", (self._last_change - self.CHANGES_KEPT,))
+            except sqlite3.Error as e:
+                print(f"⚠️ Storage change poll failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+_local_storages = {}  # backend -> instance shared by every script loaded in this process
+_local_lock = threading.Lock()
+
+def open_storage(credentials_path=None, database_url=None, backend=None):
+    """Storage for STORAGE_BACKEND (firebase, sqlite or memory).
+
+    For the local backends, setting STORAGE_SYNC_WAL_PATH mirrors every
+    write to Firebase in the background through a durable UploadQueue.
+    Local backends are opened once per process, so scripts running together
+    (e.g. under pipeline.py) see the same data.
+    """
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == 'firebase':
+        return FirebaseStorage(credentials_path, database_url)
+    if backend not in ('sqlite', 'memory'):
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected firebase, sqlite or memory)")
+
+    with _local_lock:
+        if backend in _local_storages:
+            return _local_storages[backend]
+        storage = SQLiteStorage() if backend == 'sqlite' else MemoryStorage()
+        if STORAGE_SYNC_WAL_PATH:
+            from upload_queue import UploadQueue
+            cloud = FirebaseStorage(credentials_path, database_url)
+            storage.mirror_to(UploadQueue(STORAGE_SYNC_WAL_PATH, root_ref=cloud.reference('/')).start())
+        _local_storages[backend] = storage
+        return storage
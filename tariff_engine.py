@@ -0,0 +1,137 @@
+import json
+import os
+import numpy as np
+
+# ----------------- Tariff Configuration -----------------
+TARIFF_PLANS_PATH = os.getenv('TARIFF_PLANS_PATH')     # JSON file with a "plans" list
+TARIFF_PLAN = os.getenv('TARIFF_PLAN', 'default')      # Plan used for the live optimizer
+
+# Original time-of-use structure: peak 8 AM - 10 PM, off-peak otherwise
+DEFAULT_PLANS = [
+    {
+        "name": "default",
+        "default_rate": 0.4,  # Base tariff (applies to any hour not covered by a period)
+        "periods": [
+            {"hours": [8, 22], "rate": 1.0},   # Peak
+            {"hours": [22, 8], "rate": 0.2},   # Off-peak (wraps midnight)
+        ],
+    },
+]
+
+def hour_mask(hours, slots=24):
+    """Boolean slot mask for an [start, end) hour range; end < start wraps past midnight."""
+    start, end = hours
+    slot_hours = np.arange(slots) * 24.0 / slots
+    if start <= end:
+        return (slot_hours >= start) & (slot_hours < end)
+    return (slot_hours >= start) | (slot_hours < end)
+
+class TariffPlan:
+    """One utility plan: a per-slot energy price vector, optional tiers and an optional demand charge.
+
+    Config keys:
+      name, default_rate, periods [{"hours": [start, end], "rate": r}] -> per-slot price vector
+      tiers [{"up_to": kwh or null, "rate": r}]  -> extra price on daily energy blocks
+      demand_charge {"rate": r, "hours": [start, end]} -> r x daily peak inside the window
+    """
+
+    def __init__(self, config, slots=24):
+        self.name = config["name"]
+        self.slots = slots
+
+        prices = np.full(slots, float(config.get("default_rate", 0.0)))
+        for period in config.get("periods", []):
+            prices[hour_mask(period["hours"], slots)] = float(period["rate"])
+        self.prices = prices
+
+        self.tiers = [(t.get("up_to"), float(t["rate"])) for t in config.get("tiers", [])]
+
+        demand = config.get("demand_charge") or {}
+        self.demand_rate = float(demand.get("rate", 0.0))
+        self.demand_mask = hour_mask(demand.get("hours", [0, 24]), slots)
+
+def load_plans(path=TARIFF_PLANS_PATH, slots=24):
+    """Plans from the JSON config file, or the built-in default plan."""
+    if path:
+        with open(path, 'r') as f:
+            config = json.load(f)
+        plans = config["plans"] if isinstance(config, dict) else config
+    else:
+        plans = DEFAULT_PLANS
+    return [TariffPlan(plan, slots) for plan in plans]
+
+class TariffEngine:
+    """Prices whole consumption arrays against several plans at once.
+
+    Plans are stacked into dense arrays when the engine is built:
+    a (plans x slots) price matrix, padded (plans x tiers) block bounds and
+    rates, and per-plan demand windows. `costs()` then works on any
+    (..., slots) array, e.g. days x sites x slots, and returns (..., plans).
+    Readings are average power per slot, so energy is reading x slot length
+    (24 / slots hours); at hourly resolution the two are the same.
+    """
+
+    def __init__(self, plans):
+        if not plans:
+            raise ValueError("TariffEngine needs at least one plan")
+        slots = {plan.slots for plan in plans}
+        if len(slots) != 1:
+            raise ValueError(f"All plans must use the same number of slots, got {sorted(slots)}")
+        self.slots = slots.pop()
+        self.slot_hours = 24.0 / self.slots
+        self.plans = plans
+        self.names = [plan.name for plan in plans]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+        self.prices = np.stack([plan.prices for plan in plans])                    # (P, N)
+        self.slot_prices = self.prices * self.slot_hours                           # Price per (power x slot)
+
+        n_tiers = max((len(plan.tiers) for plan in plans), default=0)
+        self.tier_lower = np.zeros((len(plans), n_tiers))
+        self.tier_upper = np.full((len(plans), n_tiers), np.inf)
+        self.tier_rates = np.zeros((len(plans), n_tiers))
+        for p, plan in enumerate(plans):
+            lower = 0.0
+            for t, (up_to, rate) in enumerate(plan.tiers):
+                upper = np.inf if up_to is None else float(up_to)
+                self.tier_lower[p, t], self.tier_upper[p, t], self.tier_rates[p, t] = lower, upper, rate
+                lower = upper
+        self.has_tiers = n_tiers > 0
+
+        self.demand_rates = np.array([plan.demand_rate for plan in plans])         # (P,)
+        self.demand_masks = np.stack([plan.demand_mask for plan in plans])         # (P, N)
+        self.has_demand = bool(self.demand_rates.any())
+
+    @classmethod
+    def from_config(cls, path=TARIFF_PLANS_PATH, slots=24):
+        return cls(load_plans(path, slots))
+
+    def costs(self, consumption):
+        """Cost of each (..., slots) consumption row under every plan -> (..., plans)."""
+        load = np.asarray(consumption, dtype=np.float64)
+        if load.shape[-1] != self.slots:
+            raise ValueError(f"Expected {self.slots} slots, got {load.shape[-1]}")
+
+        # Time-of-use energy charge: one matrix contraction over the slot axis
+        total = load @ self.slot_prices.T
+
+        if self.has_tiers:
+            daily = load.sum(axis=-1)[..., None, None] * self.slot_hours             # (..., 1, 1) energy
+            in_block = np.clip(daily, self.tier_lower, self.tier_upper) - self.tier_lower
+            total = total + (in_block * self.tier_rates).sum(axis=-1)
+
+        if self.has_demand:
+            windowed = np.where(self.demand_masks, load[..., None, :], -np.inf)   # (..., P, N)
+            peak = np.maximum(windowed.max(axis=-1), 0)
+            total = total + peak * self.demand_rates
+
+        return total
+
+    def cost(self, consumption, plan=None):
+        """Cost under one plan (TARIFF_PLAN, or the first configured plan if that name is absent)."""
+        plan = plan or (TARIFF_PLAN if TARIFF_PLAN in self.index else self.names[0])
+        p = self.index[plan]
+        load = np.asarray(consumption, dtype=np.float64)
+        if not self.has_tiers and not self.has_demand:
+            return load @ self.slot_prices[p]
+        return self.costs(load)[..., p]
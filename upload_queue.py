@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import time
+import metrics
+
+# ----------------- Upload Queue Configuration -----------------
+MAX_BATCH_PATHS = int(os.getenv('UPLOAD_MAX_BATCH_PATHS', 500))   # Paths per multi-path update()
+INITIAL_BACKOFF = float(os.getenv('UPLOAD_INITIAL_BACKOFF', 1))   # Seconds before the first retry
+MAX_BACKOFF = float(os.getenv('UPLOAD_MAX_BACKOFF', 60))          # Cap for exponential backoff
+COMPACT_AFTER = int(os.getenv('UPLOAD_COMPACT_AFTER', 1000))      # Acked entries before rewriting the WAL
+WAL_FSYNC = os.getenv('UPLOAD_WAL_FSYNC', '0') == '1'             # fsync every append (slower, survives power loss)
+
+def _to_json(value):
+    """json.dumps fallback for NumPy scalars and arrays."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _overlaps(a, b):
+    """True if one Firebase path is an ancestor of the other (update() rejects these)."""
+    a, b = a.strip('/') + '/', b.strip('/') + '/'
+    return a != b and (a.startswith(b) or b.startswith(a))
+
+class UploadQueue:
+    """Durable, batched Firebase writer.
+
+    `put()` appends the write to a local write-ahead log and returns at once.
+    A background thread flushes pending writes as coalesced multi-path
+    `update()` calls on `root_ref`, retrying with exponential backoff.
+    Writes that were never acknowledged are replayed from the WAL on restart.
+    """
+
+    def __init__(self, wal_path, root_ref=None):
+        self.wal_path = wal_path
+        self._root_ref = root_ref
+        self._cond = threading.Condition()
+        self._pending = []      # [(seq, path, value)] in write order
+        self._next_seq = 1
+        self._acked = 0
+        self._acked_since_compact = 0
+        self._stopping = False
+        self._thread = None
+        self._replay()
+        self._wal = open(wal_path, 'a', encoding='utf-8')
+
+    # ----------------- WAL -----------------
+    def _replay(self):
+        """Rebuild the pending list from entries that were never acknowledged."""
+        if not os.path.exists(self.wal_path):
+            return
+        entries = []
+        good = 0  # Byte offset just past the last complete record
+        with open(self.wal_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Torn final line from a crash mid-write
+                if not line.endswith(b'\n'):
+                    line += b'\n'  # Complete record whose newline never made it to disk
+                good += len(line)
+                if 'ack' in record:
+                    self._acked = max(self._acked, record['ack'])
+                else:
+                    entries.append((record['seq'], record['path'], record['value']))
+        # Cut a torn tail (or finish a missing newline) so new appends start on a fresh line
+        if good != os.path.getsize(self.wal_path):
+            with open(self.wal_path, 'r+b') as f:
+                f.truncate(min(good, os.path.getsize(self.wal_path)))
+                if good > f.seek(0, os.SEEK_END):
+                    f.write(b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self._pending = [e for e in entries if e[0] > self._acked]
+        seqs = [e[0] for e in entries] + [self._acked]
+        self._next_seq = max(seqs) + 1
+        if self._pending:
+            print(f"♻️ Replaying {len(self._pending)} unacknowledged upload(s) from {self.wal_path}", flush=True)
+
+    def _append(self, record):
+        self._wal.write(json.dumps(record, default=_to_json) + '\n')
+        self._wal.flush()
+        if WAL_FSYNC:
+            os.fsync(self._wal.fileno())
+
+    def _compact(self):
+        """Rewrite the WAL with only the still-pending entries."""
+        tmp_path = self.wal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'ack': self._acked}) + '\n')
+            for seq, path, value in self._pending:
+                f.write(json.dumps({'seq': seq, 'path': path, 'value': value}, default=_to_json) + '\n')
+        self._wal.close()
+        os.replace(tmp_path, self.wal_path)
+        self._wal = open(self.wal_path, 'a', encoding='utf-8')
+        self._acked_since_compact = 0
+
+    # ----------------- Producer API -----------------
+    def put(self, path, value):
+        """Queue a write of `value` at `path` (relative to the database root)."""
+        self.put_many({path: value})
+
+    def put_many(self, writes):
+        """Queue several path -> value writes; they are flushed in the same batch when possible."""
+        with self._cond:
+            for path, value in writes.items():
+                seq = self._next_seq
+                self._next_seq += 1
+                self._append({'seq': seq, 'path': path, 'value': value})
+                self._pending.append((seq, path, value))
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def pending_writes(self, prefix):
+        """{path: value} of queued, unacknowledged writes at or below `prefix` (the latest write per path)."""
+        prefix = prefix.strip('/')
+        with self._cond:
+            return {path: value for _, path, value in self._pending
+                    if path.strip('/') == prefix or path.strip('/').startswith(prefix + '/')}
+
+    # ----------------- Worker -----------------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='upload-queue', daemon=True)
+            self._thread.start()
+        return self
+
+    def _next_batch(self):
+        """Oldest pending writes coalesced into one {path: value} update, plus the last seq covered."""
+        batch = {}
+        last_seq = self._acked
+        for seq, path, value in self._pending:
+            if path not in batch and (len(batch) >= MAX_BATCH_PATHS or any(_overlaps(path, p) for p in batch)):
+                break
+            batch[path] = value  # A later write to the same path wins
+            last_seq = seq
+        return batch, last_seq
+
+    def _run(self):
+        try:
+            self._drain()
+        finally:
+            with self._cond:
+                if self._stopping:
+                    self._wal.close()  # stop() leaves this to a worker that outlived its join
+
+    def _drain(self):
+        backoff = INITIAL_BACKOFF
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch, last_seq = self._next_batch()
+
+            queue_name = os.path.basename(self.wal_path)
+            try:
+                root = self._root_ref
+                if root is None:
+                    from firebase_admin import db
+                    root = db.reference('/')
+                with metrics.timer("upload_batch_seconds", queue=queue_name):
+                    root.update(batch)
+            except Exception as e:
+                metrics.inc("upload_failures_total", queue=queue_name)
+                print(f"❌ Firebase batch upload failed ({len(batch)} paths), retrying in {backoff:g}s:", e, flush=True)
+                with self._cond:
+                    if self._stopping:
+                        return
+                    self._cond.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            backoff = INITIAL_BACKOFF
+            with self._cond:
+                done = sum(1 for e in self._pending if e[0] <= last_seq)
+                del self._pending[:done]
+                self._acked = last_seq
+                self._append({'ack': last_seq})
+                self._acked_since_compact += done
+                if self._acked_since_compact >= COMPACT_AFTER:
+                    self._compact()
+                self._cond.notify_all()
+                metrics.gauge("upload_pending", len(self._pending), queue=queue_name)
+            metrics.inc("upload_paths_total", len(batch), queue=queue_name)
+            print(f"✅ Uploaded batch of {len(batch)} path(s) to Firebase.", flush=True)
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is acknowledged. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=5):
+        """Try to drain the queue, then stop the worker. Unsent writes stay in the WAL."""
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return  # Still inside update(); the worker closes the WAL when it exits
+        with self._cond:
+            self._wal.close()
@@ -0,0 +1,68 @@
+import struct
+import time
+from collections import namedtuple
+import numpy as np
+
+# ----------------- Frame Layout -----------------
+# header:  magic u8 (0xA5) | version u8 | flags u16 (0) | payload length u32      (little-endian)
+# v1 body: timestamp f64 (unix s) | device id length u8 | dtype u8 ('f' or 'd') | count u16
+#          | device id (utf-8) | count readings (float32 or float64)
+# 0xA5 is not ASCII, so a frame can never be mistaken for a plain-text reading
+# line; both can be mixed on one connection.
+MAGIC = 0xA5
+VERSION = 1
+HEADER = struct.Struct('<BBHI')
+BODY_V1 = struct.Struct('<dBBH')
+DTYPES = {ord('f'): np.dtype('<f4'), ord('d'): np.dtype('<f8')}
+MAX_PAYLOAD = 64 * 1024  # Bytes; larger frames are treated as a corrupt stream
+
+Frame = namedtuple('Frame', 'device_id timestamp readings size')  # size: bytes on the wire
+
+class ProtocolError(ValueError):
+    """A frame that cannot be decoded; the connection's byte stream can no longer be trusted."""
+
+def encode_frame(readings, device_id='', timestamp=None, dtype='f'):
+    """One framed batch of readings (what a sensor sends)."""
+    device = device_id.encode('utf-8')
+    values = np.asarray(readings, dtype=DTYPES[ord(dtype)])
+    body = BODY_V1.pack(time.time() if timestamp is None else timestamp, len(device), ord(dtype), len(values))
+    payload = body + device + values.tobytes()
+    return HEADER.pack(MAGIC, VERSION, 0, len(payload)) + payload
+
+def decode_payload(version, payload):
+    """Frame from a payload; readings are a zero-copy NumPy view into it."""
+    if version != 1:
+        raise ProtocolError(f"Unsupported frame version {version}")
+    if len(payload) < BODY_V1.size:
+        raise ProtocolError("Frame body too short")
+    timestamp, device_len, dtype_code, count = BODY_V1.unpack_from(payload)
+    dtype = DTYPES.get(dtype_code)
+    if dtype is None:
+        raise ProtocolError(f"Unknown reading type {dtype_code!r}")
+    offset = BODY_V1.size + device_len
+    if offset + count * dtype.itemsize != len(payload):
+        raise ProtocolError(f"Frame length does not match {count} reading(s)")
+    device_id = bytes(payload[BODY_V1.size:offset]).decode('utf-8', errors='replace')
+    return Frame(device_id, timestamp, np.frombuffer(payload, dtype, count, offset), HEADER.size + len(payload))
+
+async def read_frame(reader):
+    """Read the rest of a frame whose magic byte has already been consumed from an asyncio StreamReader.
+
+    Returns None for a well-formed frame of a version this server does not
+    understand (it is skipped, so newer sensors do not break the stream).
+    """
+    header = bytes([MAGIC]) + await reader.readexactly(HEADER.size - 1)
+    _, version, _, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame of {length} bytes exceeds {MAX_PAYLOAD}")
+    payload = await reader.readexactly(length)
+    if version > VERSION:
+        return None
+    return decode_payload(version, payload)
+
+def reading_values(readings):
+    """Decoded readings -> Python floats, without float32 noise (12.3, not 12.300000190734863)."""
+    if readings.dtype.itemsize == 4:
+        # Shortest round-trip text of each float32 gives the value the sensor meant
+        return [float(text) for text in readings.astype(str)]
+    return readings.tolist()